@@ -1,143 +1,522 @@
 import os
-import json
-import pandas as pd
+import sys
+import time
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import openai
-import firebase_admin
-from firebase_admin import credentials, firestore
+
+from index_factory import (
+    index_kind, index_metric, search_parameters, search, search_many, enable_reconstruct, reconstruct, normalize_vectors,
+)
+from metadata_store import MetadataStore, METADATA_PATH, METADATA_INDEX_PATH
+from filters import FilterIndex, parse_preferences, FILTER_META_PATH
+from bm25 import BM25Index, reciprocal_rank_scores, BM25_META_PATH
+from rerank import MMRReranker, CrossEncoderReranker, RERANK_MODES
+from query_cache import QueryCache, normalize_query, save_caches, load_caches
+from session import SessionCache
+from storage import create_storage
+from startup import StartupOrchestrator
+from encoder import create_encoder, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_DIM
+from semantic_cache import SemanticAnswerCache
+from metrics import LatencyTracker
+from context import ConversationContext, RecipeFormatter
+from quick_replies import quick_reply
+from batcher import MicroBatcher
+from write_behind import WriteBehindQueue
+from tracing import span, log
 
 # ----------------------------------------- 
 # 🔹 初始化全局變數
 # ----------------------------------------- 
 FAISS_INDEX_PATH = "recipe_faiss.index"
-METADATA_PATH = "recipe_metadata.csv"
+
+# ✅ 以 mmap 唯讀開啟索引：IVF 的 inverted lists 直接映射檔案，多個 worker 共用 page cache
+# (flat / HNSW 仍會讀進記憶體，多 worker 時靠 gunicorn preload_app 在 fork 前載入來共用)
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
+
+# ✅ 近似索引的查詢參數 (IVF 的 nprobe / HNSW 的 efSearch，flat 索引會忽略)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+# ✅ 檢索模式：vector | bm25 | hybrid (向量 + BM25 以 reciprocal rank fusion 合併)
+SEARCH_MODES = ("vector", "bm25", "hybrid")
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid").lower()
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))  # 每種檢索取幾筆候選再合併
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))  # BM25 排名的權重 (向量為 1.0)
+
+# ✅ 第二階段重新排序：none | mmr | cross_encoder (先取 RERANK_CANDIDATES 筆候選，RERANK_BUDGET_MS 毫秒內選出 top-k)
+RERANK_MODE = os.getenv("RERANK_MODE", "mmr").lower()
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "50"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# ✅ 相關性門檻：食譜和查詢的 cosine similarity 低於 MIN_SIMILARITY 時不放進 prompt (0 代表不過濾)
+# 沒有任何食譜達到門檻 (例如閒聊) 時，GPT 不帶檢索結果回答；打招呼和指令則完全不呼叫 GPT (見 quick_replies.py)
+MIN_SIMILARITY = float(os.getenv("MIN_SIMILARITY", "0.3"))
+# hybrid / bm25 模式中，包含查詢中至少 LEXICAL_MIN_COVERAGE 比例 token 的食譜視為明確的字面命中，
+# 即使 cosine 低於門檻也保留 (只靠 BM25 找到的食譜不會在融合之後被向量分數濾掉)
+LEXICAL_MIN_COVERAGE = float(os.getenv("LEXICAL_MIN_COVERAGE", "0.75"))
+
+# ✅ 併發查詢合併：QUERY_BATCH_WAIT_MS 毫秒內或湊滿 QUERY_BATCH_MAX 筆就一起 encode / search
+QUERY_BATCHING = os.getenv("QUERY_BATCHING", "0") == "1"
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "1"))
+
+# ✅ 查詢快取設定 (QUERY_CACHE_TTL 單位為秒，0 代表不過期；QUERY_CACHE_PATH 設定後會跨重啟保存)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "86400"))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+
+# ✅ 使用者 session 快取 (SESSION_CACHE_TTL 單位為秒)
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "300"))
+# 每則訊息重新讀取使用者資料，多個 worker 之間的偏好 / 對話才會一致；只有單一 worker 時可設 0 省下這次讀取
+SESSION_REVALIDATE = os.getenv("SESSION_REVALIDATE", "1") == "1"
+
+# ✅ 對話記錄 write-behind：回覆路徑只排入佇列，背景每 WRITE_BEHIND_INTERVAL_MS 批次寫入
+# (進程異常終止時最多遺失這段時間內的對話；正常關閉時會先寫入)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "1000"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "100"))
+
+# ✅ 語意回答快取 (偏好 + 查詢相似度 >= 門檻、且檢索到相同食譜時重用先前的 GPT 回答；SEMANTIC_CACHE_SIZE=0 關閉)
+#    只用於沒有對話紀錄和摘要的一輪 (追問依賴上下文，不能跨使用者共用回答)
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+# ✅ OpenAI 設定 (OPENAI_TIMEOUT 單位為秒)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "200"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # 離線壓測時指向 mock_services.py
+
+# ✅ 對話 context：每次送出的 prompt token 上限、儲存的對話 token 上限 (超過時摺疊成摘要)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "150"))
+
+# ✅ 系統提示中的食譜：全部食譜合計的 token 上限，以及每個欄位的上限 (項目數 / 每項字元數)
+RECIPE_TOKEN_BUDGET = int(os.getenv("RECIPE_TOKEN_BUDGET", "600"))
+RECIPE_MAX_INGREDIENTS = int(os.getenv("RECIPE_MAX_INGREDIENTS", "20"))
+RECIPE_MAX_STEPS = int(os.getenv("RECIPE_MAX_STEPS", "10"))
+RECIPE_MAX_ITEM_CHARS = int(os.getenv("RECIPE_MAX_ITEM_CHARS", "200"))
 
 # 全局變數
 index = None
-df = None
+scores_supported = False  # 索引可以 reconstruct 時才能計算檢索分數
+metadata = None
+filter_index = None
+bm25_index = None
+
+# 正規化查詢 → embedding；(正規化查詢, k, 搜尋參數) → top-k 行號
+embedding_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL, name="embedding")
+result_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL, name="result")
+
+# 多個線程同時查詢時合併成一次 encoder.encode / index.search
+encode_batcher = MicroBatcher(
+    lambda texts: list(encoder.encode(texts, batch_size=QUERY_BATCH_MAX)),
+    max_batch=QUERY_BATCH_MAX, max_wait_ms=QUERY_BATCH_WAIT_MS, name="encode-batcher",
+)
+search_batcher = MicroBatcher(
+    lambda requests: search_many(index, requests),
+    max_batch=QUERY_BATCH_MAX, max_wait_ms=QUERY_BATCH_WAIT_MS, name="search-batcher",
+)
+
+# (偏好, 查詢) embedding → GPT 回答
+answer_cache = SemanticAnswerCache(
+    EMBEDDING_DIM,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_size=SEMANTIC_CACHE_SIZE,
+    ttl=SEMANTIC_CACHE_TTL,
+)
 
 # ✅ 從環境變數讀取 API Keys
 openai_api_key = os.getenv("OPENAI_API_KEY")
-firebase_json = os.getenv("FIREBASE_CREDENTIALS")
 
 if not openai_api_key:
     raise ValueError("❌ OPENAI_API_KEY not found! Please set it in Render environment variables.")
 
-# ✅ 初始化 Firebase（從環境變數讀取）
-if firebase_json:
-    firebase_cred = json.loads(firebase_json)  # 解析 JSON 字串
-    if not firebase_admin._apps:  # 確保 Firebase 只初始化一次
-        cred = credentials.Certificate(firebase_cred)
-        firebase_admin.initialize_app(cred)
-else:
-    raise ValueError("❌ FIREBASE_CREDENTIALS not found! Please set it in Render environment variables.")
+# ✅ 使用者資料儲存後端 (STORAGE_BACKEND=firestore | sqlite | memory)
+storage = create_storage()
+print(f"✅ 使用 {storage.name} 儲存後端")
 
-db = firestore.client()
+# embedding 模型 (EMBEDDING_BACKEND=torch | onnx | onnx-int8，由 startup 在背景載入)
+encoder = None
 
-# 測試 Firebase 連接
-def test_firebase_connection():
-    try:
-        # 創建一個測試文檔
-        test_ref = db.collection("test").document("connection_test")
-        test_ref.set({"timestamp": firestore.SERVER_TIMESTAMP})
-        print("✅ Firebase 連接成功")
-        return True
-    except Exception as e:
-        print(f"❌ Firebase 連接失敗: {e}")
-        return False
-        
-# 啟動時測試 Firebase 連接
-test_firebase_connection()
+# 共用的 OpenAI client (第一次呼叫時建立，之後重用同一個連線池)
+openai_client = None
+_openai_client_lock = threading.Lock()
 
-# ✅ 加載 embedding 模型
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# OpenAI 延遲：第一個 token (只在串流模式) 和完整回應
+llm_first_token_latency = LatencyTracker("llm_first_token")
+llm_total_latency = LatencyTracker("llm_total")
 
 # ----------------------------------------- 
-# 🔹 RAG 初始化函數 (用於背景執行)
+# 🔹 RAG 初始化函數 (背景並行載入)
 # ----------------------------------------- 
-def initialize_rag():
-    """初始化 RAG 系統，加載預處理的 FAISS 索引和元數據"""
-    global index, df
-    
-    print("🔍 開始初始化 RAG 系統...")
-    
-    if os.path.exists(FAISS_INDEX_PATH) and os.path.exists(METADATA_PATH):
-        try:
-            print(f"✅ 找到預處理的文件，正在載入 {FAISS_INDEX_PATH} 和 {METADATA_PATH}")
-            index = faiss.read_index(FAISS_INDEX_PATH)
-            df = pd.read_csv(METADATA_PATH)
-            print(f"✅ 成功載入索引 (向量數: {index.ntotal}) 和元數據 (行數: {len(df)})")
-            return index, df
-        except Exception as e:
-            print(f"❌ 載入索引或元數據失敗: {e}")
-            raise
-    else:
+def require_file(path):
+    if not os.path.exists(path):
         files_found = os.listdir(".")
-        error_msg = f"❌ 找不到預處理文件! 目錄內容: {files_found}"
-        print(error_msg)
-        raise FileNotFoundError(error_msg)
+        raise FileNotFoundError(f"❌ 找不到預處理文件 {path}! 目錄內容: {files_found}")
 
-# ----------------------------------------- 
-# 🔹 Firestore 函數
-# ----------------------------------------- 
-def get_user_data(user_id):
-    """ 從 Firestore 獲取使用者數據 """
-    try:
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        return user_doc.to_dict() if user_doc.exists else None
-    except Exception as e:
-        print(f"❌ Firestore 獲取用戶數據錯誤: {e}")
+def load_model():
+    """加載 embedding 模型 (torch / onnxruntime 的 import 也放在背景線程，不拖慢進程啟動)"""
+    global encoder
+    encoder = create_encoder()
+    print(f"✅ Embedding 後端: {encoder.name}")
+
+def load_index():
+    """加載 FAISS 索引，並還原依賴索引的查詢快取"""
+    global index, scores_supported
+    require_file(FAISS_INDEX_PATH)
+    index = faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if FAISS_MMAP else 0)
+    print(f"✅ 成功載入索引 (類型: {index_kind(index)}, 度量: {index_metric(index)}, 向量數: {index.ntotal})")
+    scores_supported = enable_reconstruct(index)
+    if not scores_supported:
+        print("⚠️ 索引不支援 reconstruct，檢索結果沒有相似度分數 (MIN_SIMILARITY 不生效)")
+        if isinstance(reranker, MMRReranker):
+            disable_reranker()
+    restore_query_caches()
+
+def load_metadata():
+    """以 mmap 開啟元數據"""
+    global metadata
+    require_file(METADATA_PATH)
+    require_file(METADATA_INDEX_PATH)
+    metadata = MetadataStore(METADATA_PATH, METADATA_INDEX_PATH)
+    print(f"✅ 成功載入元數據 (行數: {len(metadata)})")
+
+def load_filters():
+    """以 mmap 開啟食材倒排索引和飲食標籤 (不存在時只用向量檢索，不影響就緒狀態)"""
+    global filter_index
+    if not os.path.exists(FILTER_META_PATH):
+        print(f"⚠️ 找不到 {FILTER_META_PATH}，偏好過濾停用 (執行 python filters.py 建立)")
+        return
+    filter_index = FilterIndex()
+    print(f"✅ 成功載入過濾索引 (食材 token: {len(filter_index.vocab)})")
+
+def load_bm25():
+    """以 mmap 開啟 BM25 索引 (不存在時 hybrid / bm25 模式退回向量檢索)"""
+    global bm25_index
+    if not os.path.exists(BM25_META_PATH):
+        print(f"⚠️ 找不到 {BM25_META_PATH}，只使用向量檢索 (執行 python bm25.py 建立)")
+        return
+    bm25_index = BM25Index()
+    print(f"✅ 成功載入 BM25 索引 (token 數: {len(bm25_index.vocab)})")
+
+def rerank_text(recipe):
+    return f"{recipe.title}. Ingredients: {'; '.join(recipe.ingredients)}"
+
+def create_reranker():
+    if RERANK_MODE not in RERANK_MODES:
+        print(f"⚠️ 不支援的重新排序模式: {RERANK_MODE} (可用: {', '.join(RERANK_MODES)})，不重新排序")
         return None
+    if RERANK_MODE == "mmr":
+        return MMRReranker(lambda ids: reconstruct(index, ids), lambda_=MMR_LAMBDA, budget_ms=RERANK_BUDGET_MS)
+    if RERANK_MODE == "cross_encoder":
+        return CrossEncoderReranker(
+            RERANK_MODEL, lambda ids: [rerank_text(recipe) for recipe in metadata.take(ids)],
+            budget_ms=RERANK_BUDGET_MS,
+        )
+    return None
 
-def set_user_data(user_id, data):
-    """ 更新 Firestore 中的使用者數據 """
-    try:
-        user_ref = db.collection("users").document(user_id)
-        user_ref.set(data, merge=True)
-        return True
-    except Exception as e:
-        print(f"❌ Firestore 設置用戶數據錯誤: {e}")
-        return False
+def disable_reranker():
+    global reranker
+    print(f"⚠️ 停用 {reranker.name} 重新排序，直接使用第一階段的結果")
+    reranker = None
 
-def get_user_conversation(user_id):
-    """ 獲取使用者的聊天記錄 """
+def load_reranker():
+    """載入 cross-encoder (載入失敗時停用重新排序，不影響就緒狀態)"""
     try:
-        user_ref = db.collection("conversations").document(user_id)
-        user_doc = user_ref.get()
-        return user_doc.to_dict().get("messages", []) if user_doc.exists else []
+        reranker.load()
+        print(f"✅ 成功載入 cross-encoder: {RERANK_MODEL}")
     except Exception as e:
-        print(f"❌ Firestore 獲取對話記錄錯誤: {e}")
-        return []
+        print(f"❌ cross-encoder 載入失敗: {e}")
+        disable_reranker()
+
+reranker = create_reranker()
+
+startup = StartupOrchestrator()
+startup.register("model", load_model)
+startup.register("index", load_index)
+startup.register("metadata", load_metadata)
+startup.register("filters", load_filters)
+startup.register("bm25", load_bm25)
+if isinstance(reranker, CrossEncoderReranker):
+    startup.register("reranker", load_reranker)
+
+def start_rag():
+    """開始在背景並行載入模型、索引和元數據 (立即返回，重複呼叫不會重複載入)"""
+    startup.start()
+
+def rag_ready():
+    return startup.is_ready()
+
+def rag_status():
+    """/readyz 使用的各元件載入狀態和耗時"""
+    return startup.status()
+
+def after_fork(threads=None):
+    """gunicorn post_fork：重建不能跨 fork 使用的資源 (模型和索引沿用 master 載入的 copy-on-write 頁面)
+
+    threads 限制每個 worker 的 faiss / torch / onnxruntime 計算線程數，避免多個 worker 搶同一組 CPU。
+    """
+    global encoder
+    storage.after_fork()
+    if threads:
+        faiss.omp_set_num_threads(threads)
+        os.environ["ONNX_THREADS"] = str(threads)
+    if encoder is None:
+        return
+    if encoder.name.startswith("onnx"):
+        # onnxruntime 的線程池在 fork 後不存在，需在 worker 中重新建立 session
+        encoder = create_encoder(encoder.name)
+    elif threads and "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
 
-def save_user_conversation(user_id, messages):
-    """ 存儲使用者的聊天記錄 """
+def initialize_rag(timeout=None):
+    """載入 RAG 系統並等待完成 (命令列工具使用；請求路徑請用 rag_ready)"""
+    print("🔍 開始初始化 RAG 系統...")
+    startup.wait(timeout)
+    if not rag_ready():
+        raise RuntimeError(f"❌ RAG 初始化失敗: {startup.summary()}")
+    return index, metadata
+
+# ----------------------------------------- 
+# 🔹 查詢快取
+# ----------------------------------------- 
+def cache_fingerprints():
+    """快取有效性的依據：embedding 依模型，搜尋結果依索引檔"""
+    index_stat = os.stat(FAISS_INDEX_PATH)
+    return {
+        "embedding": f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}",
+        "result": f"{index_stat.st_size}:{int(index_stat.st_mtime)}:{index.ntotal}:{RERANK_MODE}:scored:fused:coverage",
+    }
+
+def restore_query_caches():
+    """從 QUERY_CACHE_PATH 還原快取，並在程式結束時寫回"""
+    if not QUERY_CACHE_PATH:
+        return
+    caches = {"embedding": embedding_cache, "result": result_cache}
+    restored = load_caches(QUERY_CACHE_PATH, caches, cache_fingerprints())
+    print(f"✅ 還原 {restored} 筆查詢快取")
+    atexit.register(persist_query_caches)
+
+def persist_query_caches():
     try:
-        user_ref = db.collection("conversations").document(user_id)
-        user_ref.set({"messages": messages}, merge=True)
-        return True
+        caches = {"embedding": embedding_cache, "result": result_cache}
+        save_caches(QUERY_CACHE_PATH, caches, cache_fingerprints())
     except Exception as e:
-        print(f"❌ Firestore 保存對話記錄錯誤: {e}")
-        return False
+        print(f"❌ 保存查詢快取失敗: {e}")
+
+def query_cache_stats():
+    """查詢快取的命中、未命中和淘汰次數"""
+    return {"embedding": embedding_cache.stats(), "result": result_cache.stats(), "answer": answer_cache.stats()}
+
+def rerank_stats():
+    """第二階段重新排序的耗時和超過預算的次數"""
+    if reranker is None:
+        return {"mode": "none"}
+    return dict(reranker.stats(), candidates=RERANK_CANDIDATES)
+
+def batching_stats():
+    """併發查詢合併的批次數和平均批次大小"""
+    return {"enabled": QUERY_BATCHING, "encode": encode_batcher.stats(), "search": search_batcher.stats()}
+
+def encode_query(query):
+    """取得正規化查詢的 embedding (優先使用快取)
+
+    embedding 一律 L2 正規化：ip 索引的分數就是 cosine similarity，l2 索引的排序不受影響。
+    """
+    key = normalize_query(query)
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+        with span("encode"):
+            if QUERY_BATCHING:
+                embedding = encode_batcher.submit(key).reshape(1, -1)
+            else:
+                embedding = encoder.encode([key])
+            embedding = normalize_vectors(embedding)
+        embedding_cache.put(key, embedding)
+    return embedding
+
+# ----------------------------------------- 
+# 🔹 使用者資料函數 (委派給儲存後端)
+# ----------------------------------------- 
+def get_user_data(user_id):
+    """ 獲取使用者數據 """
+    with span("storage.get_user"):
+        return storage.get_user(user_id)
+
+def set_user_data(user_id, data):
+    """ 更新使用者數據 """
+    with span("storage.set_user"):
+        return storage.set_user(user_id, data)
+
+def clear_user_preferences(user_id):
+    """ 刪除使用者偏好 """
+    with span("storage.clear_preferences"):
+        return storage.clear_preferences(user_id)
+
+def get_user_messages(user_id, start=0):
+    """ 獲取使用者序號 >= start 的聊天記錄 """
+    with span("storage.get_messages"):
+        return storage.get_messages(user_id, start)
+
+def commit_conversations(writes):
+    """ 批次寫入對話更新 (新訊息 + 摘要 / 訊息計數) """
+    with span("storage.commit"):
+        return storage.commit(writes)
+
+conversation_writer = None
+if WRITE_BEHIND:
+    conversation_writer = WriteBehindQueue(
+        commit_conversations,
+        flush_interval_ms=WRITE_BEHIND_INTERVAL_MS,
+        max_batch=WRITE_BEHIND_MAX_BATCH,
+        name="conversation-writer",
+    )
+    atexit.register(conversation_writer.shutdown)  # 關閉時寫入剩餘的對話
+
+# ✅ 每則訊息只載入一次使用者資料，chatbot.py 和 RAG.py 共用
+session_cache = SessionCache(
+    load_profile=get_user_data,
+    save_profile=set_user_data,
+    clear_preferences=clear_user_preferences,
+    load_messages=get_user_messages,
+    commit=commit_conversations,
+    writer=conversation_writer,
+    max_users=SESSION_CACHE_SIZE,
+    ttl=SESSION_CACHE_TTL,
+    revalidate=SESSION_REVALIDATE,
+)
+
+def session_stats():
+    """session 快取命中率和每則訊息的 資料庫讀寫次數"""
+    return session_cache.stats()
+
+def write_behind_stats():
+    """write-behind 佇列的合併次數、批次大小和待寫入數量"""
+    if conversation_writer is None:
+        return {"enabled": False}
+    return dict(conversation_writer.stats(), enabled=True)
 
 # ----------------------------------------- 
 # 🔹 FAISS 檢索
 # ----------------------------------------- 
-def search_recipe(query, k=3):
-    """ 透過 FAISS 搜尋相似食譜 """
-    global index, df
-    
-    # 確保 index 和 df 已初始化
-    if index is None or df is None:
-        print("⚠️ FAISS 索引和元數據未初始化，嘗試初始化...")
-        initialize_rag()
+def vector_search(query, k, nprobe, ef_search, recipe_filter=None):
+    """FAISS 向量檢索，回傳 top-k 行號"""
+    query_embedding = encode_query(query)
+    with span("faiss_search"):
+        if recipe_filter:
+            return filter_index.search(index, query_embedding, k, recipe_filter, nprobe=nprobe, ef_search=ef_search)
+        if QUERY_BATCHING:
+            return search_batcher.submit((query_embedding, k, nprobe, ef_search))
+        params = search_parameters(index, nprobe=nprobe, ef_search=ef_search)
+        distances, indices = search(index, query_embedding, k, params)
+        return tuple(int(i) for i in indices[0] if i >= 0)
+
+def lexical_search(query, k, recipe_filter=None):
+    """BM25 檢索 (標題 + 食材)，回傳 top-k 行號"""
+    allowed = (lambda ids: filter_index.allowed(ids, recipe_filter)) if recipe_filter else None
+    with span("bm25_search"):
+        ids, _ = bm25_index.search(query, k, allowed=allowed)
+    return tuple(int(i) for i in ids)
+
+def score_hits(query, ids):
+    """查詢和每筆食譜的 cosine similarity
+
+    以索引中存的向量計算 (不是各檢索方式自己的距離 / BM25 分數)，所以 vector / bm25 / hybrid 的分數可以互相比較，
+    也可以用同一個 MIN_SIMILARITY 門檻。索引不支援 reconstruct 時回傳 None。
+    """
+    if not ids or not scores_supported:
+        return (None,) * len(ids)
+    vectors = normalize_vectors(reconstruct(index, ids))
+    return tuple(float(score) for score in vectors @ encode_query(query)[0])
+
+def lexical_coverage(query, ids):
+    """每筆食譜包含查詢 token 的比例 (見 BM25Index.coverage)"""
+    if not ids or bm25_index is None:
+        return (0.0,) * len(ids)
+    return tuple(float(c) for c in bm25_index.coverage(query, ids))
+
+def search_recipe(query, k=3, nprobe=None, ef_search=None, recipe_filter=None, mode=None, lexical_weight=None,
+                  min_similarity=None):
+    """ 透過 FAISS 搜尋相似食譜，回傳 Recipe 列表 (nprobe / ef_search 未指定時使用環境變數設定)
+
+    recipe_filter (RecipeFilter) 排除不符合飲食偏好的食譜，或要求包含特定食材。
+    mode 為 vector / bm25 / hybrid (預設 SEARCH_MODE)；hybrid 時 lexical_weight 調整 BM25 排名的權重。
+    RERANK_MODE 不是 none 時，再從第一階段的候選中重新排序出 k 筆 (見 rerank.py)。
+    每筆 Recipe 的 score 一律為和查詢的 cosine similarity (不是 RRF / BM25 分數)，
+    低於 min_similarity (預設 MIN_SIMILARITY) 的不回傳，所以沒有相關食譜時回傳空列表；
+    hybrid / bm25 模式中包含 LEXICAL_MIN_COVERAGE 以上查詢 token 的食譜不受門檻限制。
+    """
+    # 請求路徑上不做初始化，尚未載入完成時直接返回
+    if not rag_ready():
+        print("⚠️ RAG 尚未載入完成，略過檢索")
+        return None
     
     try:
-        query_embedding = model.encode(query, convert_to_numpy=True).reshape(1, -1)
-        distances, indices = index.search(query_embedding, k)
-        return df.iloc[indices[0]]
+        nprobe = nprobe or FAISS_NPROBE
+        ef_search = ef_search or FAISS_EF_SEARCH
+        mode = (mode or SEARCH_MODE).lower()
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"不支援的檢索模式: {mode} (可用: {', '.join(SEARCH_MODES)})")
+        if bm25_index is None:
+            mode = "vector"
+        lexical_weight = HYBRID_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+        if filter_index is None:
+            recipe_filter = None
+        cache_key = (
+            normalize_query(query), k, nprobe, ef_search, recipe_filter.key() if recipe_filter else None,
+            mode, lexical_weight if mode == "hybrid" else None,
+        )
+        hits = result_cache.get(cache_key)
+        if hits is None:
+            # 有重新排序時第一階段多取 RERANK_CANDIDATES 筆候選
+            candidates = max(k, RERANK_CANDIDATES) if reranker is not None else k
+            relevance = None  # 第一階段的排序分數 (vector 模式由 MMR 直接用 cosine)
+            if mode == "vector":
+                ids = vector_search(query, candidates, nprobe, ef_search, recipe_filter)
+            else:
+                if mode == "bm25":
+                    rankings, weights = [lexical_search(query, candidates, recipe_filter)], [1.0]
+                else:
+                    depth = max(candidates, HYBRID_CANDIDATES)
+                    rankings = [vector_search(query, depth, nprobe, ef_search, recipe_filter),
+                                lexical_search(query, depth, recipe_filter)]
+                    weights = [1.0, lexical_weight]
+                fused = reciprocal_rank_scores(rankings, weights=weights)[:candidates]
+                ids = tuple(doc_id for doc_id, _ in fused)
+                relevance = [score for _, score in fused]
+            if reranker is not None and len(ids) > k:
+                with span("rerank"):
+                    # MMR 用的查詢向量來自 embedding 快取 (vector / hybrid 模式剛 encode 過)
+                    use_vector = isinstance(reranker, MMRReranker) and relevance is None
+                    query_vector = encode_query(query) if use_vector else None
+                    ids = reranker.rerank(query, query_vector, ids, k, relevance)
+            coverage = lexical_coverage(query, ids) if mode != "vector" else (0.0,) * len(ids)
+            hits = (ids, score_hits(query, ids), coverage)
+            result_cache.put(cache_key, hits)
+
+        ids, scores, coverage = hits
+        min_similarity = MIN_SIMILARITY if min_similarity is None else min_similarity
+        recipes = []
+        for recipe, score, covered in zip(metadata.take(ids), scores, coverage):
+            if score is None or score >= min_similarity or covered >= LEXICAL_MIN_COVERAGE:
+                if score is not None and score < min_similarity:
+                    count_fast_path("lexical_kept")
+                recipe.score = score
+                recipes.append(recipe)
+        if len(recipes) < len(ids):
+            count_fast_path("filtered_hits", len(ids) - len(recipes))
+            log(f"🎯 {len(ids) - len(recipes)} 筆食譜低於相似度門檻 {min_similarity}")
+        return recipes
     except Exception as e:
         print(f"❌ FAISS 檢索錯誤: {e}")
         return None
@@ -145,91 +524,241 @@ def search_recipe(query, k=3):
 # ----------------------------------------- 
 # 🔹 GPT 整合
 # ----------------------------------------- 
-def chat_with_model(user_id, user_input):
-    """ GPT 生成回應並整合 FAISS 搜尋結果 """
-    global index, df
-    
-    print(f"📝 處理用戶 {user_id} 的輸入: {user_input}")
-    
-    # 確保 RAG 系統已初始化
-    retry_count = 0
-    while (index is None or df is None) and retry_count < 3:
-        print(f"⚠️ RAG 未初始化，嘗試初始化 (嘗試 {retry_count+1}/3)")
-        try:
-            initialize_rag()
-            break
-        except Exception as e:
-            print(f"❌ RAG 初始化失敗: {e}")
-            retry_count += 1
-            import time
-            time.sleep(1)  # 等待1秒再重試
-    
-    # 如果仍未初始化成功
-    if index is None or df is None:
-        print("❌ RAG 初始化失敗，無法繼續")
-        return "Sorry, I'm currently experiencing technical difficulties. Please try again later."
-    
-    # 獲取用戶數據
+def get_openai_client():
+    """取得共用的 OpenAI client (執行緒安全，連線會被重用)"""
+    global openai_client
+    if openai_client is None:
+        with _openai_client_lock:
+            if openai_client is None:
+                openai_client = openai.OpenAI(api_key=openai_api_key, base_url=OPENAI_BASE_URL, timeout=OPENAI_TIMEOUT)
+    return openai_client
+
+def complete_chat(messages, stream=False):
+    """調用 OpenAI，回傳 (回答, 使用的 token 數)；stream=True 時以串流方式接收並記錄第一個 token 的延遲"""
+    with span("openai"):
+        start = time.perf_counter()
+        options = {"stream_options": {"include_usage": True}} if stream else {}
+        response = get_openai_client().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            max_tokens=OPENAI_MAX_TOKENS,
+            stream=stream,
+            **options,
+        )
+        usage = None
+        if not stream:
+            reply = response.choices[0].message.content
+            usage = response.usage
+        else:
+            parts = []
+            for chunk in response:
+                usage = getattr(chunk, "usage", None) or usage  # 最後一個 chunk 帶有 usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        ttft = llm_first_token_latency.record_since(start)
+                        log(f"⚡ 第一個 token: {ttft:.0f} ms")
+                    parts.append(delta)
+            reply = "".join(parts)
+    llm_total_latency.record_since(start)
+    return reply, usage.total_tokens if usage else 0
+
+def llm_latency_stats():
+    return {
+        "first_token": llm_first_token_latency.stats(),
+        "total": llm_total_latency.stats(),
+    }
+
+def summarize_conversation(summary, messages):
+    """把較舊的對話併入摘要 (保留飲食限制、討論過的菜色和使用者的要求)"""
+    transcript = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+    with span("openai_summary"):
+        response = get_openai_client().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": (
+                    "Summarize this conversation between a user and a chef assistant in under 100 words. "
+                    "Keep dietary constraints, dishes discussed and open requests. Merge it with the previous summary."
+                )},
+                {"role": "user", "content": f"Previous summary: {summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+    return response.choices[0].message.content.strip()
+
+# 每輪 prompt 的 token 上限 + 超過時把舊對話摺疊成摘要
+conversation_context = ConversationContext(
+    summarize_conversation, budget=CONTEXT_TOKEN_BUDGET, history_budget=HISTORY_TOKEN_BUDGET,
+)
+
+recipe_formatter = RecipeFormatter(
+    budget=RECIPE_TOKEN_BUDGET, max_ingredients=RECIPE_MAX_INGREDIENTS,
+    max_steps=RECIPE_MAX_STEPS, max_item_chars=RECIPE_MAX_ITEM_CHARS,
+)
+
+def context_stats():
+    """每次請求的 prompt token 數、摘要次數和食譜文字的 token 數"""
+    return dict(conversation_context.stats(), recipes=recipe_formatter.stats())
+
+# 不需要完整 RAG 流程的請求次數
+_fast_path_lock = threading.Lock()
+_fast_path_counts = {"quick_replies": 0, "no_context": 0, "filtered_hits": 0, "lexical_kept": 0}
+
+def count_fast_path(name, n=1):
+    with _fast_path_lock:
+        _fast_path_counts[name] += n
+
+def fast_path_stats():
+    """固定回覆 (不檢索、不呼叫 GPT)、沒有相關食譜的回答次數，低於相似度門檻被過濾 / 因字面命中而保留的食譜數"""
+    with _fast_path_lock:
+        return dict(_fast_path_counts, min_similarity=MIN_SIMILARITY, scores_supported=scores_supported)
+
+def load_history(session):
+    """摘要之後的對話 (系統提示不保存，每一輪會重新產生)"""
+    return session_cache.get_conversation(session)
+
+# 對話摘要 (第二次 OpenAI 請求) 在回覆之後由背景線程執行，同一使用者同時只排一次
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+_folding_lock = threading.Lock()
+_folding_users = set()
+
+def fold_conversation(user_id):
+    """把最舊的對話併入摘要，寫入新的 summary / summary_cursor (背景執行)"""
     try:
-        user_data = get_user_data(user_id)
-        print(f"📊 用戶數據: {user_data}")
-        preferences = user_data.get("preferences", None) if user_data else None
+        if conversation_writer is not None:
+            # 先寫入佇列中的訊息：要摺疊的訊息都已儲存，序號是資料庫中的實際序號
+            conversation_writer.flush()
+        session = session_cache.load(user_id)
+        history = load_history(session)
+        folded = conversation_context.fold(session.summary, history)
+        if folded is not None:
+            summary, kept = folded
+            session_cache.append_messages(session, [], summary=summary, folded=len(history) - len(kept))
+            log(f"🗜️ 對話已摺疊成摘要，保留 {len(kept)} 則訊息")
     except Exception as e:
-        print(f"❌ 獲取用戶數據失敗: {e}")
-        preferences = None
+        print(f"⚠️ 對話摘要失敗 ({user_id}): {e}")
+    finally:
+        with _folding_lock:
+            _folding_users.discard(user_id)
+
+def save_turn(session, user_input, reply):
+    """新增這一輪對話；超過 HISTORY_TOKEN_BUDGET 時在背景把最舊的對話併入摘要 (只移動 summary_cursor)
+
+    摺疊完成前 conversation_context.build 仍然只放入 token 上限內的最近對話。
+    """
+    turn = [{"role": "user", "content": user_input}, {"role": "assistant", "content": reply}]
+    session_cache.append_messages(session, turn)
+    if not conversation_context.needs_fold(load_history(session)):
+        return
+    with _folding_lock:
+        if session.user_id in _folding_users:
+            return
+        _folding_users.add(session.user_id)
+    summary_executor.submit(fold_conversation, session.user_id)
+
+def chat_with_model(user_id, user_input, session=None, on_recipes=None):
+    """ GPT 生成回應並整合 FAISS 搜尋結果 (session 由 chatbot.py 傳入時不會重複讀取資料庫)
+
+    指定 on_recipes 時使用串流模式：檢索完成後立即以食譜列表呼叫 on_recipes (先送出第一則訊息)，
+    再串流接收 GPT 的完整回應。
+    """
+    log(f"📝 處理用戶 {user_id} 的輸入: {user_input}")
+    
+    # 獲取用戶數據
+    if session is None:
+        session = session_cache.load(user_id)
+    preferences = session.preferences
+    log(f"📊 用戶偏好: {preferences}")
 
     # 檢查是否是設置偏好的訊息
     if not preferences:
-        print(f"🆕 新用戶 {user_id}，設置飲食偏好: {user_input}")
+        log(f"🆕 新用戶 {user_id}，設置飲食偏好: {user_input}")
         try:
-            set_user_data(user_id, {"preferences": user_input})
+            session_cache.set_preferences(session, user_input)
             return f"Thanks! I've noted your dietary preferences: {user_input}. Now you can ask for recipe recommendations!"
         except Exception as e:
             print(f"❌ 設置用戶偏好失敗: {e}")
             return "I couldn't save your preferences. Please try again."
+
+    # 打招呼、道謝、說明等訊息：固定回覆，不需要等 RAG 載入
+    quick = quick_reply(user_input, preferences)
+    if quick is not None:
+        log(f"⚡ 固定回覆: {user_input!r}")
+        count_fast_path("quick_replies")
+        return quick
+    
+    # RAG 尚未載入完成：直接回覆，不在請求路徑上初始化或等待
+    if not rag_ready():
+        if startup.failed():
+            print(f"❌ RAG 初始化失敗: {startup.summary()}")
+            return "Sorry, I'm currently experiencing technical difficulties. Please try again later."
+        log(f"⏳ RAG 仍在載入中: {startup.summary()}")
+        return "I'm still warming up my recipe book. Please try again in a few seconds!"
     
     # 搜尋相關食譜
-    print(f"🔍 為查詢 '{user_input}' 搜尋食譜...")
-    best_recipes = search_recipe(user_input, k=3)
-    if best_recipes is None or len(best_recipes) == 0:
+    log(f"🔍 為查詢 '{user_input}' 搜尋食譜...")
+    recipe_filter = parse_preferences(preferences)
+    if recipe_filter:
+        log(f"🥗 偏好過濾: {recipe_filter}")
+    best_recipes = search_recipe(user_input, k=3, recipe_filter=recipe_filter)
+    if best_recipes is None:
         return "Sorry, I couldn't find any relevant recipes for your request."
+
+    # 語意回答快取：沒有對話紀錄的一輪，相同偏好下相似的問題且檢索到相同食譜時直接重用先前的回答
+    history = load_history(session)
+    cache_text = f"preferences: {normalize_query(preferences)}\nquery: {normalize_query(user_input)}"
+    cache_key = tuple(recipe.id for recipe in best_recipes)
+    cache_vector = None
+    if SEMANTIC_CACHE_SIZE > 0 and not history and not session.summary:
+        try:
+            cache_vector = encode_query(cache_text)
+            cached, score = answer_cache.get(cache_vector, key=cache_key)
+            if cached is not None:
+                log(f"💾 語意快取命中 (相似度 {score:.3f}): {cached['text']!r}")
+                save_turn(session, user_input, cached["answer"])
+                return cached["answer"]
+        except Exception as e:
+            print(f"⚠️ 語意快取查詢失敗: {e}")
+            cache_vector = None
+
+    # 串流模式：不等 GPT，先讓使用者看到找到的食譜 (沒有相關食譜時不送出空列表)
+    if on_recipes is not None and best_recipes:
+        on_recipes(best_recipes)
     
-    # 格式化食譜結果
-    formatted_recipes = "\n\n".join([
-        f"**Title:** {row['title']}\n**Ingredients:** {row['ingredients']}\n**Instructions:** {row['directions']}"
-        for _, row in best_recipes.iterrows()
-    ])
-    
-    # 組織系統提示
-    system_prompt = f"""
+    # 格式化食譜結果 + 組織系統提示 (每一輪都用本輪檢索到的食譜)
+    with span("prompt_build"):
+        if best_recipes:
+            formatted_recipes = recipe_formatter.format(best_recipes)
+            system_prompt = f"""
     You are a professional chef assistant. The user follows these dietary preferences: {preferences}.
     Here are recommended recipes based on their preferences:
     {formatted_recipes}
     Provide a response considering these preferences strictly.
     """
-    
-    # 獲取對話歷史
-    conversation = get_user_conversation(user_id)
-    if not conversation:
-        conversation.append({"role": "system", "content": system_prompt})
-    conversation.append({"role": "user", "content": user_input})
+        else:
+            # 所有檢索結果都低於 MIN_SIMILARITY：不放入不相關的食譜，省下 prompt token
+            log("🎯 沒有相關食譜，不附加檢索內容")
+            count_fast_path("no_context")
+            system_prompt = f"""
+    You are a professional chef assistant. The user follows these dietary preferences: {preferences}.
+    No recipe in the recipe book matched this message. Answer briefly, and if it is not about cooking,
+    steer the conversation back to recipes.
+    """
+        # 系統提示 + 摘要 + token 上限內的最近對話
+        messages = conversation_context.build(system_prompt, session.summary, history, user_input)
     
     # 調用 OpenAI API
     try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=conversation,
-            max_tokens=200
-        )
-        
-        reply = response.choices[0].message.content
+        start = time.perf_counter()
+        reply, tokens = complete_chat(messages, stream=on_recipes is not None)
+        if cache_vector is not None and reply:
+            answer_cache.put(cache_vector, cache_text, reply, tokens, (time.perf_counter() - start) * 1000,
+                             key=cache_key)
         
         # 保存對話
-        conversation.append({"role": "assistant", "content": reply})
-        if len(conversation) > 20:
-            conversation = conversation[-20:]
-        save_user_conversation(user_id, conversation)
+        save_turn(session, user_input, reply)
         
         return reply
     except Exception as e:
@@ -0,0 +1,94 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+class MicroBatcher:
+    """把多個線程同時送來的請求合併成一批處理 (request coalescing)
+
+    第一筆請求到達後最多再等 max_wait_ms 毫秒，或湊滿 max_batch 筆就立即處理；
+    process_fn(items) 必須回傳和 items 等長、順序相同的結果列表，結果再分別回傳給各個呼叫端。
+    沒有其他併發請求時單筆請求只會多等 max_wait_ms；max_wait_ms=0 時不額外等待，
+    只合併前一批處理期間累積的請求。
+    """
+
+    def __init__(self, process_fn, max_batch=32, max_wait_ms=3.0, name="batcher"):
+        self.process_fn = process_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+
+        # 統計
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+        self.failed_batches = 0
+
+    def _start(self):
+        # 第一次 submit 時才啟動線程 (在 fork 之後的進程中)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """送出一筆請求並等待結果 (process_fn 的例外會在呼叫端重新拋出)"""
+        future = Future()
+        with self._cond:
+            self._start()
+            self._queue.append((item, future))
+            self._cond.notify()
+        return future.result(timeout)
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._queue), self.max_batch)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: 回傳 {len(results)} 筆結果，預期 {len(items)} 筆")
+                error = None
+            except Exception as e:
+                error = e
+            # 統計在 lock 中更新 (/stats 從其他線程讀取)，先更新再把結果交給呼叫端
+            with self._cond:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+                if error is not None:
+                    self.failed_batches += 1
+            if error is not None:
+                for _, future in batch:
+                    future.set_exception(error)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "max_batch_seen": self.max_batch_seen,
+                "failed_batches": self.failed_batches,
+                "queue_depth": len(self._queue),
+            }
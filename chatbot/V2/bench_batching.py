@@ -0,0 +1,94 @@
+import time
+import argparse
+import threading
+
+import faiss
+import numpy as np
+
+from batcher import MicroBatcher
+from index_factory import search_parameters, search, search_many
+from encoder import create_encoder, EMBEDDING_BACKEND
+
+# 壓測用查詢 (每次加上編號，避免任何快取)
+QUERIES = [
+    "chicken", "vegan dinner", "quick breakfast", "leftover rice eggs scallion", "gluten free dessert",
+    "easy soup for a cold day", "what can i cook with potatoes and cheese", "banana nut bread",
+]
+
+def run_load(search_fn, concurrency, requests_per_thread):
+    """concurrency 個線程同時查詢，回傳 (總吞吐量 qps, 每筆延遲毫秒列表)"""
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(worker_id):
+        local = []
+        barrier.wait()
+        for i in range(requests_per_thread):
+            query = f"{QUERIES[(worker_id + i) % len(QUERIES)]} {worker_id}-{i}"
+            start = time.perf_counter()
+            search_fn(query)
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="比較有無合併批次 (micro-batching) 時的查詢吞吐量和 p99 延遲")
+    parser.add_argument("--index", default="recipe_faiss.index")
+    parser.add_argument("--encoder", default=EMBEDDING_BACKEND)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--requests", type=int, default=50, help="每個線程的查詢數")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, nargs="+", default=[0.0, 1.0, 3.0],
+                        help="0 = 不額外等待，只合併前一批處理期間累積的請求")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    args = parser.parse_args()
+
+    index = faiss.read_index(args.index)
+    encoder = create_encoder(args.encoder)
+    params = search_parameters(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    encoder.encode(QUERIES)  # 暖機
+
+    def direct(query):
+        _, indices = search(index, encoder.encode([query]), args.k, params)
+        return indices[0]
+
+    configs = [("direct", None)] + [(f"batched({wait:g}ms)", wait) for wait in args.max_wait_ms]
+    print(f"📊 {index.ntotal} 筆向量, encoder={encoder.name}, 每線程 {args.requests} 筆查詢")
+    header = ["mode", "threads", "qps", "p50_ms", "p99_ms", "avg_batch"]
+    print("  ".join(f"{h:>16}" for h in header))
+    for concurrency in args.concurrency:
+        for name, wait in configs:
+            if wait is None:
+                search_fn, batchers = direct, []
+            else:
+                encode_batcher = MicroBatcher(lambda texts: list(encoder.encode(texts, batch_size=args.max_batch)),
+                                              max_batch=args.max_batch, max_wait_ms=wait, name="encode-batcher")
+                search_batcher = MicroBatcher(lambda requests: search_many(index, requests),
+                                              max_batch=args.max_batch, max_wait_ms=wait, name="search-batcher")
+                batchers = [encode_batcher, search_batcher]
+
+                def search_fn(query, encode_batcher=encode_batcher, search_batcher=search_batcher):
+                    embedding = encode_batcher.submit(query).reshape(1, -1)
+                    return search_batcher.submit((embedding, args.k, args.nprobe, args.ef_search))
+
+            qps, latencies = run_load(search_fn, concurrency, args.requests)
+            avg_batch = np.mean([b.stats()["avg_batch_size"] for b in batchers]) if batchers else 1.0
+            row = [name, concurrency, f"{qps:.1f}", f"{np.percentile(latencies, 50):.2f}",
+                   f"{np.percentile(latencies, 99):.2f}", f"{avg_batch:.1f}"]
+            print("  ".join(f"{str(c):>16}" for c in row))
+
+if __name__ == "__main__":
+    main()
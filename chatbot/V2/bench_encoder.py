@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+from encoder import ENCODER_BACKENDS
+
+# 每個後端在獨立的子進程中量測，import 時間和記憶體才不會互相影響
+QUERIES = ["chicken", "vegan dinner", "quick breakfast", "leftover rice eggs scallion", "gluten free dessert"]
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+def run_worker(backend, n_queries, batch_size):
+    """子進程：量測 import、載入、單筆查詢延遲、批次吞吐量和記憶體"""
+    start = time.perf_counter()
+    import numpy as np
+    from encoder import create_encoder
+    if backend == "torch":
+        import sentence_transformers  # noqa: F401
+    else:
+        import onnxruntime  # noqa: F401
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoder = create_encoder(backend)
+    load_seconds = time.perf_counter() - start
+
+    # 暖機
+    encoder.encode(QUERIES)
+
+    latencies = []
+    for i in range(n_queries):
+        query = QUERIES[i % len(QUERIES)] + f" {i}"
+        t = time.perf_counter()
+        encoder.encode([query])
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    texts = [f"Title: recipe {i}\nIngredients: flour, sugar, eggs, butter\nInstructions: mix and bake." for i in range(512)]
+    t = time.perf_counter()
+    encoder.encode(texts, batch_size=batch_size)
+    throughput = len(texts) / (time.perf_counter() - t)
+
+    return {
+        "backend": backend,
+        "import_s": round(import_seconds, 2),
+        "load_s": round(load_seconds, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "batch_rows_s": round(throughput, 1),
+        "rss_mb": round(rss_mb(), 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 embedding 後端的延遲、記憶體和 import 時間")
+    parser.add_argument("--backends", nargs="+", default=list(ENCODER_BACKENDS), choices=ENCODER_BACKENDS)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.queries, args.batch_size)))
+        return
+
+    results = []
+    for backend in args.backends:
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", backend,
+               "--queries", str(args.queries), "--batch-size", str(args.batch_size)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"❌ {backend} 失敗:\n{proc.stderr.strip()[-500:]}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(result)
+
+    if results:
+        columns = list(results[0].keys())
+        print()
+        print("  ".join(f"{c:>12}" for c in columns))
+        for r in results:
+            print("  ".join(f"{str(r[c]):>12}" for c in columns))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+from index_factory import search_parameters, search
+from metadata_store import MetadataStore
+from bm25 import BM25Index, reciprocal_rank_fusion
+from encoder import create_encoder, EMBEDDING_BACKEND
+
+# 評估集：每個查詢有兩種標註
+#   relevant : 由規則 (標題 / 食材必須包含的詞組) 產生，換資料後可用 --relabel 重新標註。
+#              規則本身就是字面比對，會偏袒 BM25，只適合當作回歸測試，不能證明 hybrid 比較好。
+#   judged   : {行號: 0/1/2}，由 --judge 以 LLM 逐筆判斷 (不看 BM25 分數或 embedding)。
+#              候選來自各檢索方式 top-N 的聯集 (pooling)，沒有被判斷過的食譜視為不相關。
+#              held_out 的查詢刻意不使用食譜標題中的字 (例如 "something warm for a cold day")，只有 judged 標註。
+# 預設使用 judged 標註 (--labels rules 改用規則標註)；served 一列是 RAG.search_recipe 的完整流程
+# (SEARCH_MODE + RERANK_MODE 重新排序 + MIN_SIMILARITY 門檻)，和實際服務的結果相同。
+EVAL_QUERIES_PATH = "eval_queries.json"
+LABEL_SOURCES = ("judged", "rules")
+JUDGE_MODEL = os.getenv("JUDGE_MODEL", "gpt-4o-mini")
+
+JUDGE_PROMPT = (
+    "You grade search results for a recipe chatbot. For each numbered recipe, decide how well it answers the "
+    "user's request: 2 = a good answer, 1 = partially relevant (related dish or missing a key element), "
+    "0 = not relevant. Judge the meaning of the request, not shared words. "
+    "Reply with only a JSON list of integers, one per recipe, in order."
+)
+
+def matches(recipe, title_terms, ingredient_terms):
+    """每一組詞中至少有一個出現在標題 / 食材中"""
+    title = recipe.title.lower()
+    ingredients = " ; ".join(recipe.ingredients).lower()
+    return (all(any(term in title for term in group) for group in title_terms)
+            and all(any(term in ingredients for term in group) for group in ingredient_terms))
+
+def load_queries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_queries(path, data):
+    # 每個查詢一行，方便 diff
+    lines = ",\n".join("  " + json.dumps(query, ensure_ascii=False) for query in data["queries"])
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        f.write(f' "description": {json.dumps(data["description"], ensure_ascii=False)},\n')
+        f.write(f' "queries": [\n{lines}\n ]\n}}\n')
+
+def relabel(path, metadata):
+    """依規則重新產生每個查詢的 relevant 行號 (held_out 的查詢沒有規則)"""
+    data = load_queries(path)
+    for query in data["queries"]:
+        if query.get("held_out"):
+            continue
+        query["relevant"] = [
+            i for i, recipe in enumerate(metadata)
+            if matches(recipe, query["title_terms"], query["ingredient_terms"])
+        ]
+        print(f"{len(query['relevant']):>4} 筆相關  {query['query']}")
+    save_queries(path, data)
+
+def graded_labels(query, labels="judged"):
+    """{行號: 分數}；judged 為 LLM 判斷的 0/1/2，rules 的相關食譜一律為 1"""
+    if labels == "judged":
+        return {int(i): grade for i, grade in query.get("judged", {}).items()}
+    return {i: 1 for i in query.get("relevant", [])}
+
+def relevant_set(query, labels="judged"):
+    return {i for i, grade in graded_labels(query, labels).items() if grade > 0}
+
+def recall_at(ranked, relevant, k):
+    """top-k 中找到的相關食譜比例 (相關數大於 k 時以 k 為分母)"""
+    if not relevant:
+        return None
+    return len(set(ranked[:k]) & relevant) / min(k, len(relevant))
+
+def reciprocal_rank(ranked, relevant):
+    for rank, doc_id in enumerate(ranked, 1):
+        if doc_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+def ndcg_at(ranked, grades, k):
+    """graded relevance 的 nDCG@k (分數 2 的食譜比 1 的重要)"""
+    dcg = sum(grades.get(doc_id, 0) / np.log2(rank + 1) for rank, doc_id in enumerate(ranked[:k], 1))
+    ideal = sorted(grades.values(), reverse=True)[:k]
+    idcg = sum(grade / np.log2(rank + 1) for rank, grade in enumerate(ideal, 1))
+    return dcg / idcg if idcg > 0 else None
+
+def served_search():
+    """RAG.search_recipe 的完整流程 (第一階段 + 重新排序 + 相似度門檻)；每次清空快取，量到的是實際延遲"""
+    # 只用到檢索，不會呼叫 OpenAI 或讀寫使用者資料
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("STORAGE_BACKEND", "memory")
+    import RAG
+    RAG.initialize_rag()
+    print(f"🔧 served: SEARCH_MODE={RAG.SEARCH_MODE}, RERANK_MODE={RAG.RERANK_MODE}, "
+          f"MIN_SIMILARITY={RAG.MIN_SIMILARITY}")
+
+    def run(query, k):
+        RAG.result_cache.clear()
+        RAG.embedding_cache.clear()
+        recipes = RAG.search_recipe(query, k=k) or []
+        return [recipe.id for recipe in recipes]
+    return run
+
+def judge_pool(data, metadata, methods, pool, model):
+    """以 LLM 判斷各方法 top-pool 聯集中尚未判斷的食譜，結果寫入 query["judged"]"""
+    import openai
+    client = openai.OpenAI()
+    judged_count = 0
+    for query in data["queries"]:
+        judged = query.setdefault("judged", {})
+        candidates = []
+        for _, run in methods:
+            for doc_id in run(query["query"], pool):
+                if str(doc_id) not in judged and doc_id not in candidates:
+                    candidates.append(doc_id)
+        if not candidates:
+            continue
+        listing = "\n".join(
+            f"{n}. {recipe.title} — {', '.join(recipe.ingredients[:15])}"
+            for n, recipe in enumerate(metadata.take(candidates), 1)
+        )
+        response = client.chat.completions.create(
+            model=model,
+            temperature=0,
+            messages=[
+                {"role": "system", "content": JUDGE_PROMPT},
+                {"role": "user", "content": f"Request: {query['query']}\n\nRecipes:\n{listing}"},
+            ],
+        )
+        text = response.choices[0].message.content
+        match = re.search(r"\[[\d,\s]*\]", text)
+        grades = json.loads(match.group(0)) if match else []
+        if len(grades) != len(candidates):
+            print(f"⚠️ 判斷結果數量不符，略過: {query['query']} ({text!r})")
+            continue
+        for doc_id, grade in zip(candidates, grades):
+            judged[str(doc_id)] = max(0, min(2, int(grade)))
+        judged_count += len(candidates)
+        relevant = sum(1 for grade in judged.values() if grade > 0)
+        print(f"⚖️ {len(candidates):>3} 筆新判斷, 共 {relevant:>3} 筆相關  {query['query']}")
+    print(f"✅ 共判斷 {judged_count} 筆 ({model})")
+
+def main():
+    parser = argparse.ArgumentParser(description="比較向量 / BM25 / hybrid / 實際服務流程的檢索品質和延遲")
+    parser.add_argument("--queries", default=EVAL_QUERIES_PATH)
+    parser.add_argument("--index", default="recipe_faiss.index")
+    parser.add_argument("--encoder", default=EMBEDDING_BACKEND)
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 10])
+    parser.add_argument("--candidates", type=int, default=50, help="hybrid 每種檢索的候選數")
+    parser.add_argument("--weights", type=float, nargs="+", default=[0.5, 1.0, 2.0],
+                        help="hybrid 的 BM25 權重 (向量為 1.0)")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=5, help="延遲量測的重複次數")
+    parser.add_argument("--labels", choices=LABEL_SOURCES, default="judged",
+                        help="judged: LLM 判斷的標註 (預設)；rules: 字面規則標註 (偏袒 BM25)")
+    parser.add_argument("--no-served", action="store_true", help="不評估 RAG.search_recipe 的完整流程")
+    parser.add_argument("--relabel", action="store_true", help="依規則重新產生 relevant 後結束")
+    parser.add_argument("--judge", action="store_true", help="以 LLM 判斷各方法 top-N 的聯集後結束 (需要 OPENAI_API_KEY)")
+    parser.add_argument("--judge-pool", type=int, default=10, help="每個方法取幾筆候選給 LLM 判斷")
+    parser.add_argument("--judge-model", default=JUDGE_MODEL)
+    args = parser.parse_args()
+
+    metadata = MetadataStore()
+    if args.relabel:
+        relabel(args.queries, metadata)
+        return
+
+    data = load_queries(args.queries)
+    index = faiss.read_index(args.index)
+    bm25_index = BM25Index()
+    encoder = create_encoder(args.encoder)
+    params = search_parameters(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    depth = max(max(args.k), args.candidates, args.judge_pool)
+
+    def vector(query, k):
+        _, indices = search(index, encoder.encode([query]), k, params)
+        return [int(i) for i in indices[0] if i >= 0]
+
+    def lexical(query, k):
+        ids, _ = bm25_index.search(query, k)
+        return [int(i) for i in ids]
+
+    def hybrid(weight):
+        def run(query, k):
+            rankings = [vector(query, depth), lexical(query, depth)]
+            return reciprocal_rank_fusion(rankings, weights=[1.0, weight])[:k]
+        return run
+
+    methods = [("vector", vector), ("bm25", lexical)]
+    methods += [(f"hybrid(w={weight:g})", hybrid(weight)) for weight in args.weights]
+    if not args.no_served:
+        methods.append(("served", served_search()))
+
+    if args.judge:
+        judge_pool(data, metadata, methods, args.judge_pool, args.judge_model)
+        save_queries(args.queries, data)
+        return
+
+    queries = [q for q in data["queries"] if relevant_set(q, args.labels)]
+    if not queries:
+        print(f"❌ {args.queries} 沒有 {args.labels} 標註，請先執行 --judge (或使用 --labels rules)")
+        return
+    if args.labels == "rules":
+        print("⚠️ 規則標註來自標題 / 食材的字面比對，會偏袒 BM25，不能用來證明 hybrid 的改進")
+    held_out = sum(1 for q in queries if q.get("held_out"))
+
+    print(f"📊 {len(queries)} 個查詢 ({held_out} 個 held-out), {index.ntotal} 筆食譜, encoder={encoder.name}, "
+          f"標註={args.labels}")
+    header = ["method"] + [f"recall@{k}" for k in args.k] + [f"ndcg@{k}" for k in args.k]
+    header += ["mrr", "empty", "p50_ms", "p99_ms"]
+    print("  ".join(f"{h:>14}" for h in header))
+    for name, run in methods:
+        recalls = {k: [] for k in args.k}
+        ndcgs = {k: [] for k in args.k}
+        rr = []
+        empty = 0
+        latencies = []
+        for q in queries:
+            grades = graded_labels(q, args.labels)
+            relevant = relevant_set(q, args.labels)
+            ranked = run(q["query"], max(args.k))
+            empty += not ranked  # served 的相似度門檻可能濾掉所有結果
+            for k in args.k:
+                recalls[k].append(recall_at(ranked, relevant, k))
+                ndcgs[k].append(ndcg_at(ranked, grades, k))
+            rr.append(reciprocal_rank(ranked, relevant))
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                run(q["query"], max(args.k))
+                latencies.append((time.perf_counter() - start) * 1000)
+        row = [name] + [f"{np.mean(recalls[k]):.3f}" for k in args.k] + [f"{np.mean(ndcgs[k]):.3f}" for k in args.k]
+        row += [f"{np.mean(rr):.3f}", empty, f"{np.percentile(latencies, 50):.2f}", f"{np.percentile(latencies, 99):.2f}"]
+        print("  ".join(f"{c:>14}" for c in row))
+
+if __name__ == "__main__":
+    main()
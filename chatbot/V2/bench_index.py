@@ -0,0 +1,183 @@
+import os
+import gc
+import json
+import time
+import argparse
+import tempfile
+import faiss
+import numpy as np
+
+from index_factory import create_index, train_index, search_parameters, search, normalize_vectors, DEFAULT_TRAIN_SIZE
+
+# RecipeNLG 完整資料集的筆數，用來估算完整索引大小
+FULL_CORPUS_ROWS = 2231142
+
+def rss_bytes():
+    """目前進程的 resident memory (bytes)"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def load_vectors(index_path=None, shard_dir=None):
+    """從 flat 索引或 shard 目錄載入原始向量"""
+    if shard_dir:
+        with open(os.path.join(shard_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return np.vstack([
+            np.load(os.path.join(shard_dir, shard["name"] + ".npy"))
+            for shard in manifest["shards"]
+        ]).astype(np.float32)
+
+    index = faiss.read_index(index_path)
+    if faiss.try_extract_index_ivf(index) is not None or not hasattr(index, "reconstruct_n"):
+        raise ValueError("❌ 只能從 flat 索引還原向量，請改用 --shard-dir")
+    return index.reconstruct_n(0, index.ntotal)
+
+def parse_config(spec):
+    """解析 'ivf_pq:nlist=256,pq_m=16' / 'flat:metric=ip,storage=fp16' 形式的設定"""
+    index_type, _, option_str = spec.partition(":")
+    options = {}
+    for item in filter(None, option_str.split(",")):
+        key, value = item.split("=")
+        options[key] = int(value) if value.isdigit() else value
+    return index_type, options
+
+def make_queries(vectors, n_queries, noise, seed):
+    """從語料中取樣並加上少量雜訊當作查詢向量 (避免查詢剛好等於資料庫中的向量)"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[rows] + rng.normal(scale=noise, size=(len(rows), vectors.shape[1]))
+    return np.ascontiguousarray(queries, dtype=np.float32)
+
+def measure_latency(index, queries, k, params):
+    """逐筆查詢 (和線上服務一樣一次一個 query)，回傳每筆延遲 (ms)"""
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        search(index, queries[i:i + 1], k, params)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+def recall_at_k(approx_ids, exact_ids, k):
+    """approx top-k 和 flat top-k 的交集比例"""
+    hits = [len(set(a[:k]) & set(e[:k])) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits)) / k
+
+def benchmark(vectors, configs, ks, nprobes, ef_searches, n_queries, noise, train_size, seed):
+    queries = make_queries(vectors, n_queries, noise, seed)
+    max_k = max(ks)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, exact_ids = exact.search(queries, max_k)
+    del exact
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for spec in configs:
+            index_type, options = parse_config(spec)
+            options = dict(options)
+            train_rows = options.pop("train_size", train_size)
+            # ip 索引：資料和查詢都先 L2 正規化
+            if options.get("metric") == "ip":
+                data, config_queries = normalize_vectors(vectors), normalize_vectors(queries)
+            else:
+                data, config_queries = vectors, queries
+
+            build_start = time.perf_counter()
+            index = create_index(index_type, dim=vectors.shape[1], ntotal=len(vectors), **options)
+            if not index.is_trained:
+                rng = np.random.default_rng(seed)
+                sample = data[rng.choice(len(data), size=min(train_rows, len(data)), replace=False)]
+                train_index(index, sample)
+            index.add(data)
+            build_seconds = time.perf_counter() - build_start
+
+            # 磁碟大小、索引資料結構大小，以及重新讀取後的 RSS 增量
+            path = os.path.join(tmp_dir, "bench.index")
+            faiss.write_index(index, path)
+            disk_bytes = os.path.getsize(path)
+            ram_bytes = faiss.serialize_index(index).nbytes
+            del index
+            gc.collect()
+            rss_before = rss_bytes()
+            index = faiss.read_index(path)
+            rss_delta = max(rss_bytes() - rss_before, 0)
+
+            if index_type.startswith("ivf"):
+                sweep = [("nprobe", value) for value in nprobes]
+            elif index_type == "hnsw":
+                sweep = [("efSearch", value) for value in ef_searches]
+            else:
+                sweep = [("-", None)]
+
+            for param_name, value in sweep:
+                params = search_parameters(
+                    index,
+                    nprobe=value if param_name == "nprobe" else None,
+                    ef_search=value if param_name == "efSearch" else None,
+                )
+                _, approx_ids = search(index, config_queries, max_k, params)
+                latencies = measure_latency(index, config_queries, max_k, params)
+                row = {
+                    "config": spec,
+                    "param": f"{param_name}={value}" if value is not None else "-",
+                    "build_s": round(build_seconds, 2),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                    "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                    "disk_mb": round(disk_bytes / 1e6, 2),
+                    "ram_mb": round(ram_bytes / 1e6, 2),
+                    "rss_delta_mb": round(rss_delta / 1e6, 2),
+                    "full_corpus_mb": round(ram_bytes / len(vectors) * FULL_CORPUS_ROWS / 1e6, 1),
+                }
+                for k in ks:
+                    row[f"recall@{k}"] = round(recall_at_k(approx_ids, exact_ids, k), 4)
+                results.append(row)
+                print(row)
+
+            del index
+            gc.collect()
+    return results
+
+def print_table(results):
+    columns = list(results[0].keys())
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="比較不同 FAISS 索引的召回率、延遲和大小")
+    parser.add_argument("--index", default="recipe_faiss.index",
+                        help="flat 索引 (用來還原原始向量)")
+    parser.add_argument("--shard-dir", default=None,
+                        help="改從 local_preprocessing 的 shard 目錄讀取向量")
+    parser.add_argument("--configs", nargs="+",
+                        default=["flat", "ivf_flat", "ivf_pq", "ivf_pq:pq_m=16", "hnsw"],
+                        help="索引設定，例如 ivf_pq:nlist=1024,pq_m=16")
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 10])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.02,
+                        help="加在查詢向量上的高斯雜訊標準差")
+    parser.add_argument("--train-size", type=int, default=DEFAULT_TRAIN_SIZE)
+    parser.add_argument("--threads", type=int, default=1,
+                        help="FAISS OpenMP 線程數 (線上服務每個請求一次一個 query)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="另存結果為 JSON")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    faiss.omp_set_num_threads(args.threads)
+    vectors = load_vectors(args.index, args.shard_dir)
+    print(f"📦 載入 {len(vectors)} 筆向量 (維度 {vectors.shape[1]})")
+    results = benchmark(
+        vectors, args.configs, args.k, args.nprobe, args.ef_search,
+        args.queries, args.noise, args.train_size, args.seed,
+    )
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import subprocess
+
+import numpy as np
+
+from mock_services import start_mock_services
+from load_test import LOAD_TEST_SECRET, http_request, replay, percentiles
+
+# -----------------------------------------
+# 🔹 多 worker 記憶體 / 吞吐量量測
+# -----------------------------------------
+# 以 gunicorn.conf.py 啟動 1..N 個 worker (LINE / OpenAI 使用 mock_services.py，資料庫使用 memory)，
+# 讀取每個進程的 /proc/<pid>/smaps_rollup：
+#   RSS 包含和其他進程共用的頁面，PSS 把共用頁面平均分攤，所有進程 PSS 的總和才是實際佔用的記憶體。
+# preload_app 時 worker 共用 master 載入的模型和索引，總 PSS 應接近單一 worker 加上少量的每 worker 開銷。
+#
+#   python bench_workers.py --workers 1 2 4 8 --preload 1 0
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def child_pids(pid):
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return children
+
+def memory_mb(pid):
+    """回傳 {"rss": MB, "pss": MB, "shared": MB, "private": MB}"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return {
+        "rss": values.get("Rss", 0.0),
+        "pss": values.get("Pss", 0.0),
+        "shared": values.get("Shared_Clean", 0.0) + values.get("Shared_Dirty", 0.0),
+        "private": values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0),
+    }
+
+def wait_all_ready(base_url, workers, timeout):
+    """連續多次 /readyz 都回 200 (請求會分散到各個 worker)"""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline and streak < workers * 5:
+        try:
+            status, _ = http_request(f"{base_url}/readyz", timeout=5)
+        except OSError:
+            status = None
+        streak = streak + 1 if status == 200 else 0
+        if streak == 0:
+            time.sleep(0.5)
+    return streak >= workers * 5
+
+def run_config(args, mock_server, mock_url, workers, preload, offset):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(workers),
+        "PRELOAD_APP": str(preload),
+        "STORAGE_BACKEND": "memory",
+        "OPENAI_API_KEY": "load-test",
+        "OPENAI_BASE_URL": f"{mock_url}/v1",
+        "LINE_API_ENDPOINT": mock_url,
+        "LINE_ACCESS_TOKEN": "load-test",
+        "LINE_SECRET": LOAD_TEST_SECRET,
+        "VERBOSE_LOGGING": "0",
+    })
+    command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(APP_DIR, "gunicorn.conf.py"),
+               "--pythonpath", APP_DIR, "chatbot:app"]
+    log = open(args.log, "a") if args.log else subprocess.DEVNULL
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=log)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_all_ready(base_url, workers, timeout=600):
+            raise RuntimeError(f"gunicorn ({workers} workers, preload={preload}) 未就緒")
+
+        # 暖機後再量記憶體 (查詢會碰到模型和索引的頁面)
+        replay(base_url, mock_server.line, LOAD_TEST_SECRET, workers * 2, 1, offset=offset)
+        results, elapsed = replay(base_url, mock_server.line, LOAD_TEST_SECRET, args.users, args.messages,
+                                  offset=offset + workers * 2)
+        master = memory_mb(process.pid)
+        worker_memory = [memory_mb(pid) for pid in child_pids(process.pid)]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(60)
+
+    ok = [r for r in results if "error" not in r]
+    latency = percentiles([r["full_ms"] for r in ok if r["query"]])
+    return {
+        "workers": workers,
+        "preload": preload,
+        "rss_per_worker": np.mean([m["rss"] for m in worker_memory]),
+        "pss_per_worker": np.mean([m["pss"] for m in worker_memory]),
+        "private_per_worker": np.mean([m["private"] for m in worker_memory]),
+        "total_pss": master["pss"] + sum(m["pss"] for m in worker_memory),
+        "msg_s": len(ok) / elapsed if elapsed else 0.0,
+        "errors": len(results) - len(ok),
+        "p50_ms": latency.get("p50_ms"),
+        "p99_ms": latency.get("p99_ms"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 1..N 個 gunicorn worker 的每 worker 記憶體和總吞吐量")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--preload", type=int, nargs="+", default=[1, 0], help="1 = preload_app, 0 = 各 worker 自行載入")
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="mock OpenAI 延遲 (小一點才測得到 CPU 瓶頸)")
+    parser.add_argument("--log", help="gunicorn 輸出寫入的檔案 (預設丟棄)")
+    args = parser.parse_args()
+
+    mock_server, mock_url = start_mock_services(latency_ms=args.llm_latency_ms, first_token_ms=args.llm_latency_ms / 2)
+    header = ["workers", "preload", "rss/worker", "pss/worker", "priv/worker", "total_pss", "msg/s", "p50_ms", "p99_ms"]
+    print(f"📊 每個設定 {args.users} 個使用者 × {args.messages + 1} 則訊息，記憶體單位 MB")
+    print("  ".join(f"{h:>11}" for h in header))
+    offset = 0
+    for preload in args.preload:
+        for workers in args.workers:
+            row = run_config(args, mock_server, mock_url, workers, preload, offset)
+            offset += 100000
+            print("  ".join(f"{c:>11}" for c in [
+                row["workers"], row["preload"], f"{row['rss_per_worker']:.0f}", f"{row['pss_per_worker']:.0f}",
+                f"{row['private_per_worker']:.0f}", f"{row['total_pss']:.0f}", f"{row['msg_s']:.1f}",
+                row["p50_ms"], row["p99_ms"],
+            ]))
+            if row["errors"]:
+                print(f"  ⚠️ {row['errors']} 則訊息失敗")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import os
+import json
+import argparse
+from collections import Counter
+
+import numpy as np
+
+from filters import ingredient_tokens, parse_ingredients
+
+# -----------------------------------------
+# 🔹 BM25 詞彙索引 (標題 + 食材)
+# -----------------------------------------
+# recipe_bm25.json          : 版本、筆數、k1 / b、平均長度和詞彙表 (token 依 id 排序)
+# recipe_bm25_offsets.npy   : CSR offset (int64，長度 = 詞彙數 + 1)
+# recipe_bm25_postings.npy  : 每個 token 出現的食譜行號 (int32，已排序)
+# recipe_bm25_impacts.npy   : 對應的 BM25 分數 (float16，建立時預先算好 idf * tf 權重)
+# 查詢時只讀取查詢 token 的 posting list，分數直接相加即可。
+BM25_META_PATH = "recipe_bm25.json"
+BM25_OFFSETS_PATH = "recipe_bm25_offsets.npy"
+BM25_POSTINGS_PATH = "recipe_bm25_postings.npy"
+BM25_IMPACTS_PATH = "recipe_bm25_impacts.npy"
+BM25_VERSION = 1
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 2  # 標題中的字計算兩次
+
+# ✅ Reciprocal Rank Fusion 的常數 (越大越平均地看待各個排名)
+RRF_K = 60
+
+def recipe_tokens(title, ingredients):
+    """食譜 → BM25 token (標題 token 重複 TITLE_WEIGHT 次)"""
+    tokens = ingredient_tokens(title) * TITLE_WEIGHT
+    for item in parse_ingredients(ingredients):
+        tokens.extend(ingredient_tokens(item))
+    return tokens
+
+class BM25IndexBuilder:
+    """依序加入食譜，save 時計算 idf 並輸出 CSR 格式的 impact 索引"""
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self._token_ids = []  # 每筆食譜的 (token id, tf)
+        self._tfs = []
+        self._lengths = []
+
+    def add(self, title, ingredients):
+        counts = Counter(self.vocab.setdefault(token, len(self.vocab)) for token in recipe_tokens(title, ingredients))
+        self._token_ids.append(np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)))
+        self._tfs.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        self._lengths.append(sum(counts.values()))
+
+    def extend(self, rows):
+        for title, ingredients in rows:
+            self.add(title, ingredients)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def save(self, meta_path=BM25_META_PATH, offsets_path=BM25_OFFSETS_PATH,
+             postings_path=BM25_POSTINGS_PATH, impacts_path=BM25_IMPACTS_PATH):
+        rows = len(self)
+        lengths = np.array(self._lengths, dtype=np.float32)
+        avgdl = float(lengths.mean()) if rows else 0.0
+        counts = np.fromiter((len(ids) for ids in self._token_ids), dtype=np.int64, count=rows)
+        token_ids = np.concatenate(self._token_ids) if rows else np.zeros(0, dtype=np.int32)
+        tfs = np.concatenate(self._tfs) if rows else np.zeros(0, dtype=np.float32)
+        row_ids = np.repeat(np.arange(rows, dtype=np.int32), counts)
+
+        # BM25：idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        df = np.bincount(token_ids, minlength=len(self.vocab))
+        idf = np.log1p((rows - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * lengths[row_ids] / max(avgdl, 1e-9))
+        impacts = idf[token_ids] * tfs * (self.k1 + 1) / (tfs + norm)
+
+        # 依 token 字母順序排列 (stable，同一個 token 內的行號保持遞增)
+        order = sorted(self.vocab, key=self.vocab.get)
+        alphabetical = np.argsort(np.array(order, dtype=object)).astype(np.int64)
+        remap = np.empty(len(order), dtype=np.int64)
+        remap[alphabetical] = np.arange(len(order))
+        token_ids = remap[token_ids]
+        permutation = np.argsort(token_ids, kind="stable")
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(token_ids, minlength=len(order)), out=offsets[1:])
+
+        for path, array in ((offsets_path, offsets), (postings_path, row_ids[permutation]),
+                            (impacts_path, impacts[permutation].astype(np.float16))):
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+        meta = {
+            "version": BM25_VERSION,
+            "rows": rows,
+            "k1": self.k1,
+            "b": self.b,
+            "avgdl": avgdl,
+            "vocab": [order[i] for i in alphabetical],
+        }
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+        print(f"✅ 已建立 BM25 索引: {rows} 筆食譜, {len(order)} 個 token, {len(row_ids)} 筆 posting")
+
+def build_from_metadata(metadata_store):
+    """由既有的 recipe_metadata.bin 建立 BM25 索引 (不需要重新 encode)"""
+    builder = BM25IndexBuilder()
+    for recipe in metadata_store:
+        builder.add(recipe.title, recipe.ingredients)
+    builder.save()
+    return builder
+
+class BM25Index:
+    """以 mmap 讀取的 BM25 索引"""
+
+    def __init__(self, meta_path=BM25_META_PATH, offsets_path=BM25_OFFSETS_PATH,
+                 postings_path=BM25_POSTINGS_PATH, impacts_path=BM25_IMPACTS_PATH):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != BM25_VERSION:
+            raise ValueError(f"❌ {meta_path} 版本不符，請重新執行 python bm25.py")
+        self.rows = meta["rows"]
+        self.vocab = {token: i for i, token in enumerate(meta["vocab"])}
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self.postings = np.load(postings_path, mmap_mode="r")
+        self.impacts = np.load(impacts_path, mmap_mode="r")
+
+    def __len__(self):
+        return self.rows
+
+    def search(self, query, k=10, allowed=None):
+        """回傳 BM25 分數最高的 k 筆 (行號, 分數)；allowed(ids) 回傳 bool 陣列時只保留符合的行號"""
+        token_ids = sorted({self.vocab[t] for t in ingredient_tokens(query) if t in self.vocab})
+        if not token_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        ids = np.concatenate([self.postings[self.offsets[t]:self.offsets[t + 1]] for t in token_ids])
+        weights = np.concatenate([self.impacts[self.offsets[t]:self.offsets[t + 1]] for t in token_ids])
+        # 只把出現過的行號加總 (posting 數通常遠小於總筆數)
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights.astype(np.float32)).astype(np.float32)
+
+        if allowed is not None:
+            keep = allowed(unique_ids)
+            unique_ids, scores = unique_ids[keep], scores[keep]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+            unique_ids, scores = unique_ids[top], scores[top]
+        order = np.lexsort((unique_ids, -scores))  # 分數相同時依行號排序，結果可重現
+        return unique_ids[order].astype(np.int64), scores[order]
+
+    def coverage(self, query, ids):
+        """每筆食譜 (標題 + 食材) 包含查詢 token 的比例 (0~1)；查詢沒有 token 時全部為 0"""
+        tokens = set(ingredient_tokens(query))
+        ids = np.asarray(ids, dtype=np.int64)
+        matched = np.zeros(len(ids), dtype=np.float32)
+        for token in tokens:
+            if token not in self.vocab:
+                continue
+            t = self.vocab[token]
+            posting = self.postings[self.offsets[t]:self.offsets[t + 1]]
+            if not len(posting):
+                continue
+            # posting 已排序：二分搜尋，不讀取整個 posting list
+            positions = np.minimum(np.searchsorted(posting, ids), len(posting) - 1)
+            matched += posting[positions] == ids
+        return matched / len(tokens) if tokens else matched
+
+def reciprocal_rank_scores(rankings, weights=None, k=RRF_K):
+    """Reciprocal Rank Fusion：score(d) = Σ weight_i / (k + rank_i(d))，回傳依分數排序的 [(行號, 分數)]"""
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, doc_id in enumerate(ranking, 1):
+            doc_id = int(doc_id)
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+def reciprocal_rank_fusion(rankings, weights=None, k=RRF_K):
+    """依 RRF 分數排序的行號"""
+    return [doc_id for doc_id, _ in reciprocal_rank_scores(rankings, weights, k)]
+
+if __name__ == "__main__":
+    from metadata_store import MetadataStore, METADATA_PATH, METADATA_INDEX_PATH
+
+    parser = argparse.ArgumentParser(description="由 recipe_metadata.bin 建立 BM25 索引 (標題 + 食材)")
+    parser.add_argument("--metadata", default=METADATA_PATH)
+    parser.add_argument("--metadata-index", default=METADATA_INDEX_PATH)
+    args = parser.parse_args()
+    build_from_metadata(MetadataStore(args.metadata, args.metadata_index))
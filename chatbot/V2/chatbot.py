@@ -135,142 +135,239 @@
 #     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)), debug=False)
 
 
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort, jsonify
 from flask_cors import CORS
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
 import os
-import threading
-import firebase_admin
-from firebase_admin import credentials, firestore
-import json
-import ast
+import time
+import atexit
 
 # 🔥 導入 RAG 相關函數
-from RAG import chat_with_model, initialize_rag
+from RAG import (
+    chat_with_model, start_rag, rag_status, query_cache_stats, session_cache, session_stats, llm_latency_stats,
+    batching_stats, context_stats, write_behind_stats, rerank_stats, fast_path_stats, count_fast_path,
+)
+from quick_replies import quick_reply
+from worker_pool import EventWorkerPool
+from metrics import LatencyTracker
+from tracing import trace_request, current_trace, span, log, render_metrics
 
 # ✅ 設定 LINE Channel Token & Secret
 LINE_ACCESS_TOKEN = os.getenv("LINE_ACCESS_TOKEN")
 LINE_SECRET = os.getenv("LINE_SECRET")
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")  # 離線壓測時指向 mock_services.py
 
-# ✅ 讀取 Firebase 憑證
-firebase_credentials_json = os.getenv("FIREBASE_CREDENTIALS")
+# ✅ 非同步 webhook：驗證簽名後立即回 200，事件交給背景 worker 處理
+ASYNC_WEBHOOK = os.getenv("ASYNC_WEBHOOK", "0") == "1"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "0.5"))
 
-if firebase_credentials_json:
-    try:
-        if isinstance(firebase_credentials_json, str):
-            cred_dict = json.loads(firebase_credentials_json)  # 解析 JSON 字串
-        else:
-            cred_dict = firebase_credentials_json  # 如果已經是字典，直接使用
-        
-        cred = credentials.Certificate(cred_dict)
-
-        # 🔍 **先檢查 Firebase 是否已初始化**
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app(cred)
-            print("✅ Firestore database initialized successfully!")
-        else:
-            print("⚠️ Firebase app already initialized, skipping re-initialization.")
-
-    except Exception as e:
-        print(f"❌ Firebase Initialization Error: {e}")
-        raise ValueError("Failed to load Firebase credentials.")
-else:
-    raise ValueError("❌ Firebase credentials not found! Please set FIREBASE_CREDENTIALS in the environment variables.")
-
-# ✅ 初始化 Firestore
-db = firestore.client()
+# ✅ 串流回應：檢索完成就先回覆食譜標題，GPT 的完整回答再用 push 發送
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "0") == "1"
 
 # ✅ 初始化 Flask 應用
 app = Flask(__name__)
 CORS(app)
 
 # ✅ 設置 LINE Bot API
-line_bot_api = LineBotApi(LINE_ACCESS_TOKEN)
+line_bot_api = LineBotApi(LINE_ACCESS_TOKEN, endpoint=LINE_API_ENDPOINT)
 handler = WebhookHandler(LINE_SECRET)
 
-# ✅ 背景初始化 RAG
-def initialize_rag_in_background():
-    print("🔄 Initializing RAG system in the background...")
-    initialize_rag()
-    print("✅ RAG system initialized successfully!")
+def handle_event(event):
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        handle_message(event)
+
+def dispatch_event(event):
+    """在 worker 線程中處理單一 webhook 事件 (每個事件有自己的 trace，以 webhook event id 為 request id)"""
+    with trace_request("event", getattr(event, "webhook_event_id", None)):
+        handle_event(event)
+
+# ✅ 事件 worker pool (第一次收到事件時才啟動線程)
+event_pool = EventWorkerPool(
+    dispatch_event,
+    workers=WEBHOOK_WORKERS,
+    max_queue=WEBHOOK_QUEUE_SIZE,
+    enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT,
+    name="webhook-worker",
+)
+atexit.register(event_pool.shutdown)  # 關閉時先處理完佇列中的事件
+
+def send_reply(event, text):
+    """用 reply token 回覆；token 在佇列中等待過久而失效時改用 push"""
+    try:
+        with span("line_reply"):
+            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text))
+    except LineBotApiError as e:
+        if not ASYNC_WEBHOOK:
+            raise
+        print(f"⚠️ Reply token 失效，改用 push 發送: {e}")
+        with span("line_push"):
+            line_bot_api.push_message(event.source.user_id, TextSendMessage(text=text))
+
+# ✅ 使用者感受到的延遲：收到訊息 → 第一則回覆 / 完整回答
+first_message_latency = LatencyTracker("first_message")
+full_response_latency = LatencyTracker("full_response")
+
+def format_recipe_titles(recipes):
+    """串流模式的第一則訊息：列出找到的食譜標題"""
+    titles = "\n".join(f"{i}. {recipe.title}" for i, recipe in enumerate(recipes, 1))
+    return f"Here are some recipes I found:\n{titles}\n\nI'm writing up the details for you now..."
+
+# ✅ 進程啟動時間 (healthz 回報 uptime)
+STARTED_AT = time.time()
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """存活檢查：進程可以處理請求就回 200"""
+    return jsonify({"status": "ok", "uptime_seconds": round(time.time() - STARTED_AT, 1)})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """就緒檢查：模型、索引和元數據都載入完成才回 200，並附上各元件載入耗時"""
+    status = rag_status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """快取、佇列等執行期統計"""
+    return jsonify({
+        "query_cache": query_cache_stats(),
+        "session_cache": session_stats(),
+        "webhook_queue": event_pool.stats(),
+        "query_batching": batching_stats(),
+        "rerank": rerank_stats(),
+        "fast_path": fast_path_stats(),
+        "context": context_stats(),
+        "write_behind": write_behind_stats(),
+        "async_webhook": ASYNC_WEBHOOK,
+        "stream_responses": STREAM_RESPONSES,
+        "latency": {
+            "first_message": first_message_latency.stats(),
+            "full_response": full_response_latency.stats(),
+            "llm": llm_latency_stats(),
+        },
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus 格式的各階段耗時 histogram 和請求計數"""
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.route("/callback", methods=["POST"])
 def callback():
     """接收 LINE Webhook 回傳的訊息"""
-    signature = request.headers.get("X-Line-Signature", "")
-    body = request.get_data(as_text=True)
-    
-    print(f"📥 Received Webhook Request: {body}")
-    print(f"🔑 Signature: {signature}")
-    
-    if not body:
-        print("❌ Error: Received an empty request body!")
-        return "Bad Request - Empty Body", 400
-    
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        print("❌ Invalid Signature Error!")
-        return "Invalid Signature", 400
-    except Exception as e:
-        print(f"❌ Unexpected Error: {e}")
-        return "Internal Server Error", 500
-    
-    return "OK"
+    with trace_request("webhook") as trace:
+        signature = request.headers.get("X-Line-Signature", "")
+        body = request.get_data(as_text=True)
+
+        # 不記錄 body 和簽名 (含使用者 id 和訊息內容)
+        log(f"📥 Received Webhook Request ({len(body)} bytes)")
+
+        if not body:
+            print("❌ Error: Received an empty request body!")
+            trace.fail("bad_request")
+            return "Bad Request - Empty Body", 400
+
+        try:
+            with span("verify_signature"):
+                events = handler.parser.parse(body, signature)  # 驗證簽名和解析
+            if ASYNC_WEBHOOK:
+                if not event_pool.submit_all(events):
+                    print(f"⚠️ 事件佇列已滿 ({event_pool.max_queue})，請 LINE 稍後重送")
+                    trace.fail("busy")
+                    return "Service Busy", 503
+            else:
+                for event in events:
+                    handle_event(event)
+        except InvalidSignatureError:
+            print("❌ Invalid Signature Error!")
+            trace.fail("invalid_signature")
+            return "Invalid Signature", 400
+        except Exception as e:
+            print(f"❌ Unexpected Error: {e}")
+            trace.fail()
+            return "Internal Server Error", 500
+
+        return "OK"
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     """處理用戶發送的訊息"""
+    received_at = time.perf_counter()
     try:
         user_id = event.source.user_id
         user_input = event.message.text.lower().strip()
-        print(f"📨 Received message from user {user_id}: {user_input}")
+        log(f"📨 Received message from user {user_id}: {user_input}")
 
-        # 🔥 **強制從 Firebase 獲取最新的用戶偏好**
-        user_ref = db.collection("users").document(user_id)
-        user_data = user_ref.get()
-        stored_preferences = None
-
-        if user_data.exists:
-            stored_preferences = user_data.to_dict().get("preferences")  # 確保取的是最新數據
+        # 🔥 **每則訊息只載入一次用戶資料 (熱門用戶直接命中快取)**
+        session = session_cache.load(user_id)
+        stored_preferences = session.preferences
+        quick = quick_reply(user_input, stored_preferences) if stored_preferences is not None else None
 
         # **1️⃣ 用戶輸入 "change preference"，讓他重新輸入偏好**
         if user_input in ["change preference", "modify diet", "update preference"]:
-            user_ref.update({"preferences": firestore.DELETE_FIELD})  # 🔥 刪除偏好欄位
+            session_cache.clear_preferences(session)  # 🔥 刪除偏好欄位並讓快取失效
             response_text = "Please enter your new dietary preferences (e.g., 'I am vegetarian' or 'I avoid beef and pork')."
 
         # **2️⃣ 如果用戶沒有設定偏好，要求他輸入**
         elif stored_preferences is None:
-            user_ref.set({"preferences": user_input})  # ✅ 記錄新偏好
+            session_cache.set_preferences(session, user_input)  # ✅ 記錄新偏好
             response_text = f"Thanks! I've noted your dietary preferences: {user_input}. Now you can ask for recipe recommendations!"
 
-        # **3️⃣ 用戶已經有偏好，根據偏好推薦食譜**
-        else:
-            # ✅ **每次都重新獲取最新的偏好**
-            user_data = user_ref.get()  # **再次強制查詢最新數據**
-            stored_preferences = user_data.to_dict().get("preferences")
+        # **3️⃣ 打招呼、道謝、說明等訊息：固定回覆，不檢索也不呼叫 GPT**
+        elif quick is not None:
+            count_fast_path("quick_replies")
+            response_text = quick
 
+        # **4️⃣ 用戶已經有偏好，根據偏好推薦食譜**
+        else:
             response_text = f"Thanks for your message! We will recommend a recipe for you based on your preference: {stored_preferences}."
+            first_message_sent = False
+
+            def send_first_message(recipes):
+                """串流模式：檢索完成後立即用 reply token 回覆食譜標題"""
+                nonlocal first_message_sent
+                try:
+                    send_reply(event, f"{response_text}\n\n{format_recipe_titles(recipes)}")
+                    first_message_sent = True
+                    log(f"⚡ 第一則訊息已送出 ({first_message_latency.record_since(received_at):.0f} ms)")
+                except Exception as e:
+                    print(f"⚠️ 第一則訊息發送失敗，改為一次回覆: {e}")
+
             try:
-                recipe = chat_with_model(user_id, user_input)  # 調用 RAG 生成食譜
-                response_text += f"\n\n{recipe}"
+                recipe = chat_with_model(  # 調用 RAG 生成食譜
+                    user_id, user_input, session=session,
+                    on_recipes=send_first_message if STREAM_RESPONSES else None,
+                )
             except Exception as e:
                 print(f"❌ RAG generation failed: {e}")
-                response_text += "\n\nSorry, I encountered an error while generating your recipe."
+                recipe = "Sorry, I encountered an error while generating your recipe."
+
+            if first_message_sent:
+                # reply token 已用掉，完整回答改用 push
+                with span("line_push"):
+                    line_bot_api.push_message(user_id, TextSendMessage(text=recipe))
+                full_response_latency.record_since(received_at)
+                log(f"✅ Response pushed to user {user_id} (資料庫讀取 {session.reads} 次，寫入 {session.writes} 次)")
+                return
+            response_text += f"\n\n{recipe}"
 
         # ✅ **發送回應**
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=response_text))
-        print(f"✅ Response sent to user {user_id}")
+        send_reply(event, response_text)
+        first_message_latency.record_since(received_at)
+        full_response_latency.record_since(received_at)
+        log(f"✅ Response sent to user {user_id} (資料庫讀取 {session.reads} 次，寫入 {session.writes} 次)")
 
     except Exception as e:
         print(f"❌ Error while processing message: {e}")
+        if current_trace() is not None:
+            current_trace().fail()
 
-# ✅ 背景初始化 RAG
-thread = threading.Thread(target=initialize_rag_in_background)
-thread.daemon = True
-thread.start()
+# ✅ 背景並行載入模型、索引和元數據 (不阻塞啟動)
+start_rag()
 
 # ✅ 啟動 Flask 服務
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+import json
+import time
+import argparse
+import faiss
+import numpy as np
+
+from index_factory import (
+    create_index, train_index, search_parameters, search, index_kind, index_metric, normalize_vectors,
+    DEFAULT_TRAIN_SIZE,
+)
+from bench_index import load_vectors, parse_config, make_queries, recall_at_k, print_table, FULL_CORPUS_ROWS
+from bench_hybrid import recall_at, reciprocal_rank, relevant_set, EVAL_QUERIES_PATH
+from encoder import create_encoder, EMBEDDING_BACKEND
+
+# -----------------------------------------
+# 🔹 新索引設定和目前索引的準確度比較
+# -----------------------------------------
+# 以目前的 recipe_faiss.index 為基準，用相同的向量建立其他設定 (例如 ip + fp16 / int8)，比較：
+#   overlap@k  : 和目前索引 top-k 相同的比例
+#   exact@k    : 和 float32 cosine 暴力搜尋 top-k 相同的比例 (模型的原始度量)
+#   recall@k / mrr : eval_queries.json 的標註 (有 LLM 判斷的 judged 標註時優先使用，否則用規則標註；
+#                    需要 encoder 把查詢轉成向量)
+#   score_err  : ip 索引回傳的分數和真正 cosine 的平均誤差 (fp16 / int8 量化造成)
+#   bytes/vec、full_corpus_mb : 索引大小 (以完整 RecipeNLG 筆數估算)
+#
+#   python compare_index.py --configs flat:metric=ip flat:metric=ip,storage=fp16 flat:metric=ip,storage=int8
+
+def eval_queries(path, encoder_backend):
+    """eval_queries.json 的 (查詢向量, relevant 集合列表)；沒有 encoder 時回傳 (None, None)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            queries = json.load(f)["queries"]
+        labels = "judged" if any(relevant_set(q, "judged") for q in queries) else "rules"
+        queries = [q for q in queries if relevant_set(q, labels)]
+        encoder = create_encoder(encoder_backend)
+    except Exception as e:
+        print(f"⚠️ 無法使用 {path} 的標註查詢 ({e})，只比較合成查詢")
+        return None, None
+    if labels == "rules":
+        print("⚠️ 沒有 judged 標註，使用字面規則標註 (bench_hybrid.py --judge 產生)")
+    vectors = encoder.encode([q["query"] for q in queries])
+    return vectors, [relevant_set(q, labels) for q in queries]
+
+def evaluate(index, queries, k, exact_ids, baseline_ids, relevant=None, exact_scores=None, params=None):
+    """一組查詢在 index 上的各項指標"""
+    scores, ids = search(index, queries, k, params)
+    row = {
+        f"overlap@{k}": round(recall_at_k(ids, baseline_ids, k), 4),
+        f"exact@{k}": round(recall_at_k(ids, exact_ids, k), 4),
+    }
+    if relevant is not None:
+        ranked = [[int(i) for i in row_ids if i >= 0] for row_ids in ids]
+        row[f"recall@{k}"] = round(float(np.mean([recall_at(r, rel, k) for r, rel in zip(ranked, relevant)])), 4)
+        row["mrr"] = round(float(np.mean([reciprocal_rank(r, rel) for r, rel in zip(ranked, relevant)])), 4)
+    if exact_scores is not None and index_metric(index) == "ip":
+        row["score_err"] = round(float(np.abs(scores[:, 0] - exact_scores[:, 0]).mean()), 5)
+    return row
+
+def latency_ms(index, queries, k, params, repeat=3):
+    latencies = []
+    for _ in range(repeat):
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            search(index, queries[i:i + 1], k, params)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return round(float(np.percentile(latencies, 50)), 3)
+
+def compare(current, vectors, configs, query_sets, k, nprobe, ef_search, train_size, seed):
+    """query_sets: [(名稱, 查詢向量, relevant 或 None)]"""
+    normalized = normalize_vectors(vectors)
+    exact = faiss.IndexFlatIP(normalized.shape[1])
+    exact.add(normalized)
+
+    prepared = []
+    for name, queries, relevant in query_sets:
+        unit_queries = normalize_vectors(queries)
+        exact_scores, exact_ids = exact.search(unit_queries, k)
+        current_queries = unit_queries if index_metric(current) == "ip" else np.ascontiguousarray(queries)
+        _, baseline_ids = search(current, current_queries, k, search_parameters(current, nprobe, ef_search))
+        prepared.append((name, queries, unit_queries, relevant, exact_scores, exact_ids, baseline_ids))
+
+    indexes = [("current", current)]
+    for spec in configs:
+        index_type, options = parse_config(spec)
+        options = dict(options)
+        train_rows = options.pop("train_size", train_size)
+        data = normalized if options.get("metric") == "ip" else vectors
+        index = create_index(index_type, dim=vectors.shape[1], ntotal=len(vectors), **options)
+        if not index.is_trained:
+            rng = np.random.default_rng(seed)
+            train_index(index, data[rng.choice(len(data), size=min(train_rows, len(data)), replace=False)])
+        index.add(data)
+        indexes.append((spec, index))
+
+    results = []
+    for spec, index in indexes:
+        params = search_parameters(index, nprobe=nprobe, ef_search=ef_search)
+        size = faiss.serialize_index(index).nbytes
+        for name, queries, unit_queries, relevant, exact_scores, exact_ids, baseline_ids in prepared:
+            index_queries = unit_queries if index_metric(index) == "ip" else np.ascontiguousarray(queries)
+            row = {"config": spec, "kind": index_kind(index), "metric": index_metric(index), "queries": name}
+            row.update(evaluate(index, index_queries, k, exact_ids, baseline_ids, relevant, exact_scores, params))
+            row["p50_ms"] = latency_ms(index, index_queries, k, params)
+            row["bytes/vec"] = round(size / max(index.ntotal, 1), 1)
+            row["full_corpus_mb"] = round(size / max(index.ntotal, 1) * FULL_CORPUS_ROWS / 1e6, 1)
+            results.append(row)
+
+    # 沒有標註 / 不是 ip 的欄位以 "-" 補齊，方便列印成表格
+    columns = list(dict.fromkeys(key for row in results for key in row))
+    return [{key: row.get(key, "-") for key in columns} for row in results]
+
+def main():
+    parser = argparse.ArgumentParser(description="比較新的索引設定 (metric / storage) 和目前索引的準確度與大小")
+    parser.add_argument("--index", default="recipe_faiss.index", help="目前的索引 (比較基準)")
+    parser.add_argument("--shard-dir", default=None, help="目前索引不是 flat 時，改從 shard 目錄讀取原始向量")
+    parser.add_argument("--configs", nargs="+",
+                        default=["flat:metric=ip", "flat:metric=ip,storage=fp16", "flat:metric=ip,storage=int8",
+                                 "hnsw:metric=ip,storage=fp16"],
+                        help="要比較的設定，例如 ivf_flat:metric=ip,storage=int8,nlist=256")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", default=EVAL_QUERIES_PATH, help="有 relevant 標註的查詢")
+    parser.add_argument("--encoder", default=EMBEDDING_BACKEND)
+    parser.add_argument("--synthetic", type=int, default=500, help="合成查詢數 (語料向量 + 雜訊)")
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--train-size", type=int, default=DEFAULT_TRAIN_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="另存結果為 JSON")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)
+    current = faiss.read_index(args.index)
+    vectors = load_vectors(args.index, args.shard_dir)
+    print(f"📦 目前索引: {index_kind(current)} / {index_metric(current)}，{len(vectors)} 筆向量")
+
+    query_sets = [("synthetic", make_queries(vectors, args.synthetic, args.noise, args.seed), None)]
+    eval_vectors, relevant = eval_queries(args.queries, args.encoder)
+    if eval_vectors is not None:
+        query_sets.append(("eval", eval_vectors, relevant))
+
+    results = compare(current, vectors, args.configs, query_sets, args.k, args.nprobe, args.ef_search,
+                      args.train_size, args.seed)
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import threading
+
+# -----------------------------------------
+# 🔹 Token 計算
+# -----------------------------------------
+# 有安裝 tiktoken 時精確計算 (cl100k_base，gpt-3.5 / gpt-4 使用的編碼)，
+# 否則以「每 4 個字元約 1 個 token」估算 (英文的平均值)。
+MESSAGE_OVERHEAD_TOKENS = 4  # 每則訊息的 role / 分隔符號
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    print(f"⚠️ 無法載入 tiktoken，改用字數估算 token: {e}")
+                _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text or "", disallowed_special=()))
+    return (len(text or "") + 3) // 4
+
+def message_tokens(message):
+    return count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+def messages_tokens(messages):
+    return sum(message_tokens(message) for message in messages)
+
+# -----------------------------------------
+# 🔹 對話 context
+# -----------------------------------------
+class ConversationContext:
+    """每一輪組出送給 OpenAI 的訊息，並把舊的對話摺疊成摘要
+
+    - 系統提示 (含本輪檢索到的食譜和對話摘要) 每一輪重新產生，固定放在最前面
+    - 最近的對話從新到舊加入，直到超過 budget (prompt token 上限)
+    - 儲存的對話超過 history_budget 時，把最舊的訊息交給 summarize_fn 併入摘要，
+      只保留約一半的 history_budget，所以不會每一輪都摘要
+    """
+
+    def __init__(self, summarize_fn, budget=1500, history_budget=1200):
+        self.summarize_fn = summarize_fn
+        self.budget = budget
+        self.history_budget = history_budget
+        self._lock = threading.Lock()
+
+        # 統計
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.dropped_messages = 0
+        self.folds = 0
+        self.failed_folds = 0
+
+    def build(self, system_prompt, summary, history, user_input):
+        """系統提示 + 摘要 + 放得下的最近對話 + 使用者輸入"""
+        if summary:
+            system_prompt = f"{system_prompt}\nSummary of the earlier conversation: {summary}"
+        system = {"role": "system", "content": system_prompt}
+        user = {"role": "user", "content": user_input}
+        used = message_tokens(system) + message_tokens(user)
+
+        recent = []
+        for message in reversed(history):
+            tokens = message_tokens(message)
+            if used + tokens > self.budget:
+                break
+            recent.append(message)
+            used += tokens
+        recent.reverse()
+        # 不要從 assistant 的回答開始 (缺少對應的問題)
+        while recent and recent[0]["role"] != "user":
+            used -= message_tokens(recent.pop(0))
+
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += used
+            self.max_prompt_tokens = max(self.max_prompt_tokens, used)
+            self.dropped_messages += len(history) - len(recent)
+        return [system] + recent + [user]
+
+    def needs_fold(self, history):
+        return messages_tokens(history) > self.history_budget
+
+    def fold(self, summary, history):
+        """對話超過 history_budget 時回傳 (新摘要, 保留的對話)，否則回傳 None (會呼叫 summarize_fn，不要在回覆路徑上執行)"""
+        if not self.needs_fold(history):
+            return None
+
+        keep_budget = self.history_budget // 2
+        kept_tokens = 0
+        split = len(history)
+        while split > 0 and kept_tokens + message_tokens(history[split - 1]) <= keep_budget:
+            split -= 1
+            kept_tokens += message_tokens(history[split])
+        while split < len(history) and history[split]["role"] != "user":
+            split += 1
+        old, kept = history[:split], history[split:]
+
+        try:
+            new_summary = self.summarize_fn(summary, old)
+            with self._lock:
+                self.folds += 1
+        except Exception as e:
+            # 摘要失敗時保留舊摘要，仍然丟掉最舊的訊息，讓儲存的對話不會無限增長
+            print(f"⚠️ 對話摘要失敗，只保留最近的對話: {e}")
+            new_summary = summary
+            with self._lock:
+                self.failed_folds += 1
+        return new_summary, kept
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "history_budget": self.history_budget,
+                "requests": self.requests,
+                "avg_prompt_tokens": round(self.prompt_tokens / self.requests, 1) if self.requests else 0.0,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "dropped_messages": self.dropped_messages,
+                "folds": self.folds,
+                "failed_folds": self.failed_folds,
+            }
+
+# -----------------------------------------
+# 🔹 食譜 → prompt 文字
+# -----------------------------------------
+class RecipeFormatter:
+    """把檢索到的食譜排成精簡的 prompt 文字，合計不超過 budget 個 token
+
+    - 每個欄位先套用固定上限：最多 max_ingredients 項食材、max_steps 個步驟，每項最多 max_item_chars 個字元
+    - 全部食譜平均分配 budget (前面的食譜用不完的額度留給後面的)：
+      標題一定保留，接著放食材，再放步驟，放不下的項目以 "…" 表示
+    """
+
+    def __init__(self, budget=600, max_ingredients=20, max_steps=10, max_item_chars=200):
+        self.budget = budget
+        self.max_ingredients = max_ingredients
+        self.max_steps = max_steps
+        self.max_item_chars = max_item_chars
+        self._lock = threading.Lock()
+
+        # 統計
+        self.requests = 0
+        self.recipe_tokens = 0
+        self.truncated_items = 0
+
+    def _clip(self, item):
+        if len(item) <= self.max_item_chars:
+            return item
+        return item[:self.max_item_chars].rsplit(" ", 1)[0] + "…"
+
+    def _fit(self, items, limit, separator_tokens, remaining):
+        """依序放入項目直到超過 remaining 個 token，回傳 (放入的項目, 用掉的 token, 被省略的項目數)"""
+        kept, used = [], 0
+        for item in items[:limit]:
+            item = self._clip(item)
+            tokens = count_tokens(item) + separator_tokens
+            if used + tokens > remaining:
+                break
+            kept.append(item)
+            used += tokens
+        return kept, used, len(items) - len(kept)
+
+    def format_recipe(self, number, recipe, budget):
+        """回傳 (文字, token 數, 被省略的項目數)"""
+        title = f"{number}. {recipe.title}"
+        used = count_tokens(title) + 4  # 兩個欄位名稱和換行
+        ingredients, tokens, dropped_ingredients = self._fit(recipe.ingredients, self.max_ingredients, 1, budget - used)
+        used += tokens
+        steps, tokens, dropped_steps = self._fit(recipe.directions, self.max_steps, 2, budget - used)
+        used += tokens
+
+        lines = [title]
+        if ingredients or recipe.ingredients:
+            lines.append("Ingredients: " + "; ".join(ingredients) + ("; …" if dropped_ingredients else ""))
+        if steps or recipe.directions:
+            lines.append("Steps: " + " ".join(f"{i}) {step}" for i, step in enumerate(steps, 1))
+                         + (" …" if dropped_steps else ""))
+        return "\n".join(lines), used, dropped_ingredients + dropped_steps
+
+    def format(self, recipes):
+        blocks, total, dropped = [], 0, 0
+        for i, recipe in enumerate(recipes):
+            share = (self.budget - total) // (len(recipes) - i)
+            text, tokens, omitted = self.format_recipe(i + 1, recipe, share)
+            blocks.append(text)
+            total += tokens
+            dropped += omitted
+        with self._lock:
+            self.requests += 1
+            self.recipe_tokens += total
+            self.truncated_items += dropped
+        return "\n\n".join(blocks)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "max_ingredients": self.max_ingredients,
+                "max_steps": self.max_steps,
+                "max_item_chars": self.max_item_chars,
+                "avg_recipe_tokens": round(self.recipe_tokens / self.requests, 1) if self.requests else 0.0,
+                "truncated_items": self.truncated_items,
+            }
@@ -0,0 +1,229 @@
+import os
+import json
+import zlib
+import time
+import numpy as np
+import pandas as pd
+
+from filters import ingredient_tokens, parse_ingredients
+
+# -----------------------------------------
+# 🔹 建立索引時的近似重複食譜偵測
+# -----------------------------------------
+# 1. MinHash：每筆食譜的食材集合 (正規化後的食材名稱，例如 "brown sugar") → num_perm 個最小 hash，
+#    簽章寫到磁碟上的 memmap (每筆 num_perm × 4 bytes)，不放在記憶體中
+# 2. LSH：簽章切成 bands 段，一次處理一段：排序後同一段完全相同的食譜成為候選
+#    (記憶體只需要每筆幾個整數：band key、排序結果、union-find 的 parent)
+# 3. 驗證：候選的 MinHash Jaccard 估計值 >= jaccard_threshold，且 embedding cosine >= cosine_threshold
+#    (食材相同但做法不同的食譜，例如同一組材料的蛋糕和餅乾，會被 cosine 擋下)
+# 4. union-find 合併成 cluster，每個 cluster 只保留一筆 (步驟最完整的，同長度時保留最早出現的)
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 16        # 16 bands × 8 rows：Jaccard 約 0.7 以上才容易成為候選
+DEFAULT_JACCARD = 0.8
+DEFAULT_COSINE = 0.95
+MAX_BUCKET = 1000         # 同一個 bucket 超過這個數量時只比較前 MAX_BUCKET 筆 (極短的食材列表)
+REPORT_NAME = "dedup_report.json"
+
+_PRIME = (1 << 31) - 1
+_EMPTY = np.uint32(0xFFFFFFFF)  # 沒有食材的食譜，不參與去重
+_PAIR_BATCH = 50000
+
+def recipe_shingles(ingredients):
+    """食材 JSON 字串 → 正規化食材名稱的集合"""
+    items = (" ".join(ingredient_tokens(item)) for item in parse_ingredients(ingredients))
+    return {item for item in items if item}
+
+def minhash_signatures(shingle_sets, a, b):
+    """每筆的 shingle 集合 → (筆數, num_perm) uint32 簽章"""
+    signatures = np.full((len(shingle_sets), len(a)), _EMPTY, dtype=np.uint32)
+    lengths = np.fromiter((len(s) for s in shingle_sets), dtype=np.int64, count=len(shingle_sets))
+    if not lengths.sum():
+        return signatures
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for s in shingle_sets for shingle in s),
+        dtype=np.uint64, count=int(lengths.sum()),
+    )
+    values = (hashes[:, None] * a[None, :] + b[None, :]) % _PRIME
+    nonempty = lengths > 0
+    starts = (np.cumsum(lengths) - lengths)[nonempty]
+    signatures[nonempty] = np.minimum.reduceat(values, starts, axis=0)
+    return signatures
+
+def band_keys(signatures, rows, band, rows_per_band, chunk_size=100000):
+    """指定 rows 在第 band 段的 uint64 key (分批讀取 memmap)"""
+    columns = slice(band * rows_per_band, (band + 1) * rows_per_band)
+    keys = np.empty(len(rows), dtype=np.uint64)
+    for start in range(0, len(rows), chunk_size):
+        block = np.asarray(signatures[rows[start:start + chunk_size], columns], dtype=np.uint64)
+        key = np.full(len(block), 0xCBF29CE484222325, dtype=np.uint64)
+        for column in block.T:
+            key = (key ^ column) * np.uint64(0x100000001B3)
+        keys[start:start + chunk_size] = key
+    return keys
+
+def find_roots(parent, rows):
+    """union-find：一次找出多筆的 root"""
+    roots = parent[rows]
+    while True:
+        next_roots = parent[roots]
+        if np.array_equal(next_roots, roots):
+            return roots
+        roots = next_roots
+
+class ShardVectors:
+    """以全域行號讀取 shard 中的 embedding (每個 shard 以 mmap 開啟)"""
+
+    def __init__(self, shard_dir, manifest):
+        self._vectors = [
+            np.load(os.path.join(shard_dir, shard["name"] + ".npy"), mmap_mode="r") for shard in manifest["shards"]
+        ]
+        self._offsets = np.cumsum([0] + [shard["rows"] for shard in manifest["shards"]])
+
+    def take(self, rows):
+        shards = np.searchsorted(self._offsets, rows, side="right") - 1
+        result = np.empty((len(rows), self._vectors[0].shape[1]), dtype=np.float32)
+        for shard in np.unique(shards):
+            mask = shards == shard
+            local = rows[mask] - self._offsets[shard]
+            order = np.argsort(local)
+            block = np.empty((len(local), result.shape[1]), dtype=np.float32)
+            block[order] = self._vectors[shard][local[order]]
+            result[mask] = block
+        result /= np.maximum(np.linalg.norm(result, axis=1, keepdims=True), 1e-12)
+        return result
+
+def read_shard_column(shard_dir, manifest, columns, chunk_size):
+    """依全域行號順序讀取 shard 元數據 (每次 chunk_size 行)"""
+    for shard in manifest["shards"]:
+        path = os.path.join(shard_dir, shard["name"] + ".csv")
+        yield from pd.read_csv(path, usecols=columns, keep_default_na=False, chunksize=chunk_size)
+
+def find_duplicates(shard_dir, manifest, keep, jaccard_threshold=DEFAULT_JACCARD, cosine_threshold=DEFAULT_COSINE,
+                    num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, chunk_size=2000, seed=0):
+    """在 keep 為 True 的行中找出近似重複的食譜，回傳新的 keep (每個 cluster 只保留一筆)
+
+    報告 (移除筆數、cluster 數、索引大小估計、最大的幾個 cluster 的標題) 寫入 shard_dir/dedup_report.json。
+    """
+    if num_perm % bands:
+        raise ValueError(f"❌ num_perm={num_perm} 必須能被 bands={bands} 整除")
+    start_time = time.perf_counter()
+    n = len(keep)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    # 1. MinHash 簽章 (磁碟 memmap) 和步驟長度
+    signature_path = os.path.join(shard_dir, "minhash_signatures.tmp.npy")
+    signatures = np.lib.format.open_memmap(signature_path, mode="w+", dtype=np.uint32, shape=(n, num_perm))
+    lengths = np.zeros(n, dtype=np.int32)
+    offset = 0
+    for meta in read_shard_column(shard_dir, manifest, ["ingredients", "directions"], chunk_size):
+        rows = slice(offset, offset + len(meta))
+        signatures[rows] = minhash_signatures([recipe_shingles(i) for i in meta["ingredients"]], a, b)
+        lengths[rows] = meta["directions"].astype(str).str.len().to_numpy()
+        offset += len(meta)
+    signatures.flush()
+    print(f"🔏 已計算 {n} 筆 MinHash 簽章 ({time.perf_counter() - start_time:.1f}s)")
+
+    try:
+        # 2. LSH：每次一個 band，同一個 bucket 的食譜和 bucket 中最早的一筆配對
+        candidates = np.flatnonzero(keep & (np.asarray(signatures[:, 0]) != _EMPTY))
+        parent = np.arange(n, dtype=np.int64)
+        vectors = ShardVectors(shard_dir, manifest)
+        rows_per_band = num_perm // bands
+        checked = 0
+        for band in range(bands):
+            keys = band_keys(signatures, candidates, band, rows_per_band)
+            order = np.argsort(keys, kind="stable")
+            sorted_keys, sorted_rows = keys[order], candidates[order]
+            del keys, order
+            is_start = np.ones(len(sorted_keys), dtype=bool)
+            is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+            leader_position = np.flatnonzero(is_start)[np.cumsum(is_start) - 1]
+            position = np.arange(len(sorted_keys))
+            paired = ~is_start & (position - leader_position < MAX_BUCKET)
+            left, right = sorted_rows[leader_position[paired]], sorted_rows[paired]
+            del sorted_keys, sorted_rows, is_start, leader_position, position, paired
+
+            # 已經在同一個 cluster 的配對不再驗證
+            different = find_roots(parent, left) != find_roots(parent, right)
+            left, right = left[different], right[different]
+
+            # 3. 驗證 (Jaccard 估計值 + embedding cosine)
+            for start in range(0, len(left), _PAIR_BATCH):
+                l, r = left[start:start + _PAIR_BATCH], right[start:start + _PAIR_BATCH]
+                checked += len(l)
+                jaccard = (signatures[l] == signatures[r]).mean(axis=1)
+                l, r = l[jaccard >= jaccard_threshold], r[jaccard >= jaccard_threshold]
+                if not len(l):
+                    continue
+                cosine = np.einsum("ij,ij->i", vectors.take(l), vectors.take(r))
+                # 4. union-find 合併 (root 取行號較小的)
+                for x, y in zip(l[cosine >= cosine_threshold], r[cosine >= cosine_threshold]):
+                    root_x, root_y = find_roots(parent, np.array([x, y]))
+                    if root_x != root_y:
+                        parent[max(root_x, root_y)] = min(root_x, root_y)
+        del signatures
+    finally:
+        os.remove(signature_path)
+
+    # 每個 cluster 保留步驟最長的 (同長度時保留最早的)
+    roots = find_roots(parent, np.arange(n))
+    order = np.lexsort((np.arange(n), -lengths, roots))
+    canonical = np.zeros(n, dtype=bool)
+    canonical[order[np.r_[True, roots[order][1:] != roots[order][:-1]]]] = True
+    new_keep = keep & canonical
+
+    report = dedup_report(shard_dir, manifest, keep, new_keep, roots, chunk_size)
+    report.update({
+        "jaccard_threshold": jaccard_threshold,
+        "cosine_threshold": cosine_threshold,
+        "num_perm": num_perm,
+        "bands": bands,
+        "pairs_checked": int(checked),
+        "seconds": round(time.perf_counter() - start_time, 1),
+    })
+    with open(os.path.join(shard_dir, REPORT_NAME), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(
+        f"🧹 去重：{report['rows_before']} → {report['rows_after']} 筆 "
+        f"(移除 {report['removed']} 筆，{report['clusters']} 個重複 cluster，"
+        f"flat 索引 {report['flat_index_mb_before']} → {report['flat_index_mb_after']} MB，"
+        f"{report['seconds']}s)，報告: {os.path.join(shard_dir, REPORT_NAME)}"
+    )
+    return new_keep
+
+def dedup_report(shard_dir, manifest, keep, new_keep, roots, chunk_size, examples=10):
+    """去重統計 + 最大的幾個 cluster 的標題 (方便人工確認門檻是否合適)"""
+    removed = keep & ~new_keep
+    cluster_roots, cluster_removed = np.unique(roots[removed], return_counts=True)
+    largest = cluster_roots[np.argsort(-cluster_removed, kind="stable")[:examples]]
+    members = {root: np.flatnonzero(keep & (roots == root)) for root in largest}
+    kept_rows = {root: rows[new_keep[rows]][0] for root, rows in members.items()}
+    wanted = np.unique(np.concatenate([rows[:5] for rows in members.values()] + [list(kept_rows.values())])
+                       if members else np.array([], dtype=np.int64))
+
+    titles = {}
+    offset = 0
+    for meta in read_shard_column(shard_dir, manifest, ["title"], chunk_size):
+        local = wanted[(wanted >= offset) & (wanted < offset + len(meta))]
+        titles.update((int(row), str(meta["title"].iloc[row - offset])) for row in local)
+        offset += len(meta)
+
+    vector_mb = manifest.get("embedding_dim", 384) * 4 / 2 ** 20
+    rows_before, rows_after = int(keep.sum()), int(new_keep.sum())
+    return {
+        "rows_before": rows_before,
+        "rows_after": rows_after,
+        "removed": int(removed.sum()),
+        "removed_ratio": round(float(removed.sum()) / max(rows_before, 1), 4),
+        "clusters": len(cluster_roots),
+        "largest_cluster": int(cluster_removed.max()) + 1 if len(cluster_removed) else 0,
+        "flat_index_mb_before": round(rows_before * vector_mb, 1),
+        "flat_index_mb_after": round(rows_after * vector_mb, 1),
+        "examples": [
+            {"kept": titles.get(int(kept_rows[root])), "size": len(members[root]),
+             "titles": [titles.get(int(row)) for row in members[root][:5]]}
+            for root in largest
+        ],
+    }
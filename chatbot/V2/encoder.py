@@ -0,0 +1,112 @@
+import os
+import numpy as np
+
+# -----------------------------------------
+# 🔹 Embedding 後端
+# -----------------------------------------
+# EMBEDDING_BACKEND=torch (預設，sentence-transformers) | onnx | onnx-int8
+# 三者都輸出和 all-MiniLM-L6-v2 相同的 384 維、L2 正規化向量，
+# 可以直接查詢既有的 recipe_faiss.index (用 export_onnx.py --check 驗證)。
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_model")
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+ONNX_TOKENIZER_FILE = "tokenizer.json"
+
+# all-MiniLM-L6-v2 的 max_seq_length
+MAX_SEQ_LENGTH = 256
+
+class SentenceTransformerEncoder:
+    """PyTorch sentence-transformers 後端"""
+
+    name = "torch"
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size=64):
+        embeddings = self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+class OnnxEncoder:
+    """onnxruntime 後端 (export_onnx.py 匯出的 fp32 或 int8 模型)
+
+    流程和 sentence-transformers 相同：tokenize → transformer → mean pooling → L2 正規化。
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=False, threads=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.name = "onnx-int8" if quantized else "onnx"
+        model_path = os.path.join(model_dir, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        tokenizer_path = os.path.join(model_dir, ONNX_TOKENIZER_FILE)
+        for path in (model_path, tokenizer_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"❌ 找不到 {path}，請先執行 python export_onnx.py")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        threads = threads or int(os.getenv("ONNX_THREADS", "0"))
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        # mean pooling (只計算非 padding 的 token)
+        mask = attention_mask[..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        # L2 正規化
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def encode(self, texts, batch_size=64):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        batches = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        return np.ascontiguousarray(np.vstack(batches), dtype=np.float32)
+
+def create_encoder(backend=None):
+    """依 EMBEDDING_BACKEND 環境變數建立 encoder"""
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if backend == "torch":
+        return SentenceTransformerEncoder()
+    if backend == "onnx":
+        return OnnxEncoder(quantized=False)
+    if backend == "onnx-int8":
+        return OnnxEncoder(quantized=True)
+    raise ValueError(f"❌ 不支援的 EMBEDDING_BACKEND: {backend} (可用: {', '.join(ENCODER_BACKENDS)})")
+
+def cosine_similarities(a, b):
+    """兩組向量逐列的 cosine similarity"""
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return (a * b).sum(axis=1)
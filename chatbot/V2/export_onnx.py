@@ -0,0 +1,134 @@
+import os
+import json
+import argparse
+import numpy as np
+
+from encoder import (
+    EMBEDDING_MODEL_NAME, ONNX_MODEL_DIR, ONNX_MODEL_FILE, ONNX_INT8_MODEL_FILE, ONNX_TOKENIZER_FILE,
+    SentenceTransformerEncoder, OnnxEncoder, cosine_similarities,
+)
+
+# 匯出和驗證需要額外的套件 (只在建置時使用，線上服務只需要 onnxruntime + tokenizers)：
+#   pip install torch transformers onnx onnxruntime
+HF_MODEL_ID = f"sentence-transformers/{EMBEDDING_MODEL_NAME}"
+
+SAMPLE_QUERIES = [
+    "chicken", "vegan dinner", "quick breakfast", "leftover rice eggs scallion",
+    "something sweet without an oven", "i avoid beef and pork", "easy soup for a cold day",
+    "gluten free dessert", "what can i cook with potatoes and cheese", "hi",
+]
+
+def model_size_mb(path):
+    """模型大小 (含 torch 新版 exporter 另存的 .data 權重檔)"""
+    size = os.path.getsize(path)
+    if os.path.exists(path + ".data"):
+        size += os.path.getsize(path + ".data")
+    return size / 1e6
+
+def export(model_dir=ONNX_MODEL_DIR, opset=17):
+    """把 HuggingFace transformer 匯出成 ONNX (pooling 和正規化在 OnnxEncoder 中用 numpy 完成)"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(HF_MODEL_ID)
+    model = AutoModel.from_pretrained(HF_MODEL_ID)
+    model.eval()
+
+    dummy = tokenizer(["a recipe"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    model_path = os.path.join(model_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    tokenizer.backend_tokenizer.save(os.path.join(model_dir, ONNX_TOKENIZER_FILE))
+    print(f"✅ 已匯出 {model_path} ({model_size_mb(model_path):.1f} MB)")
+    return model_path
+
+def quantize(model_dir=ONNX_MODEL_DIR):
+    """動態 int8 量化 (權重 int8，activation 執行時量化)"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    source = os.path.join(model_dir, ONNX_MODEL_FILE)
+    target = os.path.join(model_dir, ONNX_INT8_MODEL_FILE)
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    print(f"✅ 已量化 {target} ({model_size_mb(target):.1f} MB)")
+    return target
+
+def sample_texts(n_recipes):
+    """驗證用的文字：常見查詢 + 索引中的食譜文本 (和建立索引時相同的格式)"""
+    texts = list(SAMPLE_QUERIES)
+    try:
+        from metadata_store import MetadataStore
+        store = MetadataStore()
+        step = max(len(store) // max(n_recipes, 1), 1)
+        for i in range(0, len(store), step)[:n_recipes]:
+            r = store[i]
+            ingredients = json.dumps(list(r.ingredients), ensure_ascii=False)
+            directions = json.dumps(list(r.directions), ensure_ascii=False)
+            texts.append(f"Title: {r.title}\nIngredients: {ingredients}\nInstructions: {directions}")
+    except FileNotFoundError:
+        print("⚠️ 找不到元數據，只用查詢樣本驗證")
+    return texts
+
+def check(model_dir=ONNX_MODEL_DIR, tolerance=0.99, n_recipes=200, index_path="recipe_faiss.index", k=3):
+    """確認 ONNX 向量和原始模型的 cosine similarity 都在容許範圍內，並比較既有索引的 top-k"""
+    texts = sample_texts(n_recipes)
+    reference = SentenceTransformerEncoder().encode(texts)
+
+    ok = True
+    for quantized in (False, True):
+        if not os.path.exists(os.path.join(model_dir, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)):
+            continue
+        encoder = OnnxEncoder(model_dir, quantized=quantized)
+        vectors = encoder.encode(texts)
+        if vectors.shape != reference.shape:
+            print(f"❌ {encoder.name}: 維度不符 {vectors.shape} != {reference.shape}")
+            ok = False
+            continue
+
+        sims = cosine_similarities(reference, vectors)
+        passed = bool(sims.min() >= tolerance)
+        ok = ok and passed
+        print(
+            f"{'✅' if passed else '❌'} {encoder.name}: cosine min={sims.min():.5f} "
+            f"mean={sims.mean():.5f} (容許 >= {tolerance})"
+        )
+
+        # 用既有索引比較查詢結果是否一致
+        if os.path.exists(index_path):
+            import faiss
+            index = faiss.read_index(index_path)
+            n = len(SAMPLE_QUERIES)
+            _, ref_ids = index.search(reference[:n], k)
+            _, new_ids = index.search(vectors[:n], k)
+            overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_ids, new_ids)])
+            print(f"   既有索引 top-{k} 重疊率: {overlap:.3f}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="匯出 all-MiniLM-L6-v2 為 ONNX / int8 並驗證向量一致性")
+    parser.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="只匯出 fp32 ONNX")
+    parser.add_argument("--check-only", action="store_true", help="不匯出，只驗證既有的 ONNX 模型")
+    parser.add_argument("--tolerance", type=float, default=0.99,
+                        help="每個向量和原始模型的最小 cosine similarity")
+    parser.add_argument("--recipes", type=int, default=200, help="驗證用的食譜數")
+    args = parser.parse_args()
+
+    if not args.check_only:
+        export(args.model_dir)
+        if not args.no_quantize:
+            quantize(args.model_dir)
+    if not check(args.model_dir, args.tolerance, args.recipes):
+        raise SystemExit("❌ ONNX 向量超出容許誤差，既有索引可能不再適用")
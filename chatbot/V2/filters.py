@@ -0,0 +1,409 @@
+import os
+import re
+import json
+import argparse
+from functools import lru_cache
+
+import faiss
+import numpy as np
+
+from index_factory import search_parameters, search
+
+# -----------------------------------------
+# 🔹 食材倒排索引 + 飲食標籤
+# -----------------------------------------
+# recipe_filters.json              : 版本、筆數、食材詞彙表 (token 依 id 排序) 和標籤名稱
+# recipe_ingredient_offsets.npy    : CSR offset (int64，長度 = 詞彙數 + 1)
+# recipe_ingredient_postings.npy   : CSR 內容，每個 token 包含它的食譜行號 (int32，已排序)
+# recipe_tags.npy                  : 每筆食譜一個 uint16 bitmask (「含有」哪些類別)
+# 所有 .npy 都以 mmap 開啟，查詢時只讀取用到的 posting list。
+FILTER_META_PATH = "recipe_filters.json"
+FILTER_OFFSETS_PATH = "recipe_ingredient_offsets.npy"
+FILTER_POSTINGS_PATH = "recipe_ingredient_postings.npy"
+FILTER_TAGS_PATH = "recipe_tags.npy"
+FILTER_VERSION = 1
+
+# ✅ 先過採樣再過濾：取 k * FILTER_OVERSAMPLE 筆，不夠時放大，超過 FILTER_MAX_FETCH 改用 ID selector
+FILTER_OVERSAMPLE = int(os.getenv("FILTER_OVERSAMPLE", "10"))
+FILTER_MAX_FETCH = int(os.getenv("FILTER_MAX_FETCH", "1000"))
+
+# 類別 → 食材關鍵字 (以整個字比對；刪掉 NOT_MATCHING 中的詞組後再比對，避免 peanut butter 被當成乳製品等誤判)
+TAG_KEYWORDS = {
+    "beef": ["beef", "steak", "veal", "brisket", "sirloin", "hamburger", "ground chuck", "chuck roast", "oxtail"],
+    "pork": ["pork", "bacon", "ham", "sausages?", "prosciutto", "pancetta", "chorizo", "salami", "pepperoni",
+             "lard", "hot dogs?", "frankfurters?", "spareribs"],
+    "poultry": ["chicken", "turkey", "duck", "goose", "hens?"],
+    "meat": ["meat", "meaty", "meatballs?", "soup bones?", "marrow", "suet", "lamb", "mutton", "venison", "goat",
+             "rabbit", "gelatin", "jello"],
+    "fish": ["fish", "salmon", "tuna", "cod", "anchov(?:y|ies)", "sardines?", "tilapia", "halibut", "trout",
+             "haddock", "catfish", "mackerel", "snapper"],
+    "shellfish": ["shrimps?", "prawns?", "crabs?", "crabmeat", "lobsters?", "clams?", "mussels?", "oysters?",
+                  "scallops?", "crawfish", "crayfish"],
+    "dairy": ["milk", "butter", "buttermilk", "cheese", "cheddar", "mozzarella", "parmesan", "ricotta", "cream",
+              "yogh?urt", "ghee", "whey"],
+    "egg": ["eggs?", "yolks?", "egg whites?", "mayonnaise"],
+    "gluten": ["flour", "wheat", "bread", "breadcrumbs", "bread crumbs", "pasta", "spaghetti", "macaroni",
+               "noodles", "barley", "rye", "crackers?", "biscuits?", "soy sauce", "couscous", "bulgur",
+               "semolina", "cake mix", "bisquick", "croutons", "pie crust", "graham"],
+    "nuts": ["nuts?", "almonds?", "walnuts?", "pecans?", "cashews?", "pistachios?", "hazelnuts?", "macadamias?",
+             "peanuts?", "peanut butter"],
+    "alcohol": ["wine", "beer", "rum", "vodka", "brandy", "whiske?y", "bourbon", "sherry", "liqueur", "tequila",
+                "gin", "sake", "kahlua", "champagne"],
+    "honey": ["honey"],
+}
+TAGS = tuple(TAG_KEYWORDS)
+TAG_BITS = {tag: 1 << i for i, tag in enumerate(TAGS)}
+
+NOT_MATCHING = [
+    "peanut butter", "coconut milk", "almond milk", "soy milk", "rice milk", "oat milk", "cream of tartar",
+    "cocoa butter", "apple butter", "wine vinegar", "rice flour", "almond flour", "coconut flour", "corn flour",
+    "rice noodles", "gluten-free", "gluten free", "egg substitute", "vegan", "dairy-free", "dairy free",
+]
+_NOT_MATCHING_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, NOT_MATCHING)) + r")\b")
+_TAG_RES = {tag: re.compile(r"\b(?:" + "|".join(words) + r")\b") for tag, words in TAG_KEYWORDS.items()}
+# peanut butter 不是乳製品，但仍然是堅果
+_TAG_EXTRA_RES = {"nuts": re.compile(r"\bpeanut butter\b")}
+
+def _mask(*tags):
+    mask = 0
+    for tag in tags:
+        mask |= TAG_BITS[tag]
+    return mask
+
+MEAT_MASK = _mask("beef", "pork", "poultry", "meat")
+VEGETARIAN_MASK = MEAT_MASK | _mask("fish", "shellfish")
+
+# 飲食習慣 → 排除的類別
+DIET_MASKS = {
+    r"vegan": VEGETARIAN_MASK | _mask("dairy", "egg", "honey"),
+    r"vegetarian|veggie": VEGETARIAN_MASK,
+    r"pescatarian|pescetarian": MEAT_MASK,
+    r"gluten[- ]free|celiac|coeliac": _mask("gluten"),
+    r"dairy[- ]free|lactose": _mask("dairy"),
+    r"nut[- ]free|nut allergy": _mask("nuts"),
+    r"halal": _mask("pork", "alcohol"),
+    r"kosher": _mask("pork", "shellfish"),
+    r"sober|alcohol[- ]free": _mask("alcohol"),
+}
+_DIET_RES = [(re.compile(rf"\b(?:{pattern})\b"), mask) for pattern, mask in DIET_MASKS.items()]
+
+# 偏好中「不吃 X」的 X 中出現類別名稱 (單字或兩個字的詞組) 時排除整個類別，其餘的字排除該食材 token
+CATEGORY_MASKS = {
+    "meat": MEAT_MASK, "red meat": _mask("beef", "pork", "meat"), "beef": _mask("beef"), "pork": _mask("pork"),
+    "poultry": _mask("poultry"), "fish": _mask("fish"), "seafood": _mask("fish", "shellfish"),
+    "shellfish": _mask("shellfish"), "dairy": _mask("dairy"), "lactose": _mask("dairy"), "egg": _mask("egg"),
+    "gluten": _mask("gluten"), "wheat": _mask("gluten"), "nut": _mask("nuts"), "tree nut": _mask("nuts"),
+    "peanut": _mask("nuts"), "alcohol": _mask("alcohol"), "honey": _mask("honey"),
+}
+_NEGATION_RE = re.compile(
+    r"\b(?:no|not|avoid|avoids|without|exclude|hate|dislike|except|stay away from|not a fan of|"
+    r"(?:do not|don't|dont|doesn't|does not|can't|cant|cannot|can not|never|won't|will not) "
+    r"(?:eat|like|want|have|stand)|allergic to|allergy to|intolerant to|free of)\s+"
+    r"([a-z ,&/'-]+?)(?=[.;!?]|\bbut\b|$)"
+)
+_FREE_RE = re.compile(r"\b([a-z]+)[- ]free\b")
+_ALLERGY_RE = re.compile(r"\b([a-z]+) allerg(?:y|ies|ic)\b")
+_LIST_SPLIT_RE = re.compile(r",|&|/|\band\b|\bor\b|\bnor\b")
+
+# -----------------------------------------
+# 🔹 食材文字正規化
+# -----------------------------------------
+INGREDIENT_STOPWORDS = frozenset("""
+    a an and or of the to for with into in on at as by from about plus more each per x
+    c cup cups tbsp tbs tbl tablespoon tablespoons tsp teaspoon teaspoons lb lbs pound pounds oz ounce ounces
+    g gram grams kg ml l liter qt quart quarts pt pint pints gal gallon pkg pkgs package packages can cans jar
+    jars box boxes bottle carton container envelope stick sticks pinch dash handful bunch inch inches
+    large small medium big fresh freshly chopped diced minced sliced crushed ground grated shredded divided
+    optional cooked uncooked melted softened beaten cut piece pieces finely coarsely thinly roughly lightly
+    whole lean extra low fat free frozen canned dried drained rinsed peeled seeded room temperature warm cold
+    well packed firmly level heaping halved quartered cubed trimmed boneless skinless taste needed desired
+    into about approximately additional such like if any other your
+""".split())
+
+# 偏好文字中不是食材的字 (代名詞、語氣詞、縮寫的殘片 "i'm" → i / m 等)，不當作排除的食材
+PREFERENCE_STOPWORDS = frozenset("""
+    i m im me my we us our you it its s t d ll ve re am is are be been please pls thanks thank too also
+    really very much so just at all eat eating food foods dish dishes anything something stuff kind
+    like want have stand allergic allergy allergies intolerant intolerance either neither nor but
+""".split())
+
+_PAREN_RE = re.compile(r"\([^)]*\)")
+_WORD_RE = re.compile(r"[a-z]+")
+
+@lru_cache(maxsize=65536)
+def normalize_token(word):
+    """簡單的單數化 (tomatoes → tomato, berries → berry, eggs → egg)"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+def ingredient_tokens(text):
+    """食材文字 → 正規化的 token (去掉數量、單位、括號說明和處理方式)"""
+    text = _PAREN_RE.sub(" ", str(text).lower())
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        if len(word) < 2 or word in INGREDIENT_STOPWORDS:
+            continue
+        token = normalize_token(word)
+        if token not in INGREDIENT_STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+def parse_ingredients(ingredients):
+    """metadata 中的 ingredients (JSON 字串列表) → 食材字串列表"""
+    if isinstance(ingredients, (list, tuple)):
+        return [str(item) for item in ingredients]
+    try:
+        items = json.loads(ingredients)
+        return [str(item) for item in items] if isinstance(items, list) else [str(items)]
+    except (TypeError, ValueError):
+        return [str(ingredients)]
+
+def ingredient_tags(items, title=""):
+    """食材列表 (和標題) → 類別 bitmask
+
+    標題也一起比對：有些食譜的食材列表不完整 (例如 "Chicken Broccoli Casserole" 只列出 stuffing)。
+    """
+    text = _PAREN_RE.sub(" ", " ; ".join([str(title)] + list(items)).lower())
+    cleaned = _NOT_MATCHING_RE.sub(" ", text)
+    mask = 0
+    for tag, pattern in _TAG_RES.items():
+        if pattern.search(cleaned) or (tag in _TAG_EXTRA_RES and _TAG_EXTRA_RES[tag].search(text)):
+            mask |= TAG_BITS[tag]
+    return mask
+
+def tag_names(mask):
+    return [tag for tag in TAGS if mask & TAG_BITS[tag]]
+
+# -----------------------------------------
+# 🔹 過濾條件
+# -----------------------------------------
+class RecipeFilter:
+    """排除的類別 (bitmask)、排除的食材和必須包含的食材"""
+
+    __slots__ = ("exclude_tags", "exclude_ingredients", "include_ingredients")
+
+    def __init__(self, exclude_tags=0, exclude_ingredients=(), include_ingredients=()):
+        self.exclude_tags = int(exclude_tags)
+        self.exclude_ingredients = tuple(sorted({normalize_token(t) for t in exclude_ingredients}))
+        self.include_ingredients = tuple(sorted({normalize_token(t) for t in include_ingredients}))
+
+    def __bool__(self):
+        return bool(self.exclude_tags or self.exclude_ingredients or self.include_ingredients)
+
+    def key(self):
+        """查詢結果快取用的 key"""
+        return (self.exclude_tags, self.exclude_ingredients, self.include_ingredients)
+
+    def __repr__(self):
+        return (f"RecipeFilter(exclude_tags={tag_names(self.exclude_tags)}, "
+                f"exclude={list(self.exclude_ingredients)}, include={list(self.include_ingredients)})")
+
+@lru_cache(maxsize=4096)
+def parse_preferences(text):
+    """從使用者的飲食偏好文字解析出排除條件 (例如 "I avoid beef and pork" → 排除 beef / pork 類別)"""
+    text = str(text or "").lower().replace("’", "'")
+    exclude_tags = 0
+    exclude_ingredients = set()
+
+    for pattern, mask in _DIET_RES:
+        if pattern.search(text):
+            exclude_tags |= mask
+
+    phrases = []
+    for match in _NEGATION_RE.finditer(text):
+        phrases.extend(_LIST_SPLIT_RE.split(match.group(1)))
+    phrases.extend(match.group(1) for match in _FREE_RE.finditer(text))
+    phrases.extend(match.group(1) for match in _ALLERGY_RE.finditer(text))
+
+    for phrase in phrases:
+        words = [normalize_token(word) for word in _WORD_RE.findall(phrase)]
+        words = [word for word in words if word not in INGREDIENT_STOPWORDS and word not in PREFERENCE_STOPWORDS]
+        # 先比對兩個字的類別 (red meat、tree nut)，再比對單字；沒有對應類別的字排除該食材
+        i = 0
+        while i < len(words):
+            pair = " ".join(words[i:i + 2])
+            if i + 1 < len(words) and pair in CATEGORY_MASKS:
+                exclude_tags |= CATEGORY_MASKS[pair]
+                i += 2
+                continue
+            if words[i] in CATEGORY_MASKS:
+                exclude_tags |= CATEGORY_MASKS[words[i]]
+            else:
+                exclude_ingredients.add(words[i])
+            i += 1
+    return RecipeFilter(exclude_tags, exclude_ingredients)
+
+# -----------------------------------------
+# 🔹 建立索引
+# -----------------------------------------
+class FilterIndexBuilder:
+    """依序加入每筆食譜的標題和 ingredients，save 時輸出 CSR 倒排索引和標籤"""
+
+    def __init__(self):
+        self.vocab = {}
+        self._token_ids = []  # 每筆食譜的 token id (np.int32)
+        self._tags = []
+
+    def add(self, title, ingredients):
+        items = parse_ingredients(ingredients)
+        ids = {self.vocab.setdefault(token, len(self.vocab)) for item in items for token in ingredient_tokens(item)}
+        self._token_ids.append(np.fromiter(ids, dtype=np.int32, count=len(ids)))
+        self._tags.append(ingredient_tags(items, title))
+
+    def extend(self, rows):
+        for title, ingredients in rows:
+            self.add(title, ingredients)
+
+    def __len__(self):
+        return len(self._tags)
+
+    def save(self, meta_path=FILTER_META_PATH, offsets_path=FILTER_OFFSETS_PATH,
+             postings_path=FILTER_POSTINGS_PATH, tags_path=FILTER_TAGS_PATH):
+        rows = len(self)
+        counts = np.fromiter((len(ids) for ids in self._token_ids), dtype=np.int64, count=rows)
+        token_ids = np.concatenate(self._token_ids) if rows else np.zeros(0, dtype=np.int32)
+        row_ids = np.repeat(np.arange(rows, dtype=np.int32), counts)
+
+        # 依 token 排序 (stable，同一個 token 內的行號保持遞增)，並把 token id 重新編號為字母順序
+        order = sorted(self.vocab, key=self.vocab.get)
+        alphabetical = np.argsort(np.array(order, dtype=object)).astype(np.int64)
+        remap = np.empty(len(order), dtype=np.int64)
+        remap[alphabetical] = np.arange(len(order))
+        token_ids = remap[token_ids]
+        permutation = np.argsort(token_ids, kind="stable")
+        postings = row_ids[permutation]
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(token_ids, minlength=len(order)), out=offsets[1:])
+
+        for path, array in ((offsets_path, offsets), (postings_path, postings),
+                            (tags_path, np.array(self._tags, dtype=np.uint16))):
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+        meta = {
+            "version": FILTER_VERSION,
+            "rows": rows,
+            "tags": list(TAGS),
+            "vocab": [order[i] for i in alphabetical],
+        }
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+        print(f"✅ 已建立過濾索引: {rows} 筆食譜, {len(order)} 個食材 token, {len(postings)} 筆 posting")
+
+def build_from_metadata(metadata_store):
+    """由既有的 recipe_metadata.bin 建立過濾索引 (不需要重新 encode)"""
+    builder = FilterIndexBuilder()
+    for recipe in metadata_store:
+        builder.add(recipe.title, recipe.ingredients)
+    builder.save()
+    return builder
+
+# -----------------------------------------
+# 🔹 查詢
+# -----------------------------------------
+class FilterIndex:
+    """以 mmap 讀取的食材倒排索引和標籤，提供過濾後的 FAISS 搜尋"""
+
+    def __init__(self, meta_path=FILTER_META_PATH, offsets_path=FILTER_OFFSETS_PATH,
+                 postings_path=FILTER_POSTINGS_PATH, tags_path=FILTER_TAGS_PATH):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FILTER_VERSION or tuple(meta.get("tags", ())) != TAGS:
+            raise ValueError(f"❌ {meta_path} 版本不符，請重新執行 python filters.py")
+        self.rows = meta["rows"]
+        self.vocab = {token: i for i, token in enumerate(meta["vocab"])}
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self.postings = np.load(postings_path, mmap_mode="r")
+        self.tags = np.load(tags_path, mmap_mode="r")
+
+    def __len__(self):
+        return self.rows
+
+    def posting(self, token):
+        """包含某個食材 token 的行號 (已排序)"""
+        token_id = self.vocab.get(normalize_token(token))
+        if token_id is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.postings[self.offsets[token_id]:self.offsets[token_id + 1]]
+
+    def allowed(self, ids, recipe_filter):
+        """ids 中每筆是否符合過濾條件"""
+        ids = np.asarray(ids, dtype=np.int64)
+        ok = (ids >= 0) & (ids < self.rows)
+        ok[ok] = (self.tags[ids[ok]] & recipe_filter.exclude_tags) == 0
+        for token in recipe_filter.exclude_ingredients:
+            ok &= ~_contains(self.posting(token), ids)
+        for token in recipe_filter.include_ingredients:
+            ok &= _contains(self.posting(token), ids)
+        return ok
+
+    def candidates(self, recipe_filter):
+        """有必須包含的食材時，回傳符合條件的行號；沒有時回傳 None (代表全部)"""
+        if not recipe_filter.include_ingredients:
+            return None
+        postings = sorted((self.posting(t) for t in recipe_filter.include_ingredients), key=len)
+        ids = np.asarray(postings[0], dtype=np.int64)
+        for posting in postings[1:]:
+            ids = ids[_contains(posting, ids)]
+        return ids[self.allowed(ids, recipe_filter)] if len(ids) else ids
+
+    def bitmap(self, recipe_filter, ids=None):
+        """符合條件的行號 bitmap (IDSelectorBitmap 使用，bit i 代表第 i 筆)"""
+        if ids is None:
+            mask = (self.tags & recipe_filter.exclude_tags) == 0
+            for token in recipe_filter.exclude_ingredients:
+                mask[self.posting(token)] = False
+        else:
+            mask = np.zeros(self.rows, dtype=bool)
+            mask[ids] = True
+        return np.packbits(mask, bitorder="little")
+
+    def search(self, index, query, k, recipe_filter, nprobe=None, ef_search=None):
+        """過濾後的 top-k 行號
+
+        沒有必須包含的食材時先過採樣 (k * FILTER_OVERSAMPLE) 再過濾，大部分查詢只需要一次普通搜尋；
+        過採樣仍不足 k 筆或有必須包含的食材時，改用 IDSelectorBitmap 只在符合條件的向量中搜尋。
+        """
+        candidates = self.candidates(recipe_filter)
+        if candidates is None:
+            fetch = min(k * FILTER_OVERSAMPLE, index.ntotal)
+            while True:
+                _, indices = search(index, query, fetch, search_parameters(index, nprobe=nprobe, ef_search=ef_search))
+                ids = indices[0][indices[0] >= 0]
+                ids = ids[self.allowed(ids, recipe_filter)]
+                if len(ids) >= k or fetch >= index.ntotal:
+                    return tuple(int(i) for i in ids[:k])
+                if fetch * 4 > FILTER_MAX_FETCH:
+                    break
+                fetch = min(fetch * 4, index.ntotal)
+        elif len(candidates) == 0:
+            return ()
+
+        bitmap = self.bitmap(recipe_filter, candidates)
+        selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+        params = search_parameters(index, nprobe=nprobe, ef_search=ef_search, selector=selector)
+        _, indices = search(index, query, k, params)
+        return tuple(int(i) for i in indices[0] if i >= 0)
+
+def _contains(sorted_ids, ids):
+    """ids 中每個值是否出現在已排序的 sorted_ids 中"""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions >= len(sorted_ids)] = 0
+    return np.asarray(sorted_ids)[positions] == ids
+
+if __name__ == "__main__":
+    from metadata_store import MetadataStore, METADATA_PATH, METADATA_INDEX_PATH
+
+    parser = argparse.ArgumentParser(description="由 recipe_metadata.bin 建立食材倒排索引和飲食標籤")
+    parser.add_argument("--metadata", default=METADATA_PATH)
+    parser.add_argument("--metadata-index", default=METADATA_INDEX_PATH)
+    args = parser.parse_args()
+    build_from_metadata(MetadataStore(args.metadata, args.metadata_index))
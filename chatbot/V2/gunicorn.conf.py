@@ -0,0 +1,43 @@
+import os
+import multiprocessing
+
+# -----------------------------------------
+# 🔹 gunicorn 多 worker 設定
+# -----------------------------------------
+#   gunicorn -c gunicorn.conf.py chatbot:app
+#
+# preload_app：master 先 import chatbot，等模型、FAISS 索引載入完成才 fork worker，
+# worker 以 copy-on-write 共用這些記憶體頁面 (元數據 / 食材倒排索引 / BM25 本身就是 mmap)，
+# 所以記憶體不會隨 worker 數倍增。背景線程 (webhook worker、查詢批次、write-behind) 都在 fork 之後
+# 第一次使用時才啟動；onnxruntime session、SQLite 連線和 Firestore client 在 post_fork 中重新建立
+# (gRPC 連線不能跨 fork 使用，每個 worker 用自己的 client；master 最好不要呼叫 Firestore，FIREBASE_CONNECTION_TEST=0)。
+# PRELOAD_APP=0 時每個 worker 各自載入 (舊行為，用於比較記憶體用量，見 bench_workers.py)。
+# 每個 worker 有自己的 session 快取：SESSION_REVALIDATE=1 (預設) 時每則訊息重新讀取使用者資料，
+# 其他 worker 修改的偏好和新增的訊息立即生效；訊息序號由儲存後端在 transaction 中分配 (見 storage.py)。
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# WEB_CONCURRENCY 預設 2 個 worker (舊的 procfile 只有 1 個)；memory 後端的資料只存在各自的 process 中，
+# worker 之間看不到彼此的資料，所以預設只用 1 個 worker。
+storage_backend = os.getenv("STORAGE_BACKEND", "firestore").lower()
+workers = int(os.getenv("WEB_CONCURRENCY", "1" if storage_backend == "memory" else "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+preload_app = os.getenv("PRELOAD_APP", "1") == "1"
+
+# 每個 worker 的 faiss / torch / onnxruntime 計算線程數 (預設把 CPU 平均分給各 worker)
+compute_threads = int(os.getenv("WORKER_COMPUTE_THREADS", "0")) or max(1, multiprocessing.cpu_count() // workers)
+
+def when_ready(server):
+    """master 開始 fork 前等待 RAG 載入完成 (chatbot import 時已開始背景載入)"""
+    if not preload_app:
+        return
+    import RAG
+    RAG.startup.wait()
+    server.log.info(f"RAG 載入完成，fork {workers} 個 worker: {RAG.startup.summary()}")
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    import RAG
+    RAG.after_fork(threads=compute_threads)
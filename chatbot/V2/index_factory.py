@@ -0,0 +1,156 @@
+import faiss
+import numpy as np
+
+# -----------------------------------------
+# 🔹 FAISS 索引類型
+# -----------------------------------------
+# flat     : 暴力搜尋 (精確，記憶體 = 1.5KB/筆)
+# ivf_flat : 倒排 + 原始向量 (nprobe 控制召回率/延遲)
+# ivf_pq   : 倒排 + Product Quantization 壓縮 (每筆只佔 pq_m bytes)
+# hnsw     : 圖索引 (efSearch 控制召回率/延遲，記憶體比 flat 大)
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# metric  : l2 (歐氏距離) | ip (內積：向量 L2 正規化後就是 cosine similarity，all-MiniLM-L6-v2 訓練時使用的度量)
+# storage : float32 (每維 4 bytes) | fp16 (scalar quantizer，每維 2 bytes) | int8 (每維 1 byte，需要訓練)
+#           ivf_pq 本身已經壓縮，只支援 float32 (代表不另外做 scalar quantization)
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+STORAGE_TYPES = {"float32": None, "fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+DEFAULT_PQ_M = 48
+DEFAULT_PQ_NBITS = 8
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_TRAIN_SIZE = 100000
+
+def default_nlist(ntotal):
+    """IVF 的 cluster 數：約 4 * sqrt(N)，並確保每個 cluster 至少有 39 筆訓練資料"""
+    nlist = int(4 * np.sqrt(max(ntotal, 1)))
+    return max(1, min(nlist, ntotal // 39))
+
+def create_index(index_type="flat", dim=384, ntotal=0, nlist=None, pq_m=DEFAULT_PQ_M,
+                 pq_nbits=DEFAULT_PQ_NBITS, hnsw_m=DEFAULT_HNSW_M,
+                 ef_construction=DEFAULT_EF_CONSTRUCTION, metric="l2", storage="float32"):
+    """依類型建立空的 FAISS 索引 (IVF 類型和 int8 storage 需要再呼叫 train_index)
+
+    metric="ip" 時加入和查詢的向量都必須先 L2 正規化 (normalize_vectors)。
+    """
+    if metric not in METRICS:
+        raise ValueError(f"❌ 不支援的 metric: {metric} (可用: {', '.join(METRICS)})")
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"❌ 不支援的 storage: {storage} (可用: {', '.join(STORAGE_TYPES)})")
+    metric_type, qtype = METRICS[metric], STORAGE_TYPES[storage]
+
+    if index_type == "flat":
+        if qtype is not None:
+            return faiss.IndexScalarQuantizer(dim, qtype, metric_type)
+        return faiss.IndexFlatIP(dim) if metric == "ip" else faiss.IndexFlatL2(dim)
+
+    if index_type == "hnsw":
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(dim, qtype, hnsw_m, metric_type)
+        else:
+            index = faiss.IndexHNSWFlat(dim, hnsw_m, metric_type)
+        index.hnsw.efConstruction = ef_construction
+        return index
+
+    if nlist is None:
+        nlist = default_nlist(ntotal)
+    quantizer = faiss.IndexFlatIP(dim) if metric == "ip" else faiss.IndexFlatL2(dim)
+
+    if index_type == "ivf_flat":
+        if qtype is not None:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, metric_type)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, metric_type)
+
+    if index_type == "ivf_pq":
+        if dim % pq_m != 0:
+            raise ValueError(f"❌ pq_m={pq_m} 必須能整除向量維度 {dim}")
+        if qtype is not None:
+            raise ValueError("❌ ivf_pq 已經以 PQ 壓縮，storage 只能是 float32")
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, metric_type)
+
+    raise ValueError(f"❌ 不支援的索引類型: {index_type} (可用: {', '.join(INDEX_TYPES)})")
+
+def train_index(index, sample):
+    """用取樣向量訓練索引 (flat / hnsw 不需要訓練)"""
+    if index.is_trained:
+        return
+    print(f"🏋️ 使用 {len(sample)} 筆向量訓練索引...")
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+def index_metric(index):
+    """已載入索引的度量 (l2 / ip)"""
+    return "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+def normalize_vectors(vectors):
+    """回傳 L2 正規化後的 float32 副本 (cosine = 內積)"""
+    vectors = np.array(vectors, dtype=np.float32, order="C")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def index_kind(index):
+    """判斷已載入索引的類型 (flat / ivf / hnsw)"""
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivf"
+    if isinstance(faiss.downcast_index(index), faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+def search_parameters(index, nprobe=None, ef_search=None, selector=None):
+    """建立查詢時的搜尋參數 (不修改共用的索引物件，可在多線程下安全使用)
+
+    selector (faiss.IDSelector) 限制只搜尋部分向量；呼叫端需在搜尋結束前保留 selector 的參考。
+    """
+    kind = index_kind(index)
+    options = {"sel": selector} if selector is not None else {}
+    if kind == "ivf" and (nprobe or options):
+        if nprobe:
+            options["nprobe"] = int(nprobe)
+        return faiss.SearchParametersIVF(**options)
+    if kind == "hnsw" and (ef_search or options):
+        if ef_search:
+            options["efSearch"] = int(ef_search)
+        return faiss.SearchParametersHNSW(**options)
+    if options:
+        return faiss.SearchParameters(**options)
+    return None
+
+def search(index, queries, k, params=None):
+    """FAISS 搜尋 (有參數時才傳入 params)"""
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+def search_many(index, requests):
+    """合併多筆查詢 [(query (1, dim), k, nprobe, ef_search), ...]，回傳每筆的 top-k 行號 tuple
+
+    搜尋參數相同的查詢合併成一次 index.search (k 取最大值再各自截斷)。
+    """
+    results = [None] * len(requests)
+    groups = {}
+    for i, (_, _, nprobe, ef_search) in enumerate(requests):
+        groups.setdefault((nprobe, ef_search), []).append(i)
+    for (nprobe, ef_search), members in groups.items():
+        queries = np.ascontiguousarray(np.vstack([requests[i][0] for i in members]), dtype=np.float32)
+        k = max(requests[i][1] for i in members)
+        _, indices = search(index, queries, k, search_parameters(index, nprobe=nprobe, ef_search=ef_search))
+        for row, i in enumerate(members):
+            results[i] = tuple(int(j) for j in indices[row][:requests[i][1]] if j >= 0)
+    return results
+
+def enable_reconstruct(index):
+    """讓 reconstruct 可以使用 (IVF 需要建立行號 → inverted list 位置的 direct map)；不支援時回傳 False"""
+    ivf = faiss.try_extract_index_ivf(index)
+    try:
+        if ivf is not None and ivf.direct_map.no():
+            ivf.make_direct_map()
+        if index.ntotal:
+            index.reconstruct(0)
+        return True
+    except RuntimeError as e:
+        print(f"⚠️ 索引不支援 reconstruct: {e}")
+        return False
+
+def reconstruct(index, ids):
+    """取回索引中存的向量 (ivf_pq 為解碼後的近似值)，回傳 (len(ids), dim) float32"""
+    return index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
@@ -0,0 +1,256 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import urllib.request
+import urllib.error
+
+import numpy as np
+
+from mock_services import start_mock_services, line_webhook_body, line_signature
+
+# -----------------------------------------
+# 🔹 離線壓測 / 效能回歸檢查
+# -----------------------------------------
+# 啟動 LINE / OpenAI 替身 (mock_services.py) 和記憶體資料庫，讓 N 個模擬使用者同時透過 /callback
+# 傳訊息，量測 webhook 回應時間、第一則回覆 / 完整回答的延遲、吞吐量，以及 /metrics 的各階段耗時。
+#
+#   python load_test.py --users 20 --messages 5
+#   ASYNC_WEBHOOK=1 STREAM_RESPONSES=1 python load_test.py --max-p95-ms 2000   # 超過門檻時 exit code 1
+#
+# 預設在同一個進程內啟動 chatbot；--url 可改測外部啟動的 server
+# (該 server 需以 OPENAI_BASE_URL / LINE_API_ENDPOINT 指向 --mock-port，並使用相同的 LINE_SECRET)。
+
+LOAD_TEST_SECRET = "load-test-secret"
+
+# 串流模式的第一則訊息 (chatbot.format_recipe_titles) 以這句結尾，之後還會 push 完整回答
+STREAM_PENDING_SUFFIX = "I'm writing up the details for you now..."
+
+PREFERENCES = ["I am vegetarian", "I avoid beef and pork", "no dairy please", "I eat everything", "I am vegan"]
+QUERIES = [
+    "chicken", "vegan dinner", "quick breakfast", "leftover rice eggs scallion", "gluten free dessert",
+    "easy soup for a cold day", "what can i cook with potatoes and cheese", "banana nut bread",
+    "something with mushrooms", "a healthy salad for lunch", "pasta with tomato sauce", "chocolate cake",
+]
+
+METRIC_LINE = re.compile(r'^recipe_bot_stage_seconds_(sum|count)\{stage="([^"]+)"\} ([0-9.eE+-]+)$')
+
+def http_request(url, data=None, headers=None, timeout=30):
+    """回傳 (status, body)；HTTP 錯誤也回傳狀態碼"""
+    request = urllib.request.Request(url, data=data, headers=headers or {}, method="POST" if data else "GET")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8")
+
+def stage_totals(base_url):
+    """讀取 /metrics 中每個階段的 (次數, 總秒數)"""
+    _, text = http_request(f"{base_url}/metrics")
+    totals = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            count, total = totals.get(stage, (0, 0.0))
+            totals[stage] = (count + int(float(value)), total) if kind == "count" else (count, total + float(value))
+    return totals
+
+def start_local_app(mock_url, env):
+    """在同一個進程內以 threaded werkzeug server 啟動 chatbot (需在 import chatbot 前設定環境變數)"""
+    os.environ.update({
+        "STORAGE_BACKEND": "memory",
+        "OPENAI_API_KEY": "load-test",
+        "OPENAI_BASE_URL": f"{mock_url}/v1",
+        "LINE_API_ENDPOINT": mock_url,
+        "LINE_ACCESS_TOKEN": "load-test",
+        "LINE_SECRET": LOAD_TEST_SECRET,
+    })
+    for key, value in env.items():
+        os.environ.setdefault(key, value)
+
+    from werkzeug.serving import make_server
+    import chatbot
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # 不輸出每個請求的 access log
+    server = make_server("127.0.0.1", 0, chatbot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="load-test-app", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def wait_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _ = http_request(f"{base_url}/readyz", timeout=5)
+            if status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+class SimulatedUser(threading.Thread):
+    """先設定偏好，再依序送出查詢；每則訊息等到收到完整回答才送下一則"""
+
+    def __init__(self, index, base_url, line, secret, messages, think_ms, timeout, results):
+        super().__init__(name=f"user-{index}", daemon=True)
+        self.user_id = f"Uloadtest{index:05d}"
+        self.base_url = base_url
+        self.line = line
+        self.secret = secret
+        self.texts = [PREFERENCES[index % len(PREFERENCES)]] + [
+            QUERIES[(index * 7 + i) % len(QUERIES)] for i in range(messages)
+        ]
+        self.think = think_ms / 1000
+        self.timeout = timeout
+        self.results = results
+
+    def send(self, seq, text):
+        body = line_webhook_body(self.user_id, text, reply_token=f"{self.user_id}.{seq}")
+        headers = {"Content-Type": "application/json", "X-Line-Signature": line_signature(body, self.secret)}
+        start_index = self.line.count(self.user_id)
+        start = time.perf_counter()
+        status, _ = http_request(f"{self.base_url}/callback", body.encode("utf-8"), headers, timeout=self.timeout)
+        ack_ms = (time.perf_counter() - start) * 1000
+        if status != 200:
+            return {"status": status, "ack_ms": ack_ms, "error": f"HTTP {status}"}
+
+        received = self.line.wait(self.user_id, start_index,
+                                  lambda text: not text.endswith(STREAM_PENDING_SUFFIX), self.timeout)
+        if received is None:
+            return {"status": status, "ack_ms": ack_ms, "error": "timeout"}
+        return {
+            "status": status,
+            "ack_ms": ack_ms,
+            "first_ms": (received[0][0] - start) * 1000,
+            "full_ms": (received[-1][0] - start) * 1000,
+            "query": seq > 0,
+        }
+
+    def run(self):
+        for seq, text in enumerate(self.texts):
+            self.results.append(self.send(seq, text))
+            if self.think:
+                time.sleep(self.think)
+
+def replay(base_url, line, secret, users, messages, think_ms=0.0, timeout=60.0, offset=0):
+    """users 個模擬使用者同時傳訊息，回傳 (每則訊息的結果, 總秒數)；offset 讓多輪壓測使用不同的使用者"""
+    results = []
+    threads = [SimulatedUser(offset + i, base_url, line, secret, messages, think_ms, timeout, results)
+               for i in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "avg_ms": round(float(np.mean(values)), 1), "p50_ms": round(float(p50), 1),
+            "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1), "max_ms": round(float(np.max(values)), 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description="離線壓測：模擬 LINE 使用者，LINE / OpenAI / Firestore 都使用本機替身")
+    parser.add_argument("--users", type=int, default=10, help="同時在線的模擬使用者數")
+    parser.add_argument("--messages", type=int, default=5, help="每個使用者的查詢數 (另加一則設定偏好的訊息)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="同一使用者兩則訊息之間的間隔")
+    parser.add_argument("--timeout", type=float, default=60.0, help="每則訊息等待回覆的秒數")
+    parser.add_argument("--url", help="測試外部啟動的 chatbot (預設在本進程內啟動)")
+    parser.add_argument("--secret", default=LOAD_TEST_SECRET, help="--url 模式下該 server 的 LINE_SECRET")
+    parser.add_argument("--mock-port", type=int, default=0, help="mock server 埠號 (--url 模式需固定)")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--storage-latency-ms", type=float, default=20.0, help="模擬 Firestore 每次讀寫的延遲")
+    parser.add_argument("--max-p95-ms", type=float, help="查詢完整回答的 p95 超過此值時失敗 (回歸檢查)")
+    parser.add_argument("--max-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="把結果寫入 JSON 檔 (和之前的結果比較)")
+    args = parser.parse_args()
+
+    mock_server, mock_url = start_mock_services(
+        port=args.mock_port, latency_ms=args.llm_latency_ms, first_token_ms=args.llm_first_token_ms,
+        jitter_ms=args.llm_jitter_ms,
+    )
+    if args.url:
+        base_url, secret = args.url.rstrip("/"), args.secret
+        print(f"🧪 Mock services: OPENAI_BASE_URL={mock_url}/v1 LINE_API_ENDPOINT={mock_url}")
+    else:
+        _, base_url = start_local_app(mock_url, {
+            "VERBOSE_LOGGING": "0",
+            "MEMORY_STORAGE_LATENCY_MS": str(args.storage_latency_ms),
+        })
+        secret = LOAD_TEST_SECRET
+    if not wait_ready(base_url, timeout=300):
+        print(f"❌ {base_url} 未就緒 (/readyz)")
+        sys.exit(1)
+
+    _, stats = http_request(f"{base_url}/stats")
+    stats = json.loads(stats)
+    print(f"🚀 {args.users} 個使用者 × {args.messages + 1} 則訊息 → {base_url} "
+          f"(async_webhook={stats.get('async_webhook')}, stream_responses={stats.get('stream_responses')})")
+
+    before = stage_totals(base_url)
+    results, elapsed = replay(base_url, mock_server.line, secret, args.users, args.messages,
+                              think_ms=args.think_ms, timeout=args.timeout)
+    after = stage_totals(base_url)
+
+    ok = [r for r in results if "error" not in r]
+    queries = [r for r in ok if r["query"]]
+    errors = len(results) - len(ok)
+    report = {
+        "users": args.users,
+        "messages": len(results),
+        "errors": errors,
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_msg_s": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "webhook_ack": percentiles([r["ack_ms"] for r in results]),
+        "first_message": percentiles([r["first_ms"] for r in queries]),
+        "full_response": percentiles([r["full_ms"] for r in queries]),
+        "llm_requests": mock_server.openai.requests,
+        "stages": {},
+    }
+    for stage, (count, total) in sorted(after.items()):
+        count -= before.get(stage, (0, 0.0))[0]
+        total -= before.get(stage, (0, 0.0))[1]
+        if count > 0:
+            report["stages"][stage] = {
+                "count": count,
+                "per_message": round(count / len(results), 2),
+                "avg_ms": round(total / count * 1000, 2),
+                "total_s": round(total, 3),
+            }
+
+    print(f"📊 {len(results)} 則訊息, {errors} 個錯誤, {report['elapsed_s']}s, {report['throughput_msg_s']} msg/s, "
+          f"OpenAI 請求 {report['llm_requests']} 次")
+    for name in ["webhook_ack", "first_message", "full_response"]:
+        row = report[name]
+        if row["count"]:
+            print(f"  {name:>14}: p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms max={row['max_ms']}ms")
+    print(f"  {'stage':>26} {'count':>7} {'/msg':>6} {'avg_ms':>9} {'total_s':>9}")
+    for stage, row in sorted(report["stages"].items(), key=lambda item: -item[1]["total_s"]):
+        print(f"  {stage:>26} {row['count']:>7} {row['per_message']:>6} {row['avg_ms']:>9} {row['total_s']:>9}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 結果已寫入 {args.json}")
+
+    failed = False
+    if report["error_rate"] > args.max_error_rate:
+        print(f"❌ 錯誤率 {report['error_rate']} 超過門檻 {args.max_error_rate}")
+        failed = True
+    if args.max_p95_ms is not None and report["full_response"].get("p95_ms", float("inf")) > args.max_p95_ms:
+        print(f"❌ 完整回答 p95 超過門檻 {args.max_p95_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
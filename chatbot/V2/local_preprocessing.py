@@ -1,95 +1,470 @@
 import os
 import json
+import time
+import shutil
+import hashlib
+import argparse
 import gdown
 import pandas as pd
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import gc
 
+from encoder import create_encoder, EMBEDDING_BACKEND, ENCODER_BACKENDS
+from metadata_store import MetadataWriter, METADATA_PATH, METADATA_INDEX_PATH
+from filters import FilterIndexBuilder, FILTER_META_PATH
+from bm25 import BM25IndexBuilder, BM25_META_PATH
+from dedup import find_duplicates, DEFAULT_JACCARD, DEFAULT_COSINE
+from index_factory import (
+    INDEX_TYPES, METRICS, STORAGE_TYPES, DEFAULT_PQ_M, DEFAULT_PQ_NBITS, DEFAULT_HNSW_M, DEFAULT_TRAIN_SIZE,
+    create_index, train_index, normalize_vectors,
+)
+
 # 設置檔案路徑
 FAISS_INDEX_PATH = "recipe_faiss.index"
-METADATA_PATH = "recipe_metadata.csv"
 CSV_PATH = "https://drive.google.com/file/d/1IuGWrM_YwnYQwtp06SvWji695NJ7d_wS/view?usp=sharing"
+CSV_FILE_ID = "1IuGWrM_YwnYQwtp06SvWji695NJ7d_wS"
+TEMP_CSV_PATH = "RecipeNLG_dataset.csv"
+
+# 分段建立索引的 shard 目錄
+SHARD_DIR = "index_shards"
+MANIFEST_NAME = "manifest.json"
+
+# all-MiniLM-L6-v2 的嵌入維度是 384
+EMBEDDING_DIM = 384
+
+# 預設批次設定
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_BATCH_SIZE = 64
+
+# embedding 模型 (延遲載入，避免多進程子進程重複載入)
+encoder = None
+
+def load_model(backend=None):
+    """載入 embedding 模型 (只載入一次)"""
+    global encoder
+    if encoder is None:
+        print("載入 embedding 模型...")
+        encoder = create_encoder(backend)
+        print(f"Embedding 後端: {encoder.name}")
+    return encoder
+
+def build_texts(chunk):
+    """以向量化字串運算組合 Title / Ingredients / Instructions 文本"""
+    return (
+        "Title: " + chunk["title"].astype(str)
+        + "\nIngredients: " + chunk["ingredients"].astype(str)
+        + "\nInstructions: " + chunk["directions"].astype(str)
+    )
 
-# 加載 embedding 模型
-print("載入 embedding 模型...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
+def start_encode_pool(workers):
+    """啟動多進程 encode pool，每個 CPU 核心一個進程"""
+    if workers < 0:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    if load_model().name != "torch":
+        # onnxruntime 在單一進程內已經使用所有核心
+        print("⚠️ 多進程 encode 只支援 torch 後端，改用單進程")
+        return None
 
-def process_csv_in_chunks():
+    # 每個子進程只用一個 thread，避免多進程 x 多線程超額佔用 CPU
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    os.environ.setdefault("MKL_NUM_THREADS", "1")
+    print(f"啟動 {workers} 個 encode 進程...")
+    return load_model().model.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+def encode_texts(texts, batch_size=DEFAULT_BATCH_SIZE, pool=None):
+    """一次 encode 整個批次 (單進程或多進程)"""
+    if pool is not None:
+        embeddings = load_model().model.encode_multi_process(texts, pool, batch_size=batch_size)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+    return load_model().encode(texts, batch_size=batch_size)
+
+def download_csv(csv_path):
+    """若本地沒有資料集，從 Google Drive 下載"""
+    if os.path.exists(csv_path):
+        print(f"使用本地資料集: {csv_path}")
+        return False
     print("開始下載資料...")
-    # 從 Google Drive 下載檔案
-    file_id = '1IuGWrM_YwnYQwtp06SvWji695NJ7d_wS'
-    temp_csv_path = 'RecipeNLG_dataset.csv'
-    gdown.download(f'https://drive.google.com/uc?id={file_id}', temp_csv_path, quiet=False)
-    
+    gdown.download(f"https://drive.google.com/uc?id={CSV_FILE_ID}", csv_path, quiet=False)
     print("檔案下載完成，開始處理...")
-    
-    # 創建空的 FAISS 索引 (all-MiniLM-L6-v2 的嵌入維度是 384)
-    embedding_dim = 384
-    index = faiss.IndexFlatL2(embedding_dim)
-    
-    # 創建空的元數據 DataFrame
-    metadata_df = pd.DataFrame()
-    
-    # 分批處理 CSV
-    chunk_size = 500
-    max_rows = 2000  # 可以設定更大，因為在本地機器上不受 512MB 限制
-    rows_processed = 0
-    
-    # 使用 chunksize 參數分批讀取 CSV
-    for chunk in pd.read_csv(temp_csv_path, chunksize=chunk_size):
-        if rows_processed >= max_rows:
-            break
-            
-        # 處理當前批次
-        current_chunk = chunk.iloc[:min(chunk_size, max_rows - rows_processed)]
-        rows_processed += len(current_chunk)
-        
-        print(f"處理第 {rows_processed-len(current_chunk)+1} 至 {rows_processed} 行，計劃處理 {max_rows} 行")
-        
-        # 創建文本字段
-        current_chunk["text"] = current_chunk.apply(
-            lambda row: f"Title: {row['title']}\nIngredients: {row['ingredients']}\nInstructions: {row['directions']}", 
-            axis=1
+    return True
+
+def atomic_write(path, write_fn):
+    """先寫入暫存檔再 rename，避免中斷時留下寫到一半的檔案"""
+    tmp_path = path + ".tmp"
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+def load_manifest(shard_dir):
+    """讀取 shard manifest (不存在時回傳空的 manifest)"""
+    manifest_path = os.path.join(shard_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"version": 1, "embedding_dim": EMBEDDING_DIM, "shards": [], "progress": {}, "completed": []}
+
+def save_manifest(shard_dir, manifest):
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+    atomic_write(os.path.join(shard_dir, MANIFEST_NAME), write)
+
+def content_hashes(chunk):
+    """每筆食譜內容的 hash，用來判斷新增或修改過的食譜"""
+    return [
+        hashlib.sha1(f"{t}\x1f{i}\x1f{d}".encode("utf-8")).hexdigest()[:16]
+        for t, i, d in zip(chunk["title"], chunk["ingredients"], chunk["directions"])
+    ]
+
+def recipe_keys(chunk, source, first_row):
+    """食譜識別鍵：有 link 欄位時用 link，否則用資料來源的行號
+
+    同一筆食譜修改後鍵不變，合併時新版本會取代舊版本 (內容 hash 只用來判斷是否需要重新 encode)。
+    """
+    row_keys = pd.Series(
+        [f"{os.path.basename(source)}:{row}" for row in range(first_row - 1, first_row - 1 + len(chunk))],
+        index=chunk.index,
+    )
+    if "link" in chunk.columns:
+        return chunk["link"].astype(str).where(chunk["link"].notna(), row_keys).tolist()
+    return row_keys.tolist()
+
+def load_latest_hashes(shard_dir, manifest):
+    """已存在 shard 中每個 recipe_key 最新版本的內容 hash"""
+    latest = {}
+    for shard in manifest["shards"]:
+        meta = pd.read_csv(os.path.join(shard_dir, shard["name"] + ".csv"), usecols=["recipe_key", "content_hash"],
+                           dtype=str, keep_default_na=False)
+        latest.update(zip(meta["recipe_key"], meta["content_hash"]))
+    return latest
+
+def write_shard(shard_dir, name, vectors, metadata):
+    """寫入一個 shard (向量 .npy + 元數據 .csv)"""
+    def write_vectors(tmp_path):
+        with open(tmp_path, "wb") as f:
+            np.save(f, vectors)
+    atomic_write(os.path.join(shard_dir, name + ".npy"), write_vectors)
+    atomic_write(
+        os.path.join(shard_dir, name + ".csv"),
+        lambda tmp_path: metadata.to_csv(tmp_path, index=False),
+    )
+
+def process_csv_in_chunks(csv_path=TEMP_CSV_PATH, max_rows=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                          batch_size=DEFAULT_BATCH_SIZE, workers=0, shard_dir=SHARD_DIR,
+                          append=False, merge=True, cleanup_csv=False, index_type="flat",
+                          index_options=None, encoder_backend=None, dedup_options=None):
+    """分批讀取 CSV，每個 chunk encode 後寫成一個 shard，可從中斷處續跑
+
+    max_rows 為 None 時處理整份資料集；workers > 1 (或 -1 代表全部核心) 時使用多進程 encode。
+    manifest 的 progress 只用來接續被中斷的一輪；append=True 且上一輪已完成時，重新掃描整份資料來源，
+    逐筆比較內容 hash，只 encode 新的或修改過的食譜 (舊版本在合併時被取代)。
+    """
+    downloaded = download_csv(csv_path)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest = load_manifest(shard_dir)
+    source = os.path.abspath(csv_path)
+    # 舊版 manifest 沒有 completed：追加時把有進度的來源視為已完成 (重新掃描)，否則照舊從進度續跑
+    if "completed" not in manifest:
+        manifest["completed"] = list(manifest["progress"]) if append else []
+
+    if manifest["shards"] and source not in manifest["progress"] and not append:
+        raise ValueError(
+            f"❌ {shard_dir} 已有其他資料來源的 shard，請使用 --append 追加或 --fresh 重新建立"
         )
-        
-        # 保存元數據（不包含嵌入）
-        metadata_chunk = current_chunk[['title', 'ingredients', 'directions', 'text']]
-        
-        if metadata_df.empty:
-            metadata_df = metadata_chunk.copy()
-        else:
-            metadata_df = pd.concat([metadata_df, metadata_chunk])
-        
-        print(f"為第 {rows_processed-len(current_chunk)+1} 至 {rows_processed} 行創建嵌入...")
-        
-        # 處理嵌入
-        batch_embeddings = []
-        for _, row in current_chunk.iterrows():
-            embedding = model.encode(row["text"], convert_to_numpy=True)
-            batch_embeddings.append(embedding)
-        
-        # 添加到 FAISS 索引
-        batch_embeddings_array = np.vstack(batch_embeddings)
-        index.add(batch_embeddings_array)
-        
-        # 釋放記憶體
-        del batch_embeddings, batch_embeddings_array, current_chunk, metadata_chunk
-        gc.collect()
-        
-    # 保存索引和元數據
-    print("保存 FAISS 索引和元數據...")
-    faiss.write_index(index, FAISS_INDEX_PATH)
-    metadata_df.to_csv(METADATA_PATH, index=False)
-    
-    # 清理臨時檔案
-    if os.path.exists(temp_csv_path):
-        os.remove(temp_csv_path)
-        
+    completed = source in manifest["completed"]
+    if append and completed:
+        print("🔎 重新掃描整份資料來源，比較每筆食譜的內容 hash")
+        manifest["progress"][source] = 0
+        manifest["completed"] = [s for s in manifest["completed"] if s != source]
+        completed = False
+    rows_done = manifest["progress"].get(source, 0)
+    if completed:
+        print(f"✅ {source} 已全部處理 ({rows_done} 行)，使用 --append 重新掃描變動的食譜")
+    elif rows_done:
+        print(f"🔁 從第 {rows_done + 1} 行續跑 (已完成 {len(manifest['shards'])} 個 shard)")
+
+    latest_hashes = load_latest_hashes(shard_dir, manifest) if append else None
+
+    rows_processed = rows_done
+    exhausted = False
+    rows_encoded = 0
+    encode_seconds = 0.0
+    start_time = time.perf_counter()
+
+    load_model(encoder_backend)
+    pool = None
+
+    try:
+        if not completed and (max_rows is None or rows_done < max_rows):
+            pool = start_encode_pool(workers)
+            # 使用 chunksize 參數分批讀取 CSV，跳過已完成的行 (保留表頭)
+            reader = pd.read_csv(csv_path, chunksize=chunk_size, skiprows=range(1, rows_done + 1))
+            for chunk in reader:
+                if max_rows is not None and rows_processed >= max_rows:
+                    break
+
+                # 處理當前批次 (被 max_rows 截斷時，這一批之後就停止)
+                truncated = max_rows is not None and rows_processed + len(chunk) > max_rows
+                if truncated:
+                    chunk = chunk.iloc[:max_rows - rows_processed]
+                first_row = rows_processed + 1
+                rows_processed += len(chunk)
+
+                target = max_rows if max_rows is not None else "全部"
+                print(f"處理第 {first_row} 至 {rows_processed} 行，計劃處理 {target} 行")
+
+                hashes = content_hashes(chunk)
+                current_chunk = chunk[["title", "ingredients", "directions"]].copy()
+                current_chunk["recipe_key"] = recipe_keys(chunk, source, first_row)
+                current_chunk["content_hash"] = hashes
+
+                # 追加模式：只保留新的或內容有變動的食譜
+                if latest_hashes is not None:
+                    is_changed = [
+                        latest_hashes.get(key) != content_hash
+                        for key, content_hash in zip(current_chunk["recipe_key"], current_chunk["content_hash"])
+                    ]
+                    current_chunk = current_chunk[is_changed]
+                    latest_hashes.update(zip(current_chunk["recipe_key"], current_chunk["content_hash"]))
+
+                if len(current_chunk):
+                    # 整個 chunk 一次 encode
+                    chunk_start = time.perf_counter()
+                    batch_embeddings_array = encode_texts(
+                        build_texts(current_chunk).tolist(), batch_size=batch_size, pool=pool
+                    )
+                    chunk_seconds = time.perf_counter() - chunk_start
+                    encode_seconds += chunk_seconds
+                    rows_encoded += len(current_chunk)
+
+                    # 寫入 shard，再更新 manifest (manifest 只記錄已完整寫入的 shard)
+                    shard_name = f"shard_{len(manifest['shards']):05d}"
+                    write_shard(shard_dir, shard_name, batch_embeddings_array, current_chunk)
+                    manifest["shards"].append({
+                        "name": shard_name,
+                        "rows": len(current_chunk),
+                        "source": source,
+                        "source_start": first_row - 1,
+                        "source_end": rows_processed,
+                    })
+                    print(
+                        f"⏱️ 本批 {len(current_chunk) / max(chunk_seconds, 1e-9):.1f} rows/s，"
+                        f"已寫入 {shard_name}"
+                    )
+                    del batch_embeddings_array
+                else:
+                    print("⏭️ 本批沒有新的食譜，跳過 encode")
+
+                manifest["progress"][source] = rows_processed
+                save_manifest(shard_dir, manifest)
+
+                # 釋放記憶體
+                del current_chunk, chunk
+                gc.collect()
+                if truncated:
+                    break
+            else:
+                exhausted = True
+
+        # 只有讀完整份資料來源才算完成 (下一次 --append 重新掃描)；
+        # 因 max_rows 停止時保留 progress，之後用更大的 --max-rows 從該行續跑
+        if exhausted and source not in manifest["completed"]:
+            manifest["completed"].append(source)
+            save_manifest(shard_dir, manifest)
+    finally:
+        if pool is not None:
+            encoder.model.stop_multi_process_pool(pool)
+
+    total_seconds = time.perf_counter() - start_time
+    print(
+        f"📈 本次讀取 {rows_processed - rows_done} 行、encode {rows_encoded} 行，總耗時 {total_seconds:.1f}s，"
+        f"encode {encode_seconds:.1f}s ({rows_encoded / max(encode_seconds, 1e-9):.1f} rows/s)"
+    )
+
+    if merge:
+        merge_shards(shard_dir, index_type=index_type, index_options=index_options, dedup_options=dedup_options)
+
+    # 清理臨時檔案 (預設保留，方便續跑與追加)
+    if cleanup_csv and downloaded and os.path.exists(csv_path):
+        os.remove(csv_path)
+
+def sample_shard_vectors(shard_dir, manifest, keep, sample_size, seed=0):
+    """從所有 shard 中隨機取樣 (只取保留的向量)，用來訓練 IVF / PQ / int8 索引"""
+    kept_rows = np.flatnonzero(keep)
+    if len(kept_rows) > sample_size:
+        rng = np.random.default_rng(seed)
+        kept_rows = np.sort(rng.choice(kept_rows, size=sample_size, replace=False))
+
+    samples = []
+    offset = 0
+    for shard in manifest["shards"]:
+        rows = kept_rows[(kept_rows >= offset) & (kept_rows < offset + shard["rows"])] - offset
+        if len(rows):
+            vectors = np.load(os.path.join(shard_dir, shard["name"] + ".npy"), mmap_mode="r")
+            samples.append(np.asarray(vectors[rows], dtype=np.float32))
+        offset += shard["rows"]
+    return np.vstack(samples)
+
+def merge_shards(shard_dir=SHARD_DIR, index_type="flat", index_options=None, dedup_options=None):
+    """合併所有 shard，輸出 RAG.initialize_rag 需要的索引和元數據
+
+    同一個 recipe_key 出現多次時 (食譜被修改後重新追加)，只保留最後一次出現的版本。
+    dedup_options 不是 None 時再移除近似重複的食譜 (見 dedup.py，shard 本身不會被修改)。
+    index_type 為 IVF 類型 (或 storage 為 int8) 時會先用取樣向量訓練；
+    metric 為 ip 時向量先 L2 正規化 (內積 = cosine similarity)。
+    """
+    manifest = load_manifest(shard_dir)
+    if not manifest["shards"]:
+        raise FileNotFoundError(f"❌ {shard_dir} 中沒有任何 shard 可以合併")
+
+    print(f"🔗 合併 {len(manifest['shards'])} 個 shard...")
+
+    # 計算每個 recipe_key 最後一次出現的位置
+    keys = pd.concat(
+        [
+            pd.read_csv(os.path.join(shard_dir, shard["name"] + ".csv"), usecols=["recipe_key"])["recipe_key"]
+            for shard in manifest["shards"]
+        ],
+        ignore_index=True,
+    )
+    keep = ~keys.duplicated(keep="last").to_numpy()
+    print(f"保留 {int(keep.sum())} / {len(keep)} 筆 (其餘為已被更新的舊版本)")
+    del keys
+    if dedup_options is not None:
+        keep = find_duplicates(shard_dir, manifest, keep, **dedup_options)
+
+    index_options = dict(index_options or {})
+    train_size = index_options.pop("train_size", DEFAULT_TRAIN_SIZE)
+    normalize = index_options.get("metric") == "ip"
+    prepare = normalize_vectors if normalize else (lambda v: np.ascontiguousarray(v, dtype=np.float32))
+    index = create_index(index_type, dim=EMBEDDING_DIM, ntotal=int(keep.sum()), **index_options)
+    if not index.is_trained:
+        train_index(index, prepare(sample_shard_vectors(shard_dir, manifest, keep, train_size)))
+    print(f"📦 索引類型: {index_type} (metric={index_options.get('metric', 'l2')}, "
+          f"storage={index_options.get('storage', 'float32')})")
+
+    offset = 0
+    filter_builder = FilterIndexBuilder()
+    bm25_builder = BM25IndexBuilder()
+    with MetadataWriter(METADATA_PATH, METADATA_INDEX_PATH) as writer:
+        for shard in manifest["shards"]:
+            base = os.path.join(shard_dir, shard["name"])
+            vectors = np.load(base + ".npy", mmap_mode="r")
+            meta = pd.read_csv(base + ".csv", keep_default_na=False)
+            shard_keep = keep[offset:offset + len(meta)]
+            offset += len(meta)
+
+            index.add(prepare(vectors[shard_keep]))
+            meta = meta.loc[shard_keep]
+            writer.extend(zip(meta["title"], meta["ingredients"], meta["directions"]))
+            filter_builder.extend(zip(meta["title"], meta["ingredients"]))
+            bm25_builder.extend(zip(meta["title"], meta["ingredients"]))
+            del vectors, meta
+
+        # 保存索引 (元數據在離開 with 時寫入 offset 索引)
+        print("保存 FAISS 索引和元數據...")
+        atomic_write(FAISS_INDEX_PATH, lambda tmp_path: faiss.write_index(index, tmp_path))
+        filter_builder.save()
+        bm25_builder.save()
+
     print("處理完成！檔案已保存為:")
-    print(f"- {FAISS_INDEX_PATH}")
-    print(f"- {METADATA_PATH}")
-    
+    print(f"- {FAISS_INDEX_PATH} (向量數: {index.ntotal})")
+    print(f"- {METADATA_PATH}, {METADATA_INDEX_PATH}")
+    print(f"- {FILTER_META_PATH} 和食材倒排索引 / 飲食標籤")
+    print(f"- {BM25_META_PATH} 和 BM25 索引 (標題 + 食材)")
+    return index
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="建立食譜 FAISS 索引和元數據")
+    parser.add_argument("--csv", default=TEMP_CSV_PATH,
+                        help="RecipeNLG CSV 路徑 (不存在時自動下載)")
+    parser.add_argument("--max-rows", type=int, default=None,
+                        help="最多處理幾行 (預設: 全部)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="每次從 CSV 讀取並 encode 的行數")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="模型 encode 的 batch size")
+    parser.add_argument("--encoder", choices=ENCODER_BACKENDS, default=EMBEDDING_BACKEND,
+                        help="embedding 後端 (onnx 需要先執行 export_onnx.py)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="encode 進程數 (0/1: 單進程, -1: 所有 CPU 核心)")
+    parser.add_argument("--shard-dir", default=SHARD_DIR,
+                        help="存放 shard 和 manifest 的目錄")
+    parser.add_argument("--append", action="store_true",
+                        help="重新掃描資料來源，只 encode 新的或修改過的食譜")
+    parser.add_argument("--fresh", action="store_true",
+                        help="刪除既有 shard，從頭建立")
+    parser.add_argument("--no-merge", action="store_true",
+                        help="只寫入 shard，不合併成最終索引")
+    parser.add_argument("--merge-only", action="store_true",
+                        help="不處理 CSV，只合併既有 shard")
+    parser.add_argument("--cleanup-csv", action="store_true",
+                        help="完成後刪除下載的 CSV")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="FAISS 索引類型")
+    parser.add_argument("--nlist", type=int, default=None,
+                        help="IVF cluster 數 (預設: 約 4 * sqrt(N))")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M,
+                        help="IVF-PQ 子向量數 (每筆向量壓縮成 pq_m bytes)")
+    parser.add_argument("--pq-nbits", type=int, default=DEFAULT_PQ_NBITS,
+                        help="IVF-PQ 每個子向量的 bits")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M,
+                        help="HNSW 每個節點的鄰居數")
+    parser.add_argument("--train-size", type=int, default=DEFAULT_TRAIN_SIZE,
+                        help="訓練 IVF 索引的取樣數")
+    parser.add_argument("--metric", choices=list(METRICS), default="l2",
+                        help="l2 或 ip (向量 L2 正規化後以內積 = cosine similarity 排序)")
+    parser.add_argument("--storage", choices=list(STORAGE_TYPES), default="float32",
+                        help="向量儲存格式 (fp16 / int8 為 scalar quantizer，ivf_pq 只支援 float32)")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="合併時不移除近似重複的食譜")
+    parser.add_argument("--dedup-jaccard", type=float, default=DEFAULT_JACCARD,
+                        help="食材集合 Jaccard 相似度 (MinHash 估計) 的去重門檻")
+    parser.add_argument("--dedup-cosine", type=float, default=DEFAULT_COSINE,
+                        help="embedding cosine 相似度的去重門檻")
+    return parser.parse_args()
+
+def index_options_from_args(args):
+    """依索引類型整理 create_index 需要的參數"""
+    options = {"metric": args.metric, "storage": args.storage, "train_size": args.train_size}
+    if args.index_type in ("ivf_flat", "ivf_pq"):
+        options["nlist"] = args.nlist
+        if args.index_type == "ivf_pq":
+            options.update(pq_m=args.pq_m, pq_nbits=args.pq_nbits)
+    elif args.index_type == "hnsw":
+        options["hnsw_m"] = args.hnsw_m
+    return options
+
+def dedup_options_from_args(args):
+    if args.no_dedup:
+        return None
+    return {"jaccard_threshold": args.dedup_jaccard, "cosine_threshold": args.dedup_cosine}
+
 if __name__ == "__main__":
-    process_csv_in_chunks()
\ No newline at end of file
+    args = parse_args()
+    if args.fresh and os.path.isdir(args.shard_dir):
+        shutil.rmtree(args.shard_dir)
+    index_options = index_options_from_args(args)
+    dedup_options = dedup_options_from_args(args)
+    if args.merge_only:
+        merge_shards(args.shard_dir, index_type=args.index_type, index_options=index_options,
+                     dedup_options=dedup_options)
+    else:
+        process_csv_in_chunks(
+            csv_path=args.csv,
+            max_rows=args.max_rows,
+            chunk_size=args.chunk_size,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            shard_dir=args.shard_dir,
+            append=args.append,
+            merge=not args.no_merge,
+            cleanup_csv=args.cleanup_csv,
+            index_type=args.index_type,
+            index_options=index_options,
+            encoder_backend=args.encoder,
+            dedup_options=dedup_options,
+        )
@@ -0,0 +1,196 @@
+import os
+import sys
+import csv
+import json
+import mmap
+import argparse
+from array import array
+
+# -----------------------------------------
+# 🔹 食譜元數據的二進位格式
+# -----------------------------------------
+# recipe_metadata.bin : MAGIC + 每筆食譜一段 UTF-8 文字
+#   title \x1f 食材1 \x1e 食材2 ... \x1f 步驟1 \x1e 步驟2 ...
+#   (原始資料的 ingredients / directions 是 JSON 字串列表，建立時就先解析好，讀取時不用 json.loads)
+# recipe_metadata.idx : MAGIC + 筆數 (uint64) + (筆數 + 1) 個 uint64 offset (little-endian)
+# 兩個檔案都用 mmap 開啟，讀取第 i 筆只會碰到那一筆的 bytes，
+# 啟動時間和 resident memory 不會隨資料量增加。
+# 舊版 (RCPMETA1：每筆一個 JSON 陣列) 仍可讀取，python metadata_store.py --upgrade 轉成新版。
+METADATA_PATH = "recipe_metadata.bin"
+METADATA_INDEX_PATH = "recipe_metadata.idx"
+
+DATA_MAGIC = b"RCPMETA2"
+DATA_MAGIC_V1 = b"RCPMETA1"
+INDEX_MAGIC = b"RCPIDX01"
+FIELDS = ("title", "ingredients", "directions")
+
+FIELD_SEP = "\x1f"
+ITEM_SEP = "\x1e"
+_SEPARATORS = str.maketrans({FIELD_SEP: " ", ITEM_SEP: " "})
+
+class Recipe:
+    """一筆食譜 (ingredients / directions 是解析好的字串 tuple；score 為檢索時和查詢的 cosine similarity)"""
+
+    __slots__ = ("id", "title", "ingredients", "directions", "score")
+
+    def __init__(self, id, title, ingredients, directions, score=None):
+        self.id = id
+        self.title = title
+        self.ingredients = ingredients
+        self.directions = directions
+        self.score = score
+
+    def __repr__(self):
+        return f"Recipe({self.id}, {self.title!r})"
+
+def parse_list(value):
+    """原始資料的 JSON 字串列表 → 去掉空白項目的字串 tuple (不是列表時視為單一項目)"""
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        try:
+            items = json.loads(value)
+        except (TypeError, ValueError):
+            items = [value]
+        if not isinstance(items, list):
+            items = [items]
+    items = (" ".join(str(item).translate(_SEPARATORS).split()) for item in items if item is not None)
+    return tuple(item for item in items if item)
+
+def _to_little_endian(offsets):
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return offsets
+
+class MetadataWriter:
+    """依序寫入食譜元數據 (寫完後 close 才會產生 offset 索引)"""
+
+    def __init__(self, path=METADATA_PATH, index_path=METADATA_INDEX_PATH):
+        self.path = path
+        self.index_path = index_path
+        self._tmp_path = path + ".tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(DATA_MAGIC)
+        self._offsets = array("Q", [len(DATA_MAGIC)])
+
+    def append(self, title, ingredients, directions):
+        """ingredients / directions 可以是原始的 JSON 字串或列表"""
+        record = FIELD_SEP.join((
+            " ".join(str(title).translate(_SEPARATORS).split()),
+            ITEM_SEP.join(parse_list(ingredients)),
+            ITEM_SEP.join(parse_list(directions)),
+        )).encode("utf-8")
+        self._file.write(record)
+        self._offsets.append(self._offsets[-1] + len(record))
+
+    def extend(self, rows):
+        for title, ingredients, directions in rows:
+            self.append(title, ingredients, directions)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def close(self):
+        """寫入 offset 索引，並以 rename 取代舊檔"""
+        self._file.close()
+        tmp_index_path = self.index_path + ".tmp"
+        with open(tmp_index_path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(_to_little_endian(array("Q", [len(self)])).tobytes())
+            f.write(_to_little_endian(self._offsets).tobytes())
+        os.replace(self._tmp_path, self.path)
+        os.replace(tmp_index_path, self.index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._tmp_path)
+
+class MetadataStore:
+    """以 mmap 讀取食譜元數據，依行號隨機存取"""
+
+    def __init__(self, path=METADATA_PATH, index_path=METADATA_INDEX_PATH):
+        with open(index_path, "rb") as f:
+            self._index_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(path, "rb") as f:
+            self._data_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        data_magic = self._data_mmap[:len(DATA_MAGIC)]
+        if self._index_mmap[:len(INDEX_MAGIC)] != INDEX_MAGIC or data_magic not in (DATA_MAGIC, DATA_MAGIC_V1):
+            raise ValueError(f"❌ {path} / {index_path} 不是有效的元數據檔案")
+        self.version = 2 if data_magic == DATA_MAGIC else 1
+        if self.version == 1:
+            print(f"⚠️ {path} 是舊版元數據格式，每次讀取都要解析 JSON (執行 python metadata_store.py --upgrade 轉換)")
+
+        header = memoryview(self._index_mmap)[len(INDEX_MAGIC):]
+        if sys.byteorder == "big":
+            # 極少見的 big-endian 平台：複製並轉換 offset (仍不讀取資料檔本身)
+            offsets = array("Q", header.tobytes())
+            offsets.byteswap()
+            self._count, self._offsets = offsets[0], offsets[1:]
+        else:
+            offsets = header.cast("Q")
+            self._count, self._offsets = offsets[0], offsets[1:]
+
+    def __len__(self):
+        return self._count
+
+    def get(self, i):
+        """讀取第 i 筆食譜 (Recipe)"""
+        if not 0 <= i < self._count:
+            raise IndexError(f"metadata index {i} out of range (0-{self._count - 1})")
+        start, end = self._offsets[i], self._offsets[i + 1]
+        if self.version == 1:
+            title, ingredients, directions = json.loads(self._data_mmap[start:end])
+            return Recipe(i, title, parse_list(ingredients), parse_list(directions))
+        title, ingredients, directions = self._data_mmap[start:end].decode("utf-8").split(FIELD_SEP)
+        return Recipe(
+            i, title,
+            tuple(ingredients.split(ITEM_SEP)) if ingredients else (),
+            tuple(directions.split(ITEM_SEP)) if directions else (),
+        )
+
+    __getitem__ = get
+
+    def take(self, ids):
+        """依序讀取多筆食譜"""
+        return [self.get(int(i)) for i in ids]
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self.get(i)
+
+def convert_csv(csv_path, path=METADATA_PATH, index_path=METADATA_INDEX_PATH):
+    """把舊版 recipe_metadata.csv 轉成二進位格式 (丟棄重複的 text 欄位)"""
+    csv.field_size_limit(sys.maxsize)
+    with open(csv_path, "r", encoding="utf-8", newline="") as f, MetadataWriter(path, index_path) as writer:
+        for row in csv.DictReader(f):
+            writer.append(row["title"], row["ingredients"], row["directions"])
+    print(f"✅ 已轉換 {len(writer)} 筆食譜: {csv_path} → {path}, {index_path}")
+
+def upgrade(path=METADATA_PATH, index_path=METADATA_INDEX_PATH):
+    """把舊版 (RCPMETA1) 元數據檔案就地轉成新版 (行號不變，FAISS / BM25 / 過濾索引不需要重建)"""
+    store = MetadataStore(path, index_path)
+    if store.version == 2:
+        print(f"✅ {path} 已是最新格式")
+        return
+    with MetadataWriter(path, index_path) as writer:
+        writer.extend((r.title, r.ingredients, r.directions) for r in store)
+    print(f"✅ 已升級 {len(writer)} 筆食譜: {path}, {index_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="將 recipe_metadata.csv 轉換為 mmap 元數據格式")
+    parser.add_argument("csv_path", nargs="?", default="recipe_metadata.csv")
+    parser.add_argument("--output", default=METADATA_PATH)
+    parser.add_argument("--index-output", default=METADATA_INDEX_PATH)
+    parser.add_argument("--upgrade", action="store_true", help="把既有的舊版元數據檔案轉成新版")
+    args = parser.parse_args()
+    if args.upgrade:
+        upgrade(args.output, args.index_output)
+    else:
+        convert_csv(args.csv_path, args.output, args.index_output)
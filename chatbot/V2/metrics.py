@@ -0,0 +1,41 @@
+import time
+import threading
+from collections import deque
+
+import numpy as np
+
+class LatencyTracker:
+    """保留最近 window 筆延遲 (毫秒)，回報次數和 p50 / p95 / p99"""
+
+    def __init__(self, name, window=1000):
+        self.name = name
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, ms):
+        with self._lock:
+            self._samples.append(float(ms))
+            self.count += 1
+
+    def record_since(self, start):
+        """記錄從 start (time.perf_counter()) 到現在的毫秒數"""
+        ms = (time.perf_counter() - start) * 1000
+        self.record(ms)
+        return ms
+
+    def stats(self):
+        with self._lock:
+            samples = np.array(self._samples, dtype=np.float64)
+            count = self.count
+        if samples.size == 0:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {
+            "count": count,
+            "avg_ms": round(float(samples.mean()), 1),
+            "p50_ms": round(float(p50), 1),
+            "p95_ms": round(float(p95), 1),
+            "p99_ms": round(float(p99), 1),
+            "max_ms": round(float(samples.max()), 1),
+        }
@@ -0,0 +1,215 @@
+import json
+import time
+import hmac
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -----------------------------------------
+# 🔹 離線壓測用的 LINE / OpenAI 替身
+# -----------------------------------------
+# 一個 HTTP server 同時模擬：
+#   - OpenAI  POST /v1/chat/completions  (可設定延遲，支援 stream=True 的 SSE)
+#   - LINE    POST /v2/bot/message/reply、/v2/bot/message/push  (記錄送給每個使用者的訊息)
+# chatbot 以 OPENAI_BASE_URL=http://host:port/v1、LINE_API_ENDPOINT=http://host:port 指向這裡，
+# 資料庫使用 STORAGE_BACKEND=memory (MEMORY_STORAGE_LATENCY_MS 模擬 Firestore 延遲)。
+
+def line_webhook_body(user_id, text, reply_token, event_id=None):
+    """產生 LINE MessageEvent webhook 的 JSON body"""
+    now = int(time.time() * 1000)
+    return json.dumps({
+        "destination": "Umockdestination",
+        "events": [{
+            "type": "message",
+            "mode": "active",
+            "timestamp": now,
+            "source": {"type": "user", "userId": user_id},
+            "webhookEventId": event_id or reply_token,
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": reply_token,
+            "message": {"id": str(now), "type": "text", "text": text},
+        }],
+    })
+
+def line_signature(body, secret):
+    """X-Line-Signature：以 channel secret 對 body 做 HMAC-SHA256 再 base64"""
+    digest = hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+class LineMock:
+    """記錄 reply / push 的訊息 (reply token 格式為 "<user_id>.<序號>"，用來對應使用者)"""
+
+    def __init__(self):
+        self._messages = {}  # user_id -> [(perf_counter, text)]
+        self._cond = threading.Condition()
+
+    def deliver(self, user_id, text):
+        with self._cond:
+            self._messages.setdefault(user_id, []).append((time.perf_counter(), text))
+            self._cond.notify_all()
+
+    def count(self, user_id):
+        with self._cond:
+            return len(self._messages.get(user_id, []))
+
+    def wait(self, user_id, start_index, is_final, timeout):
+        """等待 start_index 之後的訊息，直到 is_final(text) 為 True；回傳 [(時間, 文字)] (逾時回傳 None)"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                received = self._messages.get(user_id, [])[start_index:]
+                if any(is_final(text) for _, text in received):
+                    return received
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+class OpenAIMock:
+    """模擬 chat completions：回答固定字數，延遲 = latency_ms ± jitter_ms"""
+
+    def __init__(self, latency_ms=800.0, first_token_ms=300.0, jitter_ms=0.0, answer_words=60):
+        self.latency_ms = latency_ms
+        self.first_token_ms = first_token_ms
+        self.jitter_ms = jitter_ms
+        self.answer_words = answer_words
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def delay(self, ms):
+        if self.jitter_ms:
+            ms += random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(ms, 0.0) / 1000
+
+    def answer(self, messages):
+        question = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        filler = " ".join("delicious" for _ in range(max(self.answer_words - 4, 0)))
+        return f"Mock answer for: {question[:80]} {filler}".strip()
+
+    def usage(self, messages, answer):
+        prompt_tokens = sum(len(m.get("content", "")) // 4 + 4 for m in messages)
+        completion_tokens = len(answer) // 4
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "MockServices/1.0"
+
+    def log_message(self, format, *args):
+        pass  # 壓測時不輸出每個請求
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self._chat_completion(payload)
+        elif self.path == "/v2/bot/message/reply":
+            user_id = payload.get("replyToken", "").rsplit(".", 1)[0]
+            self._line_delivery(user_id, payload)
+        elif self.path == "/v2/bot/message/push":
+            self._line_delivery(payload.get("to", ""), payload)
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, 404)
+
+    def _line_delivery(self, user_id, payload):
+        line = self.server.line
+        for message in payload.get("messages", []):
+            line.deliver(user_id, message.get("text", ""))
+        self._send_json({})
+
+    def _chat_completion(self, payload):
+        openai_mock = self.server.openai
+        openai_mock.count()
+        messages = payload.get("messages", [])
+        answer = openai_mock.answer(messages)
+        usage = openai_mock.usage(messages, answer)
+        created = int(time.time())
+        model = payload.get("model", "mock")
+
+        if not payload.get("stream"):
+            time.sleep(openai_mock.delay(openai_mock.latency_ms))
+            self._send_json({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        # SSE：第一個 token 在 first_token_ms 後送出，其餘平均分布到 latency_ms
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = answer.split(" ")
+        first = openai_mock.delay(openai_mock.first_token_ms)
+        step = max(openai_mock.delay(openai_mock.latency_ms) - first, 0.0) / max(len(words) - 1, 1)
+
+        def send(chunk):
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model}
+        time.sleep(first)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(step)
+            delta = {"content": word if i == 0 else f" {word}"}
+            send(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+        send(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            send(dict(base, choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # 預設 listen(5) 在高併發時會拒絕連線
+
+def start_mock_services(host="127.0.0.1", port=0, **openai_options):
+    """在背景線程啟動 mock server，回傳 (server, base_url)；server.line / server.openai 可查詢收到的請求"""
+    server = MockServer((host, port), MockHandler)
+    server.line = LineMock()
+    server.openai = OpenAIMock(**openai_options)
+    threading.Thread(target=server.serve_forever, name="mock-services", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="啟動 LINE / OpenAI 的本機替身 (離線壓測用)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--answer-words", type=int, default=60)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_services(
+        args.host, args.port, latency_ms=args.llm_latency_ms, first_token_ms=args.llm_first_token_ms,
+        jitter_ms=args.llm_jitter_ms, answer_words=args.answer_words,
+    )
+    print(f"🧪 Mock services: OPENAI_BASE_URL={base_url}/v1 LINE_API_ENDPOINT={base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import re
+import time
+import pickle
+import threading
+from collections import OrderedDict
+
+# 查詢前後常見的標點，不影響語意但會讓相同查詢變成不同的 key
+_EDGE_PUNCTUATION = ".,!?;:~。，！？～ "
+
+def normalize_query(query):
+    """正規化查詢文字：小寫、合併空白、去掉前後標點"""
+    return re.sub(r"\s+", " ", str(query).lower()).strip(_EDGE_PUNCTUATION)
+
+class QueryCache:
+    """執行緒安全、有大小上限和 TTL 的 LRU cache"""
+
+    def __init__(self, max_size=1024, ttl=0, name="cache"):
+        self.max_size = max_size
+        self.ttl = ttl  # 秒，0 代表不過期
+        self.name = name
+        self._entries = OrderedDict()  # key -> (value, created_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, created_at, now):
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def get(self, key):
+        """取得快取值 (不存在或過期時回傳 None)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self._expired(entry[1], now):
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, created_at=None):
+        with self._lock:
+            self._entries[key] = (value, created_at or time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        """移除並回傳快取值 (不存在時回傳 None)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def items(self):
+        """目前未過期的 (key, value, created_at)，依最近使用順序 (舊 → 新)"""
+        now = time.time()
+        with self._lock:
+            return [
+                (key, value, created_at)
+                for key, (value, created_at) in self._entries.items()
+                if not self._expired(created_at, now)
+            ]
+
+def save_caches(path, caches, fingerprints=None):
+    """把多個 cache 存到同一個檔案 (先寫暫存檔再 rename)"""
+    payload = {
+        "version": 1,
+        "fingerprints": fingerprints or {},
+        "caches": {name: cache.items() for name, cache in caches.items()},
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_caches(path, caches, fingerprints=None):
+    """從檔案還原 cache；fingerprint 不符 (例如換了索引或模型) 的 cache 會被略過"""
+    if not path or not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+    except Exception as e:
+        print(f"⚠️ 無法讀取查詢快取 {path}: {e}")
+        return 0
+
+    fingerprints = fingerprints or {}
+    saved_fingerprints = payload.get("fingerprints", {})
+    restored = 0
+    for name, cache in caches.items():
+        if saved_fingerprints.get(name) != fingerprints.get(name):
+            print(f"⚠️ 查詢快取 {name} 已過時，略過還原")
+            continue
+        for key, value, created_at in payload.get("caches", {}).get(name, []):
+            if not cache._expired(created_at, time.time()):
+                cache.put(key, value, created_at)
+                restored += 1
+    return restored
@@ -0,0 +1,42 @@
+import re
+
+from query_cache import normalize_query
+
+# -----------------------------------------
+# 🔹 不需要檢索和 GPT 的訊息
+# -----------------------------------------
+# 打招呼、道謝和說明類的指令直接以固定文字回覆 (不 encode、不搜尋、不呼叫 OpenAI)。
+# 只比對整則訊息 (正規化後)，"hi, any chicken recipes?" 這類帶有問題的訊息仍然走一般流程。
+_GREETING_RE = re.compile(
+    r"(hi+|hello+|hey+|hiya|yo|howdy|good (morning|afternoon|evening)|你好|您好|嗨|哈囉|安安)"
+    r"( there| chef| bot)?"
+)
+_THANKS_RE = re.compile(r"(thanks?( you)?( so much| a lot)?|thx|ty|謝謝|感謝)")
+_GOODBYE_RE = re.compile(r"(bye+|goodbye|see (you|ya)|good night|掰掰|再見|晚安)")
+_HELP_RE = re.compile(r"/?(help|commands|menu|what can you do|how does this work|說明|幫助)")
+_SHOW_PREFERENCES_RE = re.compile(r"/?(show|my|what are my|what is my) (diet|preferences?|dietary preferences?)")
+
+HELP_TEXT = (
+    "Ask me for a recipe, e.g. 'a quick chicken dinner' or 'something with tofu and rice'. "
+    "I'll pick recipes that fit your dietary preferences.\n"
+    "Type 'show preferences' to see them, or 'change preference' to set new ones."
+)
+
+def quick_reply(text, preferences=None):
+    """打招呼 / 指令的固定回覆；需要檢索的訊息回傳 None"""
+    message = normalize_query(text)
+    if not message:
+        return None
+    if _GREETING_RE.fullmatch(message):
+        return "Hi! What would you like to cook today? Tell me a dish or the ingredients you have."
+    if _THANKS_RE.fullmatch(message):
+        return "You're welcome! Let me know whenever you want another recipe."
+    if _GOODBYE_RE.fullmatch(message):
+        return "Bye! Happy cooking!"
+    if _HELP_RE.fullmatch(message):
+        return HELP_TEXT
+    if _SHOW_PREFERENCES_RE.fullmatch(message):
+        if preferences:
+            return f"Your dietary preferences: {preferences}. Type 'change preference' to update them."
+        return "You haven't set any dietary preferences yet."
+    return None
@@ -0,0 +1,143 @@
+import time
+import threading
+import numpy as np
+
+# -----------------------------------------
+# 🔹 第二階段重新排序
+# -----------------------------------------
+# 第一階段 (vector / bm25 / hybrid) 多取幾筆候選，這裡再從中選出最後的 k 筆：
+#   mmr           : maximal marginal relevance，用索引中已存的向量 (index.reconstruct，不需要再 encode)
+#                   計算候選彼此之間的相似度，避免回傳幾乎相同的食譜；相關度使用第一階段的分數
+#                   (hybrid / bm25 的 RRF 分數)，沒有時才用候選和查詢向量的 cosine
+#   cross_encoder : 小型 cross-encoder 對 (查詢, 標題 + 食材) 打分數 (較準確，但每筆候選都要跑一次模型)
+# 兩種都有毫秒預算：超過時剩下的名次沿用第一階段的順序。
+RERANK_MODES = ("none", "mmr", "cross_encoder")
+
+class Reranker:
+    """重新排序的共同流程：預算控制、失敗時退回第一階段順序、統計"""
+
+    name = "none"
+
+    def __init__(self, budget_ms):
+        self.budget_ms = budget_ms
+        self._lock = threading.Lock()
+
+        # 統計
+        self.requests = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.over_budget = 0
+        self.errors = 0
+
+    def _rerank(self, query, query_vector, ids, k, deadline, relevance=None):
+        """回傳 (排序後的行號, 是否在預算內完成)"""
+        raise NotImplementedError
+
+    def rerank(self, query, query_vector, ids, k, relevance=None):
+        """從候選行號 ids (第一階段的順序) 選出 k 筆，回傳行號 tuple
+
+        relevance 為第一階段每個候選的分數 (和 ids 對齊，越大越相關)；None 時由各 reranker 自行計算。
+        """
+        ids = list(ids)
+        if len(ids) <= 1:
+            return tuple(ids[:k])
+        start = time.perf_counter()
+        complete, failed = True, False
+        try:
+            ranked, complete = self._rerank(query, query_vector, ids, k, start + self.budget_ms / 1000, relevance)
+        except Exception as e:
+            print(f"⚠️ {self.name} 重新排序失敗，使用第一階段的順序: {e}")
+            ranked, failed = [], True
+        seen = set(ranked)
+        ranked = list(ranked) + [i for i in ids if i not in seen]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.requests += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            self.over_budget += not complete
+            self.errors += failed
+        return tuple(ranked[:k])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.name,
+                "budget_ms": self.budget_ms,
+                "requests": self.requests,
+                "avg_ms": round(self.total_ms / self.requests, 2) if self.requests else 0.0,
+                "max_ms": round(self.max_ms, 2),
+                "over_budget": self.over_budget,
+                "errors": self.errors,
+            }
+
+class MMRReranker(Reranker):
+    """score = λ · rel(候選) − (1 − λ) · max sim(候選, 已選的食譜)
+
+    vectors_fn(ids) 回傳候選在索引中的向量；λ = 1 等於只按相關度排序，越小越重視多樣性。
+    rel 為第一階段的分數除以最大值 (0~1，和 cosine 同一個範圍)，沒有時用 cosine(查詢, 候選)。
+    """
+
+    name = "mmr"
+
+    def __init__(self, vectors_fn, lambda_=0.5, budget_ms=50):
+        super().__init__(budget_ms)
+        self.vectors_fn = vectors_fn
+        self.lambda_ = lambda_
+
+    def _rerank(self, query, query_vector, ids, k, deadline, relevance=None):
+        vectors = self.vectors_fn(ids)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if relevance is not None:
+            relevance = np.asarray(relevance, dtype=np.float32)
+            relevance = relevance / max(float(relevance.max()), 1e-12)
+        else:
+            query_vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+            relevance = vectors @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+        similarity = vectors @ vectors.T
+
+        first = int(np.argmax(relevance))
+        selected = [first]
+        max_similarity = similarity[first].copy()
+        while len(selected) < min(k, len(ids)):
+            if time.perf_counter() > deadline:
+                return [ids[j] for j in selected], False
+            scores = self.lambda_ * relevance - (1 - self.lambda_) * max_similarity
+            scores[selected] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            np.maximum(max_similarity, similarity[best], out=max_similarity)
+        return [ids[j] for j in selected], True
+
+class CrossEncoderReranker(Reranker):
+    """cross-encoder 分批替候選打分數，超過預算時沒打到分數的候選排在後面
+
+    texts_fn(ids) 回傳候選的文字；模型在 load() 時才載入 (RAG 的啟動元件)。
+    """
+
+    name = "cross_encoder"
+
+    def __init__(self, model_name, texts_fn, budget_ms=150, batch_size=8):
+        super().__init__(budget_ms)
+        self.model_name = model_name
+        self.texts_fn = texts_fn
+        self.batch_size = batch_size
+        self.model = None
+
+    def load(self):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(self.model_name)
+
+    def _rerank(self, query, query_vector, ids, k, deadline, relevance=None):
+        if self.model is None:
+            raise RuntimeError("cross-encoder 尚未載入")
+        texts = self.texts_fn(ids)
+        scored = []
+        for start in range(0, len(ids), self.batch_size):
+            if start and time.perf_counter() > deadline:
+                break
+            batch = texts[start:start + self.batch_size]
+            scores = self.model.predict([(query, text) for text in batch])
+            scored.extend(zip((float(s) for s in scores), ids[start:start + len(batch)]))
+        scored.sort(key=lambda item: -item[0])
+        return [i for _, i in scored], len(scored) == len(ids)
@@ -0,0 +1,115 @@
+import time
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+class SemanticAnswerCache:
+    """以 embedding 相似度查詢的回答快取 (偏好 + 查詢 → GPT 回答)
+
+    向量存放在獨立的小型 FAISS 索引 (內積 = cosine，向量需先 L2 正規化)，
+    相似度 >= threshold 就回傳先前的回答。有大小上限 (LRU) 和 TTL。
+    key 不是 None 時只比對 key 完全相同的項目 (例如本輪檢索到的食譜 id)。
+    """
+
+    def __init__(self, dim, threshold=0.95, max_size=1000, ttl=3600, name="semantic"):
+        self.dim = dim
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl  # 秒，0 代表不過期
+        self.name = name
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self._entries = OrderedDict()  # id -> {"text", "key", "answer", "tokens", "latency_ms", "created_at"}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        # 統計
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saved_tokens = 0
+        self.saved_latency_ms = 0.0
+
+    def _expired(self, entry, now):
+        return self.ttl > 0 and now - entry["created_at"] > self.ttl
+
+    def _remove(self, ids):
+        for entry_id in ids:
+            self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def get(self, vector, k=4, key=None):
+        """回傳最相似、未過期且 key 相同的快取 (entry dict, 相似度)，沒有時回傳 (None, 最高相似度)"""
+        vector = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, self.dim)
+        now = time.time()
+        with self._lock:
+            best = 0.0
+            if self._index.ntotal:
+                scores, ids = self._index.search(vector, min(k, self._index.ntotal))
+                expired = []
+                for score, entry_id in zip(scores[0], ids[0]):
+                    entry = self._entries.get(int(entry_id))
+                    if entry is None:
+                        continue
+                    if self._expired(entry, now):
+                        expired.append(int(entry_id))
+                        continue
+                    if entry["key"] != key:
+                        continue
+                    best = max(best, float(score))
+                    if score >= self.threshold:
+                        self._entries.move_to_end(int(entry_id))
+                        self.hits += 1
+                        self.saved_tokens += entry["tokens"]
+                        self.saved_latency_ms += entry["latency_ms"]
+                        return entry, float(score)
+                if expired:
+                    self._remove(expired)
+                    self.expirations += len(expired)
+            self.misses += 1
+            return None, best
+
+    def put(self, vector, text, answer, tokens=0, latency_ms=0.0, key=None):
+        vector = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, self.dim)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {
+                "text": text,
+                "key": key,
+                "answer": answer,
+                "tokens": tokens,
+                "latency_ms": latency_ms,
+                "created_at": time.time(),
+            }
+            if len(self._entries) > self.max_size:
+                overflow = len(self._entries) - self.max_size
+                oldest = [entry_id for entry_id, _ in zip(self._entries, range(overflow))]
+                self._remove(oldest)
+                self.evictions += overflow
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.reset()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "saved_tokens": self.saved_tokens,
+            "saved_latency_ms": round(self.saved_latency_ms, 1),
+        }
@@ -0,0 +1,198 @@
+import threading
+
+from query_cache import QueryCache
+from storage import ConversationWrite
+
+class UserSession:
+    """單一訊息處理期間共用的使用者狀態 (偏好 + 對話記錄)"""
+
+    __slots__ = ("user_id", "profile", "conversation", "stored", "reads", "writes")
+
+    def __init__(self, user_id, profile, conversation=None):
+        self.user_id = user_id
+        self.profile = profile or {}
+        self.conversation = conversation  # summary_cursor 之後的訊息，None 代表尚未讀取
+        # 讀取時資料庫中已有的訊息數：序號小於 stored 的訊息，暫定序號就是實際序號
+        self.stored = self.profile.get("message_count") or 0
+        self.reads = 0
+        self.writes = 0
+
+    @property
+    def preferences(self):
+        return self.profile.get("preferences")
+
+    @property
+    def summary(self):
+        """較早對話的摘要 (存在使用者資料中)"""
+        return self.profile.get("summary", "")
+
+    @property
+    def cursor(self):
+        """第一則尚未併入摘要的訊息序號"""
+        return self.profile.get("summary_cursor", 0)
+
+    @property
+    def message_count(self):
+        """已儲存 (或已排入 write-behind 佇列) 的訊息數；舊版資料沒有這個欄位"""
+        return self.profile.get("message_count")
+
+class SessionCache:
+    """熱門使用者的 write-through cache，減少每則訊息的資料庫往返
+
+    讀取：revalidate=True (預設) 時每則訊息都重新讀取使用者資料 (偏好、message_count、summary_cursor)，
+    只快取對話記錄；message_count / summary_cursor 和快取時相同才重用，否則重新讀取對話。
+    其他 worker / instance 更新的偏好或新增的訊息因此立即生效，不必等 TTL 過期。
+    revalidate=False 時快取中有就不讀資料庫 (只適用單一進程部署)。
+    寫入：偏好先寫資料庫，成功後同步更新快取。
+    對話只新增訊息 (append-only)；指定 writer (WriteBehindQueue) 時交給背景線程批次寫入，
+    讀取時會合併 writer 中尚未寫入的更新。
+    """
+
+    def __init__(self, load_profile, save_profile, clear_preferences, load_messages,
+                 commit, writer=None, max_users=1000, ttl=300, revalidate=True):
+        self._load_profile = load_profile
+        self._save_profile = save_profile
+        self._clear_preferences = clear_preferences
+        self._load_messages = load_messages
+        self._commit = commit
+        self._writer = writer
+        self.revalidate = revalidate
+        self._cache = QueryCache(max_users, ttl, name="session")
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.stale = 0  # 其他進程更新過、需要重新讀取對話的次數
+        self.reads = 0
+        self.writes = 0
+
+    def _count(self, session, reads=0, writes=0):
+        session.reads += reads
+        session.writes += writes
+        with self._lock:
+            self.reads += reads
+            self.writes += writes
+
+    def _store(self, session):
+        self._cache.put(session.user_id, (dict(session.profile), session.conversation))
+
+    def load(self, user_id):
+        """取得使用者 session (每則訊息呼叫一次)"""
+        with self._lock:
+            self.messages += 1
+        cached = self._cache.get(user_id)
+        if cached is not None and not self.revalidate:
+            profile, conversation = cached
+            return UserSession(user_id, dict(profile), list(conversation) if conversation is not None else None)
+
+        session = UserSession(user_id, self._load_profile(user_id))
+        self._count(session, reads=1)
+        pending = self._writer.pending(user_id) if self._writer else None
+        if pending is not None:
+            session.profile.update(pending[0])
+        if cached is not None and cached[1] is not None:
+            profile, conversation = cached
+            version = (profile.get("message_count"), profile.get("summary_cursor", 0))
+            if version == (session.message_count, session.cursor):
+                session.conversation = list(conversation)
+            else:
+                with self._lock:
+                    self.stale += 1
+        self._store(session)
+        return session
+
+    def set_preferences(self, session, preferences):
+        if not self._save_profile(session.user_id, {"preferences": preferences}):
+            raise RuntimeError("Failed to save preferences")
+        self._count(session, writes=1)
+        session.profile["preferences"] = preferences
+        self._store(session)
+
+    def clear_preferences(self, session):
+        """刪除偏好 ("change preference")，並讓快取中的偏好失效"""
+        if not self._clear_preferences(session.user_id):
+            self.invalidate(session.user_id)
+            raise RuntimeError("Failed to clear preferences")
+        self._count(session, writes=1)
+        session.profile.pop("preferences", None)
+        self._store(session)
+
+    def get_conversation(self, session):
+        """取得摘要之後的對話記錄 (同一個 session 只讀取一次)"""
+        if session.conversation is None:
+            cursor = session.cursor
+            messages = self._load_messages(session.user_id, cursor)
+            self._count(session, reads=1)
+            if session.message_count is None and messages:
+                # 讀取使用者資料之後，其他 worker 可能已經寫入這個使用者的第一批訊息：再讀一次確認是否為舊版資料
+                count = (self._load_profile(session.user_id) or {}).get("message_count")
+                self._count(session, reads=1)
+                if count is not None:
+                    session.profile["message_count"] = count
+            if session.message_count is None:
+                # 舊版整份儲存的對話 (含系統提示)：系統提示每一輪重新產生，不再保存
+                messages = [m for m in messages if m.get("role") != "system"]
+            pending = self._writer.pending(session.user_id) if self._writer else None
+            if pending is None and session.message_count is not None and cursor + len(messages) > session.stored:
+                # 讀取使用者資料之後其他 worker 又新增了訊息：這些訊息已儲存，不要當成新訊息再寫一次
+                session.stored = cursor + len(messages)
+                session.profile["message_count"] = session.stored
+            for seq, message in sorted(pending[1].items()) if pending else ():
+                if seq - cursor == len(messages):
+                    messages.append(message)
+                elif 0 <= seq - cursor < len(messages):
+                    messages[seq - cursor] = message
+            session.conversation = messages
+            self._store(session)
+        return list(session.conversation)
+
+    def append_messages(self, session, messages, summary=None, folded=0):
+        """新增訊息 (只寫入新的訊息，不覆寫整份對話)
+
+        folded > 0 時，目前對話的前 folded 則已併入 summary，之後從新的 summary_cursor 開始讀取。
+        實際的 summary_cursor 由 commit() 在 transaction 中依最後一則被摺疊訊息的序號決定，
+        這裡只先更新快取中的預估值 (不一致時下一次 load 會重新讀取)。
+        有 writer 時只排入佇列並立即更新快取；否則同步寫入，失敗時回傳 False。
+        """
+        conversation = self.get_conversation(session) + list(messages)
+        cursor = session.cursor
+        saved = session.message_count or 0  # 舊版資料全部轉成逐則訊息
+        profile = {"message_count": cursor + len(conversation)}
+        fold = None
+        if folded:
+            through = cursor + folded - 1
+            if session.stored <= through < saved:
+                # 最後一則被摺疊的訊息還在 write-behind 佇列中，實際序號未知：這次不摺疊
+                print(f"⚠️ 摺疊的訊息尚未寫入，略過這次摺疊 ({session.user_id})")
+                folded = 0
+            else:
+                profile.update(summary=summary, summary_cursor=through + 1)
+                fold = (cursor, through, folded)
+        write = ConversationWrite(session.user_id, profile, {
+            cursor + i: message for i, message in enumerate(conversation) if cursor + i >= saved
+        }, fold=fold)
+
+        if self._writer is not None:
+            self._writer.enqueue(write)
+        elif not self._commit([write]):
+            self.invalidate(session.user_id)
+            return False
+        self._count(session, writes=1)
+        session.profile.update(profile)
+        session.conversation = conversation[folded:]
+        self._store(session)
+        return True
+
+    def invalidate(self, user_id):
+        self._cache.pop(user_id)
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats.update({
+            "messages": self.messages,
+            "revalidate": self.revalidate,
+            "stale_conversations": self.stale,
+            "storage_reads": self.reads,
+            "storage_writes": self.writes,
+            "reads_per_message": round(self.reads / self.messages, 3) if self.messages else 0.0,
+            "writes_per_message": round(self.writes / self.messages, 3) if self.messages else 0.0,
+        })
+        return stats
@@ -0,0 +1,86 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class StartupComponent:
+    """一個需要在啟動時載入的元件 (模型、索引、元數據...)"""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.status = "pending"
+        self.seconds = None
+        self.error = None
+
+    def run(self):
+        self.status = "loading"
+        start = time.perf_counter()
+        try:
+            self.loader()
+            self.status = "ready"
+            print(f"✅ {self.name} 載入完成 ({time.perf_counter() - start:.2f}s)")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"❌ {self.name} 載入失敗: {e}")
+        finally:
+            self.seconds = round(time.perf_counter() - start, 3)
+
+class StartupOrchestrator:
+    """並行載入所有元件，且整個進程只載入一次 (執行緒安全)
+
+    start() 立即返回，載入在背景線程中進行；請求處理路徑只查詢 is_ready()，不會等待或重試。
+    """
+
+    def __init__(self):
+        self._components = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._done = threading.Event()
+        self.started_at = None
+        self.seconds = None
+
+    def register(self, name, loader):
+        self._components[name] = StartupComponent(name, loader)
+
+    def start(self):
+        """開始背景載入 (重複呼叫不會重複載入)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self.started_at = time.time()
+        threading.Thread(target=self._run_all, name="startup", daemon=True).start()
+
+    def _run_all(self):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self._components) or 1, thread_name_prefix="startup") as pool:
+            list(pool.map(lambda component: component.run(), self._components.values()))
+        self.seconds = round(time.perf_counter() - start, 3)
+        print(f"🚀 啟動完成 ({self.seconds}s): {self.summary()}")
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """等待載入結束 (只在背景初始化或命令列工具中使用)"""
+        self.start()
+        return self._done.wait(timeout)
+
+    def is_ready(self):
+        return all(component.status == "ready" for component in self._components.values())
+
+    def failed(self):
+        return [component.name for component in self._components.values() if component.status == "failed"]
+
+    def summary(self):
+        return ", ".join(f"{c.name}={c.status}({c.seconds}s)" for c in self._components.values())
+
+    def status(self):
+        return {
+            "ready": self.is_ready(),
+            "started": self._started,
+            "total_seconds": self.seconds,
+            "components": {
+                c.name: {"status": c.status, "seconds": c.seconds, "error": c.error}
+                for c in self._components.values()
+            },
+        }
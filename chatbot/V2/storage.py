@@ -0,0 +1,408 @@
+import os
+import copy
+import time
+import json
+import sqlite3
+import threading
+
+# -----------------------------------------
+# 🔹 使用者資料儲存後端
+# -----------------------------------------
+# STORAGE_BACKEND=firestore (預設) | sqlite | memory
+# sqlite / memory 不需要 Firebase 專案，可用於離線壓測、benchmark 或小型部署。
+# memory 後端可用 MEMORY_STORAGE_LATENCY_MS 模擬 Firestore 每次讀寫的延遲 (見 load_test.py)。
+# 所有後端的錯誤處理方式相同：印出錯誤並回傳 None / False / []。
+#
+# 對話記錄是 append-only 的：每則訊息有一個遞增的序號 (seq)，只新增不覆寫。
+# 使用者資料中的 message_count 是下一則訊息的序號，summary_cursor 之前的訊息已併入 summary，
+# 讀取時只取 seq >= summary_cursor 的訊息。舊版整份覆寫的對話記錄在第一次寫入時轉成逐則訊息。
+# 多個 worker 可能同時替同一使用者新增訊息，各自快取的 message_count 會過時：
+# ConversationWrite 中的序號只用來排序，實際的 seq 由 commit() 在 transaction 中分配 (接在已儲存的訊息之後)，
+# message_count 也在同一個 transaction 中更新，不會互相覆寫。
+# 摺疊對話時的 summary_cursor 同樣在 transaction 中決定：等於最後一則被摺疊訊息的實際 seq + 1。
+# 摘要所根據的 summary_cursor 已被其他 worker 移動，或其他 worker 的訊息插在被摺疊的訊息之間時，
+# 放棄這次摺疊 (訊息不會被跳過或重複摘要，之後會重新摺疊)。
+
+class ConversationWrite:
+    """一個使用者待寫入的更新：使用者資料 (合併更新) + 新訊息 {暫定序號: message}
+
+    fold = (摘要根據的 summary_cursor, 最後一則被摺疊訊息的暫定序號, 被摺疊的訊息數)，沒有摺疊時為 None。
+    """
+
+    __slots__ = ("user_id", "profile", "messages", "fold")
+
+    def __init__(self, user_id, profile=None, messages=None, fold=None):
+        self.user_id = user_id
+        self.profile = dict(profile or {})
+        self.messages = dict(messages or {})
+        self.fold = fold
+
+    def merge(self, newer):
+        """合併同一使用者較新的更新 (相同欄位以較新的為準，訊息接在後面)"""
+        self.profile.update(newer.profile)
+        moved = {}
+        for seq, message in sorted(newer.messages.items()):
+            if self.messages.get(seq, message) != message:
+                # 同時處理的兩則訊息從同一個快取算出相同的暫定序號：兩者都保留
+                moved[seq] = max(self.messages) + 1
+                seq = moved[seq]
+            self.messages[seq] = message
+        if newer.fold is not None:
+            base, through, count = newer.fold
+            if self.fold is not None and base == self.fold[1] + 1:
+                # 接續上一次摺疊：新的摘要已包含上一次的摘要
+                base, count = self.fold[0], self.fold[2] + count
+            self.fold = (base, moved.get(through, through), count)
+
+    def ordered_messages(self):
+        return [message for _, message in sorted(self.messages.items())]
+
+    def allocate(self, next_seq, cursor=0):
+        """從 next_seq (已儲存的下一個序號) 開始分配實際序號，回傳 (使用者資料, [(seq, message)])
+
+        cursor 是已儲存的 summary_cursor。有摺疊時 summary_cursor = 最後一則被摺疊訊息的實際序號 + 1
+        (這次寫入的訊息用分配到的序號，已儲存的訊息用原本的序號)。摘要不是根據目前的 summary_cursor
+        產生 (其他 worker 已經摺疊過)，或 cursor 到該訊息之間不只被摺疊的訊息時，不寫入 summary / summary_cursor。
+        """
+        seqs = {seq: next_seq + i for i, seq in enumerate(sorted(self.messages))}
+        messages = [(seqs[seq], self.messages[seq]) for seq in sorted(self.messages)]
+        profile = dict(self.profile)
+        if messages:
+            profile["message_count"] = next_seq + len(messages)
+        else:
+            profile.pop("message_count", None)
+        if self.fold is not None:
+            base, through, count = self.fold
+            last = seqs.get(through, through if through < next_seq else None)
+            if base == cursor and last is not None and last - base + 1 == count:
+                profile["summary_cursor"] = last + 1
+            else:
+                profile.pop("summary", None)
+                profile.pop("summary_cursor", None)
+        return profile, messages
+
+class BaseStorage:
+    """使用者偏好和對話記錄的儲存介面"""
+
+    name = "base"
+
+    def get_user(self, user_id):
+        """取得使用者資料 (不存在時回傳 None)"""
+        raise NotImplementedError
+
+    def set_user(self, user_id, data):
+        """合併更新使用者資料"""
+        raise NotImplementedError
+
+    def clear_preferences(self, user_id):
+        """刪除使用者偏好"""
+        raise NotImplementedError
+
+    def get_messages(self, user_id, start=0):
+        """取得序號 >= start 的對話訊息 (依序號排列，不存在時回傳空列表)"""
+        raise NotImplementedError
+
+    def after_fork(self):
+        """gunicorn fork 出 worker 後呼叫 (需要時重新建立連線)"""
+
+    def commit(self, writes):
+        """一次寫入多個使用者的 ConversationWrite (使用者資料 + 新訊息)，成功回傳 True
+
+        新訊息的 seq 在寫入的 transaction 中分配，不使用呼叫端 (可能過時) 的序號。
+        """
+        raise NotImplementedError
+
+FIRESTORE_BATCH_LIMIT = 500  # Firestore 每個 batch 最多 500 個寫入
+
+class FirestoreStorage(BaseStorage):
+    """Firestore 後端 (users / conversations 兩個 collection)"""
+
+    name = "firestore"
+
+    def __init__(self, credentials_json=None):
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        credentials_json = credentials_json or os.getenv("FIREBASE_CREDENTIALS")
+        if not credentials_json:
+            raise ValueError("❌ FIREBASE_CREDENTIALS not found! Please set it in Render environment variables.")
+
+        if not firebase_admin._apps:  # 確保 Firebase 只初始化一次
+            cred_dict = json.loads(credentials_json) if isinstance(credentials_json, str) else credentials_json
+            firebase_admin.initialize_app(credentials.Certificate(cred_dict))
+            print("✅ Firestore database initialized successfully!")
+
+        self._firestore = firestore
+        self.db = firestore.client()
+
+    def after_fork(self):
+        # gRPC 連線不能跨 fork 使用：master 的 client 留在 master，worker 以自己的 app 建立新的 client
+        import firebase_admin
+
+        name = f"worker-{os.getpid()}"
+        if name not in firebase_admin._apps:
+            firebase_admin.initialize_app(firebase_admin.get_app().credential, name=name)
+        self.db = self._firestore.client(firebase_admin.get_app(name))
+
+    def test_connection(self):
+        """寫入測試文檔確認連線 (只在 FIREBASE_CONNECTION_TEST=1 時於啟動時執行)"""
+        try:
+            test_ref = self.db.collection("test").document("connection_test")
+            test_ref.set({"timestamp": self._firestore.SERVER_TIMESTAMP})
+            print("✅ Firebase 連接成功")
+            return True
+        except Exception as e:
+            print(f"❌ Firebase 連接失敗: {e}")
+            return False
+
+    def get_user(self, user_id):
+        try:
+            user_doc = self.db.collection("users").document(user_id).get()
+            return user_doc.to_dict() if user_doc.exists else None
+        except Exception as e:
+            print(f"❌ Firestore 獲取用戶數據錯誤: {e}")
+            return None
+
+    def set_user(self, user_id, data):
+        try:
+            self.db.collection("users").document(user_id).set(data, merge=True)
+            return True
+        except Exception as e:
+            print(f"❌ Firestore 設置用戶數據錯誤: {e}")
+            return False
+
+    def clear_preferences(self, user_id):
+        try:
+            user_ref = self.db.collection("users").document(user_id)
+            user_ref.set({"preferences": self._firestore.DELETE_FIELD}, merge=True)
+            return True
+        except Exception as e:
+            print(f"❌ Firestore 刪除用戶偏好錯誤: {e}")
+            return False
+
+    def _messages_ref(self, user_id):
+        # conversations/{user_id}/messages/{seq}：每則訊息一個文件，只新增不覆寫
+        return self.db.collection("conversations").document(user_id).collection("messages")
+
+    def get_messages(self, user_id, start=0):
+        try:
+            docs = self._messages_ref(user_id).where("seq", ">=", start).order_by("seq").stream()
+            messages = [{"role": d["role"], "content": d["content"]} for d in (doc.to_dict() for doc in docs)]
+            if not messages and start == 0:
+                # 舊版資料：整份對話存在 conversations/{user_id}.messages
+                user_doc = self.db.collection("conversations").document(user_id).get()
+                messages = user_doc.to_dict().get("messages", []) if user_doc.exists else []
+            return messages
+        except Exception as e:
+            print(f"❌ Firestore 獲取對話記錄錯誤: {e}")
+            return []
+
+    def _commit_chunk(self, writes):
+        """一個 transaction：先讀取各使用者的 message_count / summary_cursor，再分配 seq 並寫入 (衝突時 Firestore 會重試)"""
+        @self._firestore.transactional
+        def run(transaction):
+            user_refs = [self.db.collection("users").document(write.user_id) for write in writes]
+            users = []
+            for user_ref in user_refs:  # transaction 中所有讀取必須在寫入之前
+                snapshot = user_ref.get(transaction=transaction)
+                users.append((snapshot.to_dict() or {}) if snapshot.exists else {})
+            for write, user_ref, user in zip(writes, user_refs, users):
+                profile, messages = write.allocate(user.get("message_count", 0), user.get("summary_cursor", 0))
+                if profile:
+                    transaction.set(user_ref, profile, merge=True)
+                messages_ref = self._messages_ref(write.user_id)
+                for seq, message in messages:
+                    # create：序號已存在時整個 transaction 失敗，不會覆寫其他 worker 的訊息
+                    transaction.create(messages_ref.document(f"{seq:08d}"), {"seq": seq, **message})
+
+        run(self.db.transaction())
+
+    def commit(self, writes):
+        try:
+            chunk, operations = [], 0
+            for write in writes:
+                size = 1 + len(write.messages)
+                if chunk and operations + size > FIRESTORE_BATCH_LIMIT:
+                    self._commit_chunk(chunk)
+                    chunk, operations = [], 0
+                chunk.append(write)
+                operations += size
+            if chunk:
+                self._commit_chunk(chunk)
+            return True
+        except Exception as e:
+            print(f"❌ Firestore 批次寫入錯誤: {e}")
+            return False
+
+class SQLiteStorage(BaseStorage):
+    """SQLite 後端 (資料以 JSON 存放，一個連線 + lock 供多線程共用)"""
+
+    name = "sqlite"
+
+    def __init__(self, path="chatbot.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations (user_id TEXT PRIMARY KEY, messages TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "user_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL, PRIMARY KEY (user_id, seq))"
+            )
+        print(f"✅ SQLite 儲存已開啟: {path}")
+
+    def after_fork(self):
+        # SQLite 連線不能跨 fork 共用
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def _get_json(self, sql, user_id):
+        with self._lock:
+            row = self._conn.execute(sql, (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_user(self, user_id):
+        try:
+            return self._get_json("SELECT data FROM users WHERE user_id = ?", user_id)
+        except Exception as e:
+            print(f"❌ SQLite 獲取用戶數據錯誤: {e}")
+            return None
+
+    def _update_user(self, user_id, update_fn):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")  # 讀取前就取得寫入鎖，其他進程的讀取-修改-寫入不會互相覆蓋
+            self._update_user_locked(user_id, update_fn)
+
+    def _update_user_locked(self, user_id, update_fn):
+        row = self._conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        data = json.loads(row[0]) if row else {}
+        update_fn(data)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+            (user_id, json.dumps(data, ensure_ascii=False)),
+        )
+
+    def set_user(self, user_id, data):
+        try:
+            self._update_user(user_id, lambda current: current.update(data))
+            return True
+        except Exception as e:
+            print(f"❌ SQLite 設置用戶數據錯誤: {e}")
+            return False
+
+    def clear_preferences(self, user_id):
+        try:
+            self._update_user(user_id, lambda current: current.pop("preferences", None))
+            return True
+        except Exception as e:
+            print(f"❌ SQLite 刪除用戶偏好錯誤: {e}")
+            return False
+
+    def get_messages(self, user_id, start=0):
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT message FROM messages WHERE user_id = ? AND seq >= ? ORDER BY seq", (user_id, start)
+                ).fetchall()
+            if not rows and start == 0:
+                # 舊版資料：整份對話存在 conversations 表
+                return self._get_json("SELECT messages FROM conversations WHERE user_id = ?", user_id) or []
+            return [json.loads(row[0]) for row in rows]
+        except Exception as e:
+            print(f"❌ SQLite 獲取對話記錄錯誤: {e}")
+            return []
+
+    def commit(self, writes):
+        try:
+            with self._lock, self._conn:  # 整批在同一個 transaction 中寫入
+                self._conn.execute("BEGIN IMMEDIATE")  # 分配 seq 前取得寫入鎖 (其他 worker 進程會等待)
+                for write in writes:
+                    row = self._conn.execute(
+                        "SELECT MAX(seq) FROM messages WHERE user_id = ?", (write.user_id,)
+                    ).fetchone()
+                    user = self._conn.execute("SELECT data FROM users WHERE user_id = ?", (write.user_id,)).fetchone()
+                    cursor = json.loads(user[0]).get("summary_cursor", 0) if user else 0
+                    profile, messages = write.allocate(row[0] + 1 if row[0] is not None else 0, cursor)
+                    if profile:
+                        self._update_user_locked(write.user_id, lambda current: current.update(profile))
+                    self._conn.executemany(
+                        "INSERT INTO messages (user_id, seq, message) VALUES (?, ?, ?)",
+                        [(write.user_id, seq, json.dumps(message, ensure_ascii=False)) for seq, message in messages],
+                    )
+            return True
+        except Exception as e:
+            print(f"❌ SQLite 批次寫入錯誤: {e}")
+            return False
+
+class MemoryStorage(BaseStorage):
+    """純記憶體後端 (重啟後資料消失，用於測試和壓測)
+
+    latency_ms > 0 時每次讀寫先等待這麼久，模擬 Firestore 的網路往返 (離線壓測用)。
+    """
+
+    name = "memory"
+
+    def __init__(self, latency_ms=0.0):
+        self._lock = threading.Lock()
+        self._users = {}
+        self._messages = {}  # user_id -> {seq: message}
+        self.latency = latency_ms / 1000
+
+    def _round_trip(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_user(self, user_id):
+        self._round_trip()
+        with self._lock:
+            data = self._users.get(user_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def set_user(self, user_id, data):
+        self._round_trip()
+        with self._lock:
+            self._users.setdefault(user_id, {}).update(copy.deepcopy(data))
+        return True
+
+    def clear_preferences(self, user_id):
+        self._round_trip()
+        with self._lock:
+            self._users.setdefault(user_id, {}).pop("preferences", None)
+        return True
+
+    def get_messages(self, user_id, start=0):
+        self._round_trip()
+        with self._lock:
+            messages = self._messages.get(user_id, {})
+            return [copy.deepcopy(messages[seq]) for seq in sorted(messages) if seq >= start]
+
+    def commit(self, writes):
+        self._round_trip()  # 一個 batch 只有一次往返
+        with self._lock:
+            for write in writes:
+                stored = self._messages.setdefault(write.user_id, {})
+                cursor = self._users.get(write.user_id, {}).get("summary_cursor", 0)
+                profile, messages = write.allocate(max(stored) + 1 if stored else 0, cursor)
+                if profile:
+                    self._users.setdefault(write.user_id, {}).update(copy.deepcopy(profile))
+                stored.update(copy.deepcopy(dict(messages)))
+        return True
+
+def create_storage(backend=None):
+    """依 STORAGE_BACKEND 環境變數建立儲存後端"""
+    backend = (backend or os.getenv("STORAGE_BACKEND", "firestore")).lower()
+    if backend == "firestore":
+        storage = FirestoreStorage()
+        if os.getenv("FIREBASE_CONNECTION_TEST", "0") == "1":
+            storage.test_connection()
+        return storage
+    if backend == "sqlite":
+        return SQLiteStorage(os.getenv("SQLITE_PATH", "chatbot.db"))
+    if backend == "memory":
+        return MemoryStorage(float(os.getenv("MEMORY_STORAGE_LATENCY_MS", "0")))
+    raise ValueError(f"❌ 不支援的 STORAGE_BACKEND: {backend} (可用: firestore, sqlite, memory)")
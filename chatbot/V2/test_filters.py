@@ -0,0 +1,28 @@
+from filters import parse_preferences, tag_names
+
+def parsed(text):
+    recipe_filter = parse_preferences(text)
+    return tag_names(recipe_filter.exclude_tags), list(recipe_filter.exclude_ingredients)
+
+def test_category_with_filler_words():
+    assert parsed("no dairy please") == (["dairy"], [])
+    assert parsed("I do not eat fish, eggs, too") == (["fish", "egg"], [])
+
+def test_allergy():
+    assert parsed("I'm allergic to peanuts") == (["nuts"], [])
+    assert parsed("nut allergy") == (["nuts"], [])
+
+def test_dont_like():
+    assert parsed("I don't like mushrooms") == ([], ["mushroom"])
+    assert parsed("i hate cilantro but love garlic") == ([], ["cilantro"])
+
+def test_two_word_category():
+    assert parsed("no red meat or shellfish") == (["beef", "pork", "meat", "shellfish"], [])
+
+def test_diets():
+    assert parsed("I avoid beef and pork") == (["beef", "pork"], [])
+    assert parsed("I am vegetarian") == (["beef", "pork", "poultry", "meat", "fish", "shellfish"], [])
+    assert parsed("gluten-free and no chicken broth") == (["gluten"], ["broth", "chicken"])
+
+def test_no_restrictions():
+    assert not parse_preferences("I eat everything")
@@ -0,0 +1,160 @@
+import json
+import threading
+
+import pytest
+
+from storage import ConversationWrite, MemoryStorage, SQLiteStorage
+from session import SessionCache
+from write_behind import WriteBehindQueue
+
+@pytest.fixture(params=["memory", "sqlite"])
+def open_storage(request, tmp_path):
+    """回傳建立儲存後端的函式；sqlite 每次呼叫開一個新連線 (模擬另一個 worker 進程)"""
+    if request.param == "memory":
+        storage = MemoryStorage()
+        return lambda: storage
+    return lambda: SQLiteStorage(str(tmp_path / "chatbot.db"))
+
+def stored_seqs(storage, user_id):
+    if isinstance(storage, SQLiteStorage):
+        rows = storage._conn.execute("SELECT seq FROM messages WHERE user_id = ? ORDER BY seq", (user_id,))
+        return [row[0] for row in rows]
+    return sorted(storage._messages.get(user_id, {}))
+
+def session_cache(storage, writer=None):
+    return SessionCache(storage.get_user, storage.set_user, storage.clear_preferences, storage.get_messages,
+                        storage.commit, writer=writer)
+
+def turn(text):
+    return [{"role": "user", "content": text}, {"role": "assistant", "content": f"re: {text}"}]
+
+def contents(storage, user_id, start=0):
+    return [message["content"] for message in storage.get_messages(user_id, start)]
+
+def test_concurrent_writers_get_contiguous_seqs(open_storage):
+    storages = [open_storage(), open_storage()]
+    turns = 20
+
+    def worker(n, storage):
+        cache = session_cache(storage)
+        session = cache.load("u")  # 兩個 worker 從同一個 (之後會過時的) 狀態開始
+        cache.get_conversation(session)
+        for i in range(turns):
+            assert cache.append_messages(session, turn(f"w{n}-{i}"))
+
+    threads = [threading.Thread(target=worker, args=(n, storage)) for n, storage in enumerate(storages)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    storage = storages[0]
+    total = 2 * 2 * turns
+    assert stored_seqs(storage, "u") == list(range(total))
+    assert storage.get_user("u")["message_count"] == total
+    stored = contents(storage, "u")
+    assert sorted(stored) == sorted(m["content"] for n in range(2) for i in range(turns) for m in turn(f"w{n}-{i}"))
+    for n in range(2):
+        # 每個 worker 的訊息順序不變，問答成對
+        own = [text for text in stored if text.startswith(f"w{n}-") or text.startswith(f"re: w{n}-")]
+        assert own == [m["content"] for i in range(turns) for m in turn(f"w{n}-{i}")]
+
+def test_stale_tentative_seqs_do_not_overwrite(open_storage):
+    storage = open_storage()
+    write = ConversationWrite("u", {}, {0: {"role": "user", "content": "first"}})
+    assert storage.commit([write])
+    stale = ConversationWrite("u", {}, {0: {"role": "user", "content": "second"}})
+    assert open_storage().commit([stale])
+    assert contents(storage, "u") == ["first", "second"]
+    assert storage.get_user("u")["message_count"] == 2
+
+def test_legacy_conversation_fallback(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "chatbot.db"))
+    legacy = [
+        {"role": "system", "content": "old system prompt"},
+        {"role": "user", "content": "q0"},
+        {"role": "assistant", "content": "a0"},
+    ]
+    with storage._conn:
+        storage._conn.execute("INSERT INTO conversations (user_id, messages) VALUES (?, ?)", ("u", json.dumps(legacy)))
+        storage._conn.execute("INSERT INTO users (user_id, data) VALUES (?, ?)", ("u", json.dumps({"preferences": "x"})))
+    assert storage.get_messages("u") == legacy
+
+    cache = session_cache(storage)
+    session = cache.load("u")
+    assert session.message_count is None
+    assert [m["content"] for m in cache.get_conversation(session)] == ["q0", "a0"]
+
+    # 第一次寫入時轉成逐則訊息 (系統提示不保存)
+    assert cache.append_messages(session, turn("q1"))
+    assert stored_seqs(storage, "u") == [0, 1, 2, 3]
+    assert contents(storage, "u") == ["q0", "a0", "q1", "re: q1"]
+    assert storage.get_user("u") == {"preferences": "x", "message_count": 4}
+
+def test_write_behind_overlay_returns_pending_messages(open_storage):
+    storage = open_storage()
+    writer = WriteBehindQueue(storage.commit, flush_interval_ms=60_000)
+    cache = session_cache(storage, writer)
+    try:
+        session = cache.load("u")
+        cache.append_messages(session, turn("q0"))
+        cache.append_messages(session, turn("q1"))
+        assert storage.get_messages("u") == []
+
+        # 新的 session 快取 (沒有快取的對話) 仍然讀得到佇列中的訊息
+        reader = session_cache(storage, writer)
+        pending = reader.load("u")
+        assert pending.message_count == 4
+        assert [m["content"] for m in reader.get_conversation(pending)] == ["q0", "re: q0", "q1", "re: q1"]
+
+        assert writer.flush()
+        assert contents(storage, "u") == ["q0", "re: q0", "q1", "re: q1"]
+        assert stored_seqs(storage, "u") == [0, 1, 2, 3]
+    finally:
+        writer.shutdown()
+
+def interleaved_workers(open_storage, user_id):
+    """worker A 讀取 q0, q1 之後，worker B 新增 other (seq 4, 5)，A 的快取中沒有這兩則"""
+    first, second = open_storage(), open_storage()
+    worker_a, worker_b = session_cache(first), session_cache(second)
+    worker_a.append_messages(worker_a.load(user_id), turn("q0") + turn("q1"))
+    session_a = worker_a.load(user_id)
+    worker_a.get_conversation(session_a)
+    worker_b.append_messages(worker_b.load(user_id), turn("other"))
+    return first, worker_a, session_a
+
+def test_fold_cursor_uses_committed_seq(open_storage):
+    storage, worker_a, session_a = interleaved_workers(open_storage, "u")
+    assert worker_a.append_messages(session_a, turn("q2") + turn("q3"), summary="summary", folded=4)
+    user = storage.get_user("u")
+    assert (user["summary"], user["summary_cursor"], user["message_count"]) == ("summary", 4, 10)
+    assert contents(storage, "u", user["summary_cursor"]) == ["other", "re: other", "q2", "re: q2", "q3", "re: q3"]
+
+def test_fold_is_dropped_when_other_messages_are_in_the_folded_range(open_storage):
+    # 摺疊到新的一輪 q2：(re: q2) 實際在 seq 7，但 seq 4, 5 的 other 沒有被摘要，不能跳過
+    storage, worker_a, session_a = interleaved_workers(open_storage, "u")
+    assert worker_a.append_messages(session_a, turn("q2"), summary="summary", folded=6)
+    user = storage.get_user("u")
+    assert "summary" not in user and "summary_cursor" not in user
+    assert user["message_count"] == 8
+    session_a = worker_a.load("u")
+    assert [m["content"] for m in worker_a.get_conversation(session_a)][4:] == ["other", "re: other", "q2", "re: q2"]
+
+def test_fold_is_dropped_when_another_worker_already_folded(open_storage):
+    first, second = open_storage(), open_storage()
+    worker_a, worker_b = session_cache(first), session_cache(second)
+    worker_a.append_messages(worker_a.load("u"), turn("q0") + turn("q1") + turn("q2"))
+
+    session_a, session_b = worker_a.load("u"), worker_b.load("u")
+    worker_a.get_conversation(session_a)
+    worker_b.get_conversation(session_b)
+    assert worker_b.append_messages(session_b, [], summary="summary b", folded=2)
+    assert worker_a.append_messages(session_a, [], summary="summary a", folded=4)
+
+    # worker A 的摘要根據舊的 summary_cursor 產生，不能覆寫 (q0 不會被摘要兩次)
+    user = first.get_user("u")
+    assert (user["summary"], user["summary_cursor"]) == ("summary b", 2)
+
+    # 下一次讀取時發現快取過時，從資料庫中的 summary_cursor 重新讀取
+    session_a = worker_a.load("u")
+    assert [m["content"] for m in worker_a.get_conversation(session_a)] == ["q1", "re: q1", "q2", "re: q2"]
@@ -0,0 +1,185 @@
+import os
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# -----------------------------------------
+# 🔹 請求追蹤 + Prometheus 指標
+# -----------------------------------------
+# 每個 webhook / 事件有一個 request id，熱路徑上的每個階段用 span() 計時：
+#   - 寫入目前請求的 trace (請求結束時印出一行各階段耗時)
+#   - 累計到 recipe_bot_stage_seconds{stage="..."} histogram，由 /metrics 輸出
+# log() 的流程訊息可能包含使用者 id 和訊息內容，預設不輸出 (VERBOSE_LOGGING=1 時才輸出，只用於除錯)；
+# 錯誤、警告和慢請求 (超過 SLOW_REQUEST_MS) 的 trace 一律輸出。
+VERBOSE_LOGGING = os.getenv("VERBOSE_LOGGING", "0") == "1"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "3000"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Counter:
+    """Prometheus counter (可帶 label)"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Histogram:
+    """Prometheus histogram (累計 bucket + sum + count)"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.label_names, key, [("le", f"{bound:g}")])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, label_names=()):
+        metric = Counter(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+stage_seconds = registry.histogram(
+    "recipe_bot_stage_seconds", "Duration of each hot-path stage", ["stage"])
+request_seconds = registry.histogram(
+    "recipe_bot_request_seconds", "End-to-end duration of webhook requests and events", ["kind"])
+requests_total = registry.counter(
+    "recipe_bot_requests_total", "Webhook requests and events by outcome", ["kind", "status"])
+
+# -----------------------------------------
+# 🔹 Trace / span
+# -----------------------------------------
+class Trace:
+    """一個請求 (webhook 或背景事件) 的各階段耗時"""
+
+    __slots__ = ("request_id", "kind", "start", "spans", "status")
+
+    def __init__(self, kind, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.spans = []  # (stage, 毫秒)
+        self.status = "ok"
+
+    def fail(self, status="error"):
+        self.status = status
+
+    def summary(self, total_ms):
+        stages = " ".join(f"{name}={ms:.1f}ms" for name, ms in self.spans)
+        return f"🧭 [{self.request_id}] {self.kind} {self.status} total={total_ms:.1f}ms {stages}".rstrip()
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+@contextmanager
+def trace_request(kind, request_id=None):
+    """開始追蹤一個請求 (同一個線程內的 span 會記錄到這個 trace)"""
+    trace = Trace(kind, request_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception:
+        trace.fail()
+        raise
+    finally:
+        _current_trace.reset(token)
+        seconds = time.perf_counter() - trace.start
+        request_seconds.observe(seconds, kind=kind)
+        requests_total.inc(kind=kind, status=trace.status)
+        if VERBOSE_LOGGING or seconds * 1000 >= SLOW_REQUEST_MS or trace.status != "ok":
+            print(trace.summary(seconds * 1000))
+
+@contextmanager
+def span(stage):
+    """計時一個階段 (沒有進行中的 trace 時只記錄 histogram)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stage_seconds.observe(seconds, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((stage, seconds * 1000))
+
+def current_trace():
+    return _current_trace.get()
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+def log(message):
+    """一般的流程訊息 (VERBOSE_LOGGING=0 時不輸出)，加上 request id 方便對照"""
+    if not VERBOSE_LOGGING:
+        return
+    request_id = current_request_id()
+    print(f"[{request_id}] {message}" if request_id else message)
+
+def render_metrics():
+    return registry.render()
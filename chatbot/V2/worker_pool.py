@@ -0,0 +1,123 @@
+import time
+import threading
+from collections import deque
+
+class EventWorkerPool:
+    """有上限的事件佇列 + 固定數量的背景 worker 線程
+
+    submit_all 在佇列容量不足時會等待 enqueue_timeout 秒，仍然不足就整批拒絕 (回傳 False)，
+    讓呼叫端回應 503，由 LINE 重送，而不是無限制地堆積請求。
+    """
+
+    def __init__(self, handle_fn, workers=4, max_queue=100, enqueue_timeout=0.5, name="worker"):
+        self.handle_fn = handle_fn
+        self.workers = workers
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.name = name
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._started = False
+        self._stopping = False
+
+        # 統計
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        """啟動 worker 線程 (可重複呼叫；需在 fork 之後的進程中啟動)"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            self._stopping = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        print(f"✅ 啟動 {self.workers} 個 {self.name} 線程 (佇列上限 {self.max_queue})")
+
+    def submit_all(self, items):
+        """整批加入佇列；容量不足且等待逾時時整批拒絕"""
+        items = list(items)
+        if not items:
+            return True
+        self.start()
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self._cond:
+            while len(self._queue) + len(items) > self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += len(items)
+                    return False
+                self._cond.wait(remaining)
+            now = time.monotonic()
+            for item in items:
+                self._queue.append((item, now))
+            self.enqueued += len(items)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if self._stopping and not self._queue:
+                    return
+                item, enqueued_at = self._queue.popleft()
+                wait = time.monotonic() - enqueued_at
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.in_flight += 1
+                # 通知等待空間的 submit_all
+                self._cond.notify_all()
+
+            try:
+                self.handle_fn(item)
+                ok = True
+            except Exception as e:
+                print(f"❌ {self.name} 處理事件失敗: {e}")
+                ok = False
+
+            with self._cond:
+                self.in_flight -= 1
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+
+    def shutdown(self, timeout=10):
+        """處理完佇列中剩餘的事件後停止 worker"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._started = False
+
+    def stats(self):
+        with self._cond:
+            dequeued = self.processed + self.failed + self.in_flight
+            return {
+                "workers": self.workers,
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "max_depth": self.max_depth,
+                "in_flight": self.in_flight,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait / dequeued * 1000, 2) if dequeued else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+            }
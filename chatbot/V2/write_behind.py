@@ -0,0 +1,155 @@
+import time
+import threading
+
+class WriteBehindQueue:
+    """對話記錄的 write-behind 佇列：回覆路徑只把更新放進佇列，背景線程批次寫入資料庫
+
+    - 同一使用者尚未寫入的更新會合併 (使用者資料取最新值，訊息依序號合併)
+    - 每 flush_interval_ms 或待寫入的使用者達到 max_batch 時，以一次 commit_fn(writes) 寫入
+    - commit_fn 回傳 False 或拋出例外時，這批更新放回佇列，下一輪重試
+    - pending() 讓同一進程內的讀取看得到尚未寫入的更新 (read-your-writes)
+    - shutdown() 在進程結束前寫入剩餘的更新
+    """
+
+    def __init__(self, commit_fn, flush_interval_ms=1000, max_batch=100, name="write-behind"):
+        self.commit_fn = commit_fn
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.name = name
+        self._pending = {}   # user_id -> ConversationWrite
+        self._inflight = {}  # 正在寫入的批次
+        self._cond = threading.Condition()
+        self._thread = None
+        self._flush_requested = False
+        self._stopping = False
+
+        # 統計
+        self.enqueued = 0
+        self.coalesced = 0
+        self.commits = 0
+        self.written = 0
+        self.messages_written = 0
+        self.failed_commits = 0
+        self.max_pending = 0
+
+    def _start(self):
+        # 第一次 enqueue 時才啟動線程 (在 fork 之後的進程中)
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def enqueue(self, write):
+        with self._cond:
+            self._start()
+            pending = self._pending.get(write.user_id)
+            if pending is None:
+                self._pending[write.user_id] = write
+            else:
+                pending.merge(write)
+                self.coalesced += 1
+            self.enqueued += 1
+            self.max_pending = max(self.max_pending, len(self._pending))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify_all()  # 開始計時 / 湊滿一批
+
+    def pending(self, user_id):
+        """尚未寫入資料庫的 (使用者資料, {seq: message})，沒有時回傳 None"""
+        with self._cond:
+            writes = [w for w in (self._inflight.get(user_id), self._pending.get(user_id)) if w is not None]
+            if not writes:
+                return None
+            profile, messages = {}, {}
+            for write in writes:  # 正在寫入的較舊，待寫入的較新
+                profile.update(write.profile)
+                messages.update(write.messages)
+            return profile, messages
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            # 第一筆更新最多等 flush_interval，期間同一使用者的更新會合併
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.max_batch and not self._stopping and not self._flush_requested:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._flush_requested = False
+            user_ids = list(self._pending)[:self.max_batch]
+            self._inflight = {user_id: self._pending.pop(user_id) for user_id in user_ids}
+            return list(self._inflight.values())
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return  # 停止中且沒有待寫入的更新
+            try:
+                ok = self.commit_fn(batch)
+            except Exception as e:
+                print(f"❌ {self.name} 寫入失敗: {e}")
+                ok = False
+            with self._cond:
+                if ok:
+                    self.commits += 1
+                    self.written += len(batch)
+                    self.messages_written += sum(len(write.messages) for write in batch)
+                else:
+                    # 放回佇列 (之後的更新較新，合併在舊的之上)
+                    self.failed_commits += 1
+                    for write in batch:
+                        newer = self._pending.get(write.user_id)
+                        if newer is not None:
+                            write.merge(newer)
+                        self._pending[write.user_id] = write
+                self._inflight = {}
+                self._cond.notify_all()
+                if self._stopping and not ok:
+                    return  # 結束時不無限重試
+
+    def flush(self, timeout=10):
+        """立即寫入所有待寫入的更新，等到完成或逾時；全部寫入時回傳 True"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                return not self._pending
+            while self._pending or self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._flush_requested = True
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+            return True
+
+    def shutdown(self, timeout=10):
+        """寫入剩餘的更新後停止背景線程 (atexit 時呼叫)"""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._pending:
+            print(f"⚠️ {self.name}: 結束時仍有 {len(self._pending)} 位使用者的更新未寫入")
+        elif self.written:
+            print(f"✅ {self.name}: 已寫入所有對話更新")
+        self._thread = None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "flush_interval_ms": round(self.flush_interval * 1000, 1),
+                "max_batch": self.max_batch,
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "commits": self.commits,
+                "written": self.written,
+                "messages_written": self.messages_written,
+                "failed_commits": self.failed_commits,
+                "avg_batch_size": round(self.written / self.commits, 2) if self.commits else 0.0,
+            }